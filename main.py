@@ -1,7 +1,10 @@
 import os
 from website import create_app, socketio
 
-app = create_app()
+# Процессы пула рендера экспорта (spawn) импортируют этот модуль как __mp_main__:
+# приложение в них не создается - рабочим процессам нужны только функции рендера
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     socketio.run(app, 
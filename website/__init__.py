@@ -6,12 +6,12 @@ from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, current_user
 from flask_migrate import Migrate
 from flask_babel import Babel, format_date
-from .completion_db import create_database
 from flask_wtf.csrf import CSRFProtect
 from flask_talisman import Talisman
 from flask_admin import Admin
 
 import os
+import click
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -66,6 +66,28 @@ def create_app():
         BABEL_DEFAULT_LOCALE = 'ru',
 
         SEND_FILE_MAX_AGE_DEFAULT=0,  # Отключить кэширование в разработке
+        STATUS_COUNTS_CACHE_TTL=60,  # Время жизни кэша счетчиков статусов, сек
+        ADMIN_STATS_CACHE_TTL=60,  # Время жизни статистики главной страницы админ-панели, сек
+        EXPORT_JOB_THRESHOLD=20,  # С какого числа планов экспорт уходит в фоновое задание
+        EXPORT_JOBS_WORKERS=2,
+        EXPORT_JOBS_TTL=3600,  # Время хранения готовых архивов, сек
+        REFERENCE_CACHE_CHECK_INTERVAL=5,  # Как часто воркер сверяет поколение справочников, сек
+        EXPORT_PROCESSES=min(4, os.cpu_count() or 1),  # Процессы рендера пакетного XLSX/PDF, 1 - без пула
+
+        MAIL_TRANSPORT=os.getenv('MAIL_TRANSPORT', 'smtp'),  # 'memory' - локальная заглушка вместо SMTP
+        MAIL_SERVER='smtp.gmail.com',
+        MAIL_PORT=587,
+        MAIL_USE_TLS=True,
+        MAIL_USERNAME=os.getenv('EMAILNAME'),
+        MAIL_PASSWORD=os.getenv('EMAILPASS'),
+        MAIL_IDLE_TIMEOUT=60,  # Через сколько секунд простоя закрывать SMTP-соединение
+        MAIL_POLL_INTERVAL=30,  # Как часто поток отправки проверяет отложенные письма, сек
+        MAIL_MAX_ATTEMPTS=5,
+        MAIL_SENDING_TIMEOUT=300,  # Через сколько секунд письмо, зависшее в sending, отправляется повторно
+        MAIL_RETRY_BASE_DELAY=30,  # Задержка повтора: 30, 60, 120 ... сек
+        MAIL_RETRY_MAX_DELAY=3600,
+        NOTIFICATIONS_RETENTION_DAYS=180,  # Прочитанные уведомления старше - в архив
+        INIT_DB_ON_START=os.getenv('INIT_DB_ON_START') == '1',  # Иначе схема и справочники - командой flask init-db
     )
 
     db.init_app(app)
@@ -86,8 +108,10 @@ def create_app():
     app.register_blueprint(views, url_prefix='/')
     app.register_blueprint(auth, url_prefix='/')
 
-    with app.app_context():
-        db.create_all()
+    from . import events
+
+    if app.config['INIT_DB_ON_START']:
+        from .completion_db import create_database
         create_database(app, db)
 
     from .admin_views import (
@@ -142,6 +166,73 @@ def create_app():
     def load_user(user_id):
         return User.query.get(int(user_id))
     
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Создание таблиц, досоздание индексов и первичное заполнение справочников"""
+        from .completion_db import create_database
+        create_database(app, db)
+
+    @app.cli.command('load-registry')
+    def load_registry_command():
+        """Загрузка (повторная) реестра организаций и министерств из DBF в static/files"""
+        from .plans.registry import load_registry
+        from .plans.rollups import rebuild_rollups
+        summary = load_registry()
+        db.session.commit()
+        print(summary)
+        if summary['organizations_moved']:
+            rebuild_rollups()
+            print(f"Организаций сменили министерство: {summary['organizations_moved']}, сводки пересчитаны")
+
+    @app.cli.command('sync-registry')
+    @click.option('--organizations', '-o', multiple=True, type=click.Path(exists=True, dir_okay=False),
+                  help='DBF организаций (OKPO, NAME, MIN, UNP); по умолчанию - static/files/organizations')
+    @click.option('--ministries', '-m', multiple=True, type=click.Path(exists=True, dir_okay=False),
+                  help='DBF министерств (MIN, NAME); по умолчанию - static/files/ministerstvo')
+    @click.option('--dry-run', is_flag=True, help='Только показать изменения')
+    def sync_registry_command(organizations, ministries, dry_run):
+        """Инкрементальная синхронизация реестра с новой выгрузкой DBF"""
+        from .plans.registry import MINISTRY_FILES, ORGANIZATION_FILES, sync_registry
+        from .plans.rollups import rebuild_rollups
+        summary = sync_registry(organizations or ORGANIZATION_FILES, ministries or MINISTRY_FILES, dry_run)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        for table, changes in summary.items():
+            print(f"{table}: " + ", ".join(f"{name}={count}" for name, count in changes.items()))
+        moved = summary['organizations']['moved']
+        if moved and not dry_run:
+            rebuild_rollups()
+            print(f"Организаций сменили министерство: {moved}, сводки пересчитаны")
+        elif moved:
+            print(f"Организаций сменят министерство: {moved}, сводки будут пересчитаны")
+
+    @app.cli.command('rebuild-rollups')
+    def rebuild_rollups_command():
+        """Полный пересчет сводок и счетчиков статусов по министерствам и регионам"""
+        from .plans.rollups import rebuild_rollups
+        rebuild_rollups()
+
+    @app.cli.command('archive-notifications')
+    def archive_notifications_command():
+        """Перенос старых прочитанных уведомлений в архив и пересчет счетчиков непрочитанных"""
+        from .plans.notifications import archive_notifications, sync_unread_counters
+        moved = archive_notifications(app.config['NOTIFICATIONS_RETENTION_DAYS'])
+        sync_unread_counters()
+        db.session.commit()
+        print(f"Перенесено в архив: {moved}")
+
+    @app.cli.command('send-mail')
+    def send_mail_command():
+        """Отправка писем из очереди, срок которых наступил"""
+        from .user.mail import TRANSPORTS, deliver_pending
+        transport = TRANSPORTS[app.config['MAIL_TRANSPORT']](app.config)
+        try:
+            print(f"Отправлено писем: {deliver_pending(app, transport)}")
+        finally:
+            transport.close()
+
     @app.errorhandler(404)
     def page_not_found(e):
         return render_template('404.html', hide_header=True), 404
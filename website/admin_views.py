@@ -11,6 +11,13 @@ from flask import flash, redirect, url_for, current_app, request
 from functools import wraps
 from datetime import datetime, timedelta
 from website import db
+from website.plans.status import invalidate_status_counts
+from website.plans.reference import bump_reference_generation
+from website.plans.rollups import (
+    plan_rollup_groups, refresh_rollup_groups, stored_organization_rollup_groups, stored_plan_rollup_groups
+)
+from website.plans.notifications import sync_unread_counters
+from website.plans.admin_stats import ADMIN_STATS_KEYS, get_admin_stats
 from wtforms.validators import DataRequired, Email, Length, Optional, NumberRange
 from wtforms import PasswordField, SelectField, FloatField, IntegerField
 from werkzeug.security import generate_password_hash
@@ -41,45 +48,10 @@ class MyMainView(AdminIndexView):
     def index(self):
         """Главная страница админ-панели со статистикой"""
         try:
-            user_data = User.query.count()
-            organization_data = Organization.query.count()
-            
-            now = current_utc_time()
-            threshold = now - timedelta(minutes=3)
-            active_users = User.query.filter(User.last_active >= threshold).count()
-            
-            week_ago = now - timedelta(days=7)
-            new_users = User.query.filter(User.begin_time >= week_ago).count()
-            
-            admins_count = User.query.filter_by(is_admin=True).count()
-            auditors_count = User.query.filter_by(is_auditor=True).count()
-            respondents_count = User.query.filter(
-                User.is_admin == False, 
-                User.is_auditor == False
-            ).count()
-            
-            orgs_with_users = db.session.query(Organization).join(User).distinct().count()
-            
-            plan_data = Plan.query.count()
-            draft_plans = Plan.query.filter_by(is_draft=True).count()
-            approved_plans = Plan.query.filter_by(is_approved=True).count()
-            
-            tickets_count = Ticket.query.count()
-            units_count = Unit.query.count()
-            directions_count = Direction.query.count()
-            measures_count = EconMeasure.query.count()
-            execs_count = EconExec.query.count()
-            indicators_count = Indicator.query.count()
-            usages_count = IndicatorUsage.query.count()
-            notifications_count = Notification.query.count()
-            
+            stats = get_admin_stats()
         except SQLAlchemyError as e:
             current_app.logger.error(f"Database error in admin stats: {str(e)}")
-            user_data = organization_data = active_users = new_users = 0
-            admins_count = auditors_count = respondents_count = orgs_with_users = 0
-            plan_data = draft_plans = approved_plans = 0
-            tickets_count = units_count = directions_count = measures_count = 0
-            execs_count = indicators_count = usages_count = notifications_count = 0
+            stats = dict.fromkeys(ADMIN_STATS_KEYS, 0)
             flash('Ошибка при получении статистики из базы данных', 'error')
 
         endpoints = {
@@ -97,25 +69,7 @@ class MyMainView(AdminIndexView):
         }
 
         return self.render('admin/stats.html', 
-                        user_data=user_data,
-                        organization_data=organization_data,
-                        active_users=active_users,
-                        new_users=new_users,
-                        admins_count=admins_count,
-                        auditors_count=auditors_count,
-                        respondents_count=respondents_count,
-                        orgs_with_users=orgs_with_users,
-                        plan_data=plan_data,
-                        draft_plans=draft_plans,
-                        approved_plans=approved_plans,
-                        tickets_count=tickets_count,
-                        units_count=units_count,
-                        directions_count=directions_count,
-                        measures_count=measures_count,
-                        execs_count=execs_count,
-                        indicators_count=indicators_count,
-                        usages_count=usages_count,
-                        notifications_count=notifications_count,
+                        **stats,
                         profile_url=url_for('views.profile'),
                         current_time=datetime.utcnow(),
                         endpoints=endpoints
@@ -375,6 +329,18 @@ class OrganizationView(SecureModelView):
             'description': 'Активна ли организация'
         }
     }
+
+    def on_model_change(self, form, model, is_created):
+        # смена министерства или ОКПО (региона) переносит планы организации в другие группы
+        model._rollup_groups = [] if is_created else stored_organization_rollup_groups(model.id)
+
+    def after_model_change(self, form, model, is_created):
+        """Пересчет прежних и новых групп сводок планов организации"""
+        old_groups = set(getattr(model, '_rollup_groups', []))
+        new_groups = set(stored_organization_rollup_groups(model.id))
+        if old_groups != new_groups:
+            refresh_rollup_groups(old_groups | new_groups)
+            db.session.commit()
     
     column_searchable_list = ['name', 'okpo', 'ynp', 'ministry_id']
     column_filters = ['id', 'is_active', 'ministry_id']
@@ -430,6 +396,24 @@ class PlanView(SecureModelView):
         'user': lambda v, c, m, p: f"{m.user.last_name} {m.user.first_name}" if m.user else ''
     }
 
+    def on_model_change(self, form, model, is_created):
+        # прежние группы: при смене года или организации план уходит из них
+        model._rollup_groups = [] if is_created else stored_plan_rollup_groups(model.id)
+
+    def after_model_change(self, form, model, is_created):
+        """Сброс кэша счетчиков статусов и пересчет сводок после изменения плана"""
+        invalidate_status_counts(model.user_id)
+        refresh_rollup_groups(getattr(model, '_rollup_groups', []) + plan_rollup_groups(model))
+        db.session.commit()
+
+    def on_model_delete(self, model):
+        model._rollup_groups = plan_rollup_groups(model)
+
+    def after_model_delete(self, model):
+        invalidate_status_counts(model.user_id)
+        refresh_rollup_groups(getattr(model, '_rollup_groups', []))
+        db.session.commit()
+
 class TicketView(SecureModelView):
     """Админ-панель для управления тикетами"""
     
@@ -474,7 +458,16 @@ class TicketView(SecureModelView):
         'plan': lambda v, c, m, p: f"План #{m.plan.id} ({m.plan.organization.name})" if m.plan else ''
     }
 
-class UnitView(SecureModelView):
+class ReferenceModelView(SecureModelView):
+    """Справочники: после изменения сбрасывается кэш справочников во всех воркерах"""
+
+    def after_model_change(self, form, model, is_created):
+        bump_reference_generation()
+
+    def after_model_delete(self, model):
+        bump_reference_generation()
+
+class UnitView(ReferenceModelView):
     """Админ-панель для управления единицами измерения"""
     
     column_list = ['id', 'code', 'name']
@@ -504,7 +497,7 @@ class UnitView(SecureModelView):
     column_searchable_list = ['code', 'name']
     column_filters = ['id', 'code']
 
-class DirectionView(SecureModelView):
+class DirectionView(ReferenceModelView):
     """Админ-панель для управления направлениями"""
     
     column_list = ['id', 'code', 'name', 'unit', 'is_local', 'DateStart', 'DateEnd']
@@ -597,7 +590,36 @@ class EconMeasureView(SecureModelView):
         'direction': lambda v, c, m, p: f"{m.direction.code} - {m.direction.name}" if m.direction else ''
     }
 
-class EconExecView(SecureModelView):
+class PlanRowRollupsMixin:
+    """Пересчет сводок утвержденных планов после правки строк плана в админ-панели"""
+
+    def _stored_groups(self, model):
+        with db.session.no_autoflush:
+            plan_id = db.session.query(self.model.id_plan).filter(self.model.id == model.id).scalar()
+        return stored_plan_rollup_groups(plan_id, approved_only=True)
+
+    def on_model_change(self, form, model, is_created):
+        # строку могли перенести в другой план - прежний план тоже пересчитывается
+        model._rollup_groups = [] if is_created else self._stored_groups(model)
+
+    def after_model_change(self, form, model, is_created):
+        groups = list(getattr(model, '_rollup_groups', []))
+        if model.plan is not None and model.plan.is_approved:
+            groups += plan_rollup_groups(model.plan)
+        if groups:
+            refresh_rollup_groups(groups)
+            db.session.commit()
+
+    def on_model_delete(self, model):
+        model._rollup_groups = self._stored_groups(model)
+
+    def after_model_delete(self, model):
+        groups = getattr(model, '_rollup_groups', [])
+        if groups:
+            refresh_rollup_groups(groups)
+            db.session.commit()
+
+class EconExecView(PlanRowRollupsMixin, SecureModelView):
     """Админ-панель для управления экономическими исполнениями"""
     
     column_list = ['id', 'plan', 'econ_measures', 'name', 'Volume', 'EffTut', 'EffRub',
@@ -645,7 +667,7 @@ class EconExecView(SecureModelView):
         'econ_measures': lambda v, c, m, p: f"Мера #{m.econ_measures.id}" if m.econ_measures else ''
     }
 
-class IndicatorView(SecureModelView):
+class IndicatorView(ReferenceModelView):
     """Админ-панель для управления показателями"""
     
     column_list = ['id', 'code', 'name', 'unit', 'CoeffToTut', 'IsMandatory', 'Group', 'RowN', 'DateStart', 'DateEnd']
@@ -690,7 +712,7 @@ class IndicatorView(SecureModelView):
         'unit': lambda v, c, m, p: f"{m.unit.code} ({m.unit.name})" if m.unit else ''
     }
 
-class IndicatorUsageView(SecureModelView):
+class IndicatorUsageView(PlanRowRollupsMixin, SecureModelView):
     """Админ-панель для управления использованием показателей"""
     
     column_list = ['id', 'plan', 'indicator', 'QYearPrev', 'QYearCurr', 'QYearNext']
@@ -759,4 +781,13 @@ class NotificationView(SecureModelView):
         'is_read': lambda v, c, m, p: '✅ Да' if m.is_read else '❌ Нет',
         'created_at': lambda v, c, m, p: m.created_at.strftime('%d.%m.%Y %H:%M') if m.created_at else '',
         'user': lambda v, c, m, p: f"{m.user.email}" if m.user else ''
-    }
\ No newline at end of file
+    }
+
+    def after_model_change(self, form, model, is_created):
+        """Счетчик непрочитанных пользователя после правки уведомления"""
+        sync_unread_counters(model.user_id)
+        db.session.commit()
+
+    def after_model_delete(self, model):
+        sync_unread_counters(model.user_id)
+        db.session.commit()
\ No newline at end of file
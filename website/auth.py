@@ -164,6 +164,7 @@ def resend_code():
         email = session.get('temp_user', {}).get('email')
         if email:
             send_activation_email(email)
+            db.session.commit()
             flash('Новый код подтверждения отправлен на вашу почту', 'success')
         else:
             flash('Ошибка: email не найден', 'error')
@@ -243,11 +244,12 @@ def forgot_password():
 
             user.reset_password_token = token
             user.reset_password_expires = datetime.utcnow() + timedelta(hours=1)
-            db.session.commit()
             
             reset_url = url_for('auth.reset_password', token=token, _external=True)
             
+            # токен и письмо со ссылкой сохраняются одним коммитом
             mes_on_email(reset_url, email, 'reset_link')
+            db.session.commit()
      
         flash('Если email зарегистрирован, на него будет отправлена ссылка для сброса пароля', 'success')
         return redirect(url_for('auth.forgot_password'))
@@ -1,6 +1,4 @@
 import os
-from dbfread import DBF
-import pandas as pd
 from werkzeug.security import generate_password_hash
 
 def create_database(app, db):
@@ -8,26 +6,59 @@ def create_database(app, db):
     with app.app_context():
         # db.drop_all()
         db.create_all()
+        upgrade_schema(db)
         add_data_in_db(db)
+
+def upgrade_schema(db):
+    """
+    Досоздает столбцы и индексы, которые db.create_all не добавляет в уже
+    существующие таблицы. Все операции идемпотентны.
+    """
+    from sqlalchemy import text
+    from .models import REGION_DIGIT_SQL
+
+    statements = [
+        f"ALTER TABLE organizations ADD COLUMN IF NOT EXISTS region_digit VARCHAR(1) "
+        f"GENERATED ALWAYS AS ({REGION_DIGIT_SQL}) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_organizations_region_digit ON organizations (region_digit)",
+        "CREATE INDEX IF NOT EXISTS ix_plans_org_id ON plans (org_id)",
+        # поиск для подсказок ввода (website/plans/search.py)
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_organizations_name_trgm ON organizations USING gin (name gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_organizations_name_prefix ON organizations (lower(name) text_pattern_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_organizations_okpo_prefix ON organizations (okpo text_pattern_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_organizations_ynp ON organizations (ynp)",
+        "CREATE INDEX IF NOT EXISTS ix_ministries_name_trgm ON ministries USING gin (name gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_ministries_name_prefix ON ministries (lower(name) text_pattern_ops)",
+        # уведомления (website/plans/notifications.py): составной индекс заменяет индекс по user_id
+        "CREATE INDEX IF NOT EXISTS ix_notifications_user_read_created "
+        "ON notifications (user_id, is_read, created_at)",
+        "DROP INDEX IF EXISTS ix_notifications_user_id",
+    ]
+    counter_exists = db.session.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'users' AND column_name = 'unread_notifications'"
+    )).first()
+    if not counter_exists:
+        statements += [
+            "ALTER TABLE users ADD COLUMN unread_notifications INTEGER NOT NULL DEFAULT 0",
+            "UPDATE users SET unread_notifications = n.unread FROM ("
+            "SELECT user_id, count(*) AS unread FROM notifications WHERE NOT is_read GROUP BY user_id"
+            ") n WHERE n.user_id = users.id",
+        ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
         
 def is_db_empty():
-    from .models import User, Organization, Plan, Ticket, Ticket, Unit, Direction, Indicator, EconExec, EconMeasure
-    return all([
-        User.query.count() == 0,
-        Organization.query.count() == 0,
-        Plan.query.count() == 0,
-        Ticket.query.count() == 0,
-        Unit.query.count() == 0,
-        Indicator.query.count() == 0,
-        Unit.query.count() == 0,
-    ])
-        
-def read_dbf(file_path, columns):
-    data = []
-    for record in DBF(file_path):
-        row = {col: record[col] for col in columns}
-        data.append(row)
-    return data      
+    """Пустая ли база: один запрос EXISTS вместо COUNT(*) по каждой таблице"""
+    from sqlalchemy import exists, or_, select
+    from . import db
+    from .models import User, Organization, Plan, Ticket, Unit, Indicator
+    has_rows = db.session.execute(select(or_(*[
+        exists().select_from(model) for model in (User, Organization, Plan, Ticket, Unit, Indicator)
+    ]))).scalar()
+    return not has_rows
         
 def add_data_in_db(db):
     if is_db_empty():
@@ -36,77 +67,12 @@ def add_data_in_db(db):
         print('Filling is in progress...')
         
         ### ORGANIZATION DATA ###
-        website_path = os.path.dirname(os.path.abspath(__file__))
-    
-        Brest_org_data_path = os.path.join(website_path, 'static/files/organizations', 'Брест.dbf')
-        Vitebsk_org_data_path = os.path.join(website_path, 'static/files/organizations', 'Витебск.dbf')
-        Gomel_org_data_path = os.path.join(website_path, 'static/files/organizations', 'Гомель.dbf')
-        Grodno_org_data_path = os.path.join(website_path, 'static/files/organizations', 'Гродно.dbf')
-        Minsk_org_data_path = os.path.join(website_path, 'static/files/organizations', 'Минск.dbf')
-        MinskRegion_org_data_path = os.path.join(website_path, 'static/files/organizations', 'Минск_область.dbf')
-        Migilev_org_data_path = os.path.join(website_path, 'static/files/organizations', 'Могилев.dbf')
-
-        columns_org = ['OKPO', 'NAME', 'MIN', 'UNP']
-
-        Brest_org_data = read_dbf(Brest_org_data_path, columns_org)
-        Vitebsk_org_data = read_dbf(Vitebsk_org_data_path, columns_org)
-        Gomel_org_data = read_dbf(Gomel_org_data_path, columns_org)
-        Grodno_org_data = read_dbf(Grodno_org_data_path, columns_org)
-        Minsk_org_data = read_dbf(Minsk_org_data_path, columns_org)
-        MinskRegion_org_data = read_dbf(MinskRegion_org_data_path, columns_org)
-        Migilev_org_data = read_dbf(Migilev_org_data_path, columns_org)
-
-        city_all_data = pd.concat([
-            pd.DataFrame(Brest_org_data, columns=columns_org),
-            pd.DataFrame(Vitebsk_org_data, columns=columns_org),
-            pd.DataFrame(Gomel_org_data, columns=columns_org),
-            pd.DataFrame(Grodno_org_data, columns=columns_org),
-            pd.DataFrame(Minsk_org_data, columns=columns_org),
-            pd.DataFrame(MinskRegion_org_data, columns=columns_org),
-            pd.DataFrame(Migilev_org_data, columns=columns_org)
-        ], ignore_index=True)
-
-        MinskRegion_min_data_path = os.path.join(website_path, 'static/files/ministerstvo', 'MinskReg_min.dbf')
-        columns_min = ['MIN', 'NAME']
-        MinskRegion_min_data = read_dbf(MinskRegion_min_data_path, columns_min)
-
-        min_all_data = pd.DataFrame(MinskRegion_min_data, columns=columns_min)
-
-        ministries_dict = {}
-
-        for _, row in min_all_data.drop_duplicates('MIN').iterrows():
-            ministry = Ministry.query.filter_by(id=row['MIN']).first()
-            
-            if not ministry:
-                ministry = Ministry(
-                    id=row['MIN'],
-                    name=row['NAME']
-                )
-                db.session.add(ministry)
-            
-            ministries_dict[row['MIN']] = ministry
-
-        db.session.commit()
-
-        for _, row in city_all_data.iterrows():
-            organization_name = ' '.join(filter(None, [
-                row['NAME']
-            ]))
-            
-            existing_org = Organization.query.filter_by(okpo=row['OKPO']).first()
-            
-            if not existing_org:
-                organization = Organization(
-                    okpo=row['OKPO'],
-                    name=organization_name,
-                    ministry_id=row['MIN'], 
-                    ynp=row['UNP']
-                )
-                db.session.add(organization)
+        from .plans.registry import SERVICE_ORGANIZATIONS, load_registry
 
         try:
+            summary = load_registry()
             db.session.commit()
-            print("The data has been successfully added to the database")
+            print(f"The data has been successfully added to the database: {summary}")
         except IntegrityError as e:
             db.session.rollback()
             print(f"Data integrity error: {e}")
@@ -114,18 +80,7 @@ def add_data_in_db(db):
             db.session.rollback()
             print(f"An error has occurred: {e}")
 
-        dop_org_data = [
-            ('Брестское областное управление', '100000001000'),
-            ('Витебское областное управление', '200000002000'),
-            ('Гомельское областное управление', '300000003000'),
-            ('Гродненское областное управление', '400000004000'),
-            ('Управление г. Минск', '500000005000'),
-            ('Минское областное управление', '600000006000'),
-            ('Могилевское областное управление', '700000007000'),
-            ('Департамент по энергоэффективности', '800000008000'),
-        ]
-
-        for name, okpo in dop_org_data:
+        for name, okpo in SERVICE_ORGANIZATIONS:
             dop_org = Organization(name=name, okpo=str(okpo)) 
             db.session.add(dop_org)
         db.session.commit()
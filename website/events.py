@@ -0,0 +1,16 @@
+from flask_login import current_user
+from flask_socketio import join_room
+
+from . import socketio
+
+
+def user_room(user_id):
+    """Комната Socket.IO конкретного пользователя"""
+    return f"user_{user_id}"
+
+
+@socketio.on('connect')
+def handle_connect():
+    if not current_user.is_authenticated:
+        return False
+    join_room(user_room(current_user.id))
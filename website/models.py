@@ -10,6 +10,8 @@ def to_decimal_3(value):
     except (InvalidOperation, TypeError, ValueError):
         return Decimal('0.000')
 
+REGION_DIGIT_SQL = "substr(okpo, length(okpo) - 3, 1)"
+
 def current_utc_time():
     return datetime.utcnow() + timedelta(hours=3)
 
@@ -35,6 +37,9 @@ class User(db.Model, UserMixin):
     
     plan_type = db.Column(db.String(50), nullable=True)  # 'org_small', 'org_large', 'ministry', 'region'
         
+    # Число непрочитанных уведомлений; поддерживается website/plans/notifications.py
+    unread_notifications = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     reset_password_token = db.Column(db.String(255), nullable=True)
     reset_password_expires = db.Column(db.DateTime, nullable=True)
     
@@ -86,6 +91,13 @@ class Organization(db.Model):
     ynp = db.Column(db.String(), nullable=True)
     ministry_id = db.Column(db.Integer, db.ForeignKey('ministries.id'))
     is_active = db.Column(db.Boolean, default=True)
+
+    # Цифра региона - 4-я с конца в ОКПО, вычисляется БД и индексируется для выборок аудиторов
+    region_digit = db.Column(
+        db.String(1),
+        db.Computed(REGION_DIGIT_SQL, persisted=True),
+        index=True
+    )
     
     ministry = db.relationship("Ministry", back_populates="organizations")
     
@@ -126,7 +138,7 @@ class Plan(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id')) 
     
     ministry_id = db.Column(db.Integer, db.ForeignKey('ministries.id'))
-    org_id = db.Column(db.Integer, db.ForeignKey('organizations.id'))  
+    org_id = db.Column(db.Integer, db.ForeignKey('organizations.id'), index=True)
     region_id = db.Column(db.Integer, db.ForeignKey('regions.id'))
  
     afch = db.Column(db.Boolean, default=False)
@@ -300,9 +312,116 @@ class IndicatorUsage(db.Model):
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        db.Index('ix_notifications_user_read_created', 'user_id', 'is_read', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     message = db.Column(db.String(140), nullable=False)
     is_read = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=current_utc_time)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=current_utc_time)
+
+class NotificationArchive(db.Model):
+    """Прочитанные уведомления старше NOTIFICATIONS_RETENTION_DAYS"""
+    __tablename__ = 'notifications_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, index=True, nullable=False)
+    message = db.Column(db.String(140), nullable=False)
+    is_read = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=current_utc_time)
+
+class IndicatorRollup(db.Model):
+    """Сводные показатели утвержденных планов организаций по министерству/региону и году"""
+    __tablename__ = 'indicator_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'scope_key', 'year', 'id_indicator', name='uq_indicator_rollup'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(10), nullable=False)  # 'ministry', 'region'
+    scope_key = db.Column(db.String(20), nullable=False)  # id министерства или цифра региона из ОКПО
+    year = db.Column(db.Integer, nullable=False)
+    id_indicator = db.Column(db.Integer, db.ForeignKey('indicators.id'), nullable=False)
+
+    QYearPrev = db.Column(Numeric(scale=3))
+    QYearCurr = db.Column(Numeric(scale=3))
+    QYearNext = db.Column(Numeric(scale=3))
+    plans_count = db.Column(db.Integer, default=0)
+    refreshed_at = db.Column(db.DateTime, default=current_utc_time)
+
+    indicator = db.relationship("Indicator")
+
+class EconExecRollup(db.Model):
+    """Сводные мероприятия утвержденных планов по направлению и кварталу внедрения"""
+    __tablename__ = 'econ_exec_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'scope_key', 'year', 'id_direction', 'quarter', 'is_local',
+                            name='uq_econ_exec_rollup'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(10), nullable=False)
+    scope_key = db.Column(db.String(20), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    id_direction = db.Column(db.Integer, db.ForeignKey('directions.id'), nullable=False)
+    quarter = db.Column(db.Integer)
+    is_local = db.Column(db.Boolean)
+
+    execs_count = db.Column(db.Integer, default=0)
+    EffTut = db.Column(Numeric(scale=3))
+    EffRub = db.Column(Numeric(scale=3))
+    EffCurrYear = db.Column(Numeric(scale=3))
+    VolumeFin = db.Column(Numeric(scale=3))
+    BudgetState = db.Column(Numeric(scale=3))
+    BudgetRep = db.Column(Numeric(scale=3))
+    BudgetLoc = db.Column(Numeric(scale=3))
+    BudgetOther = db.Column(Numeric(scale=3))
+    MoneyOwn = db.Column(Numeric(scale=3))
+    MoneyLoan = db.Column(Numeric(scale=3))
+    MoneyOther = db.Column(Numeric(scale=3))
+    refreshed_at = db.Column(db.DateTime, default=current_utc_time)
+
+    direction = db.relationship("Direction")
+
+class PlanStatusRollup(db.Model):
+    """Число планов организаций по министерству/региону, году и статусу (все статусы)"""
+    __tablename__ = 'plan_status_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'scope_key', 'year', 'status', name='uq_plan_status_rollup'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(10), nullable=False)
+    scope_key = db.Column(db.String(20), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(10), nullable=False)  # draft / control / sent / error / approved
+    plans_count = db.Column(db.Integer, default=0)
+    refreshed_at = db.Column(db.DateTime, default=current_utc_time)
+
+class CacheGeneration(db.Model):
+    """Счетчики поколений кэшей процессов: изменение значения сбрасывает кэш во всех воркерах"""
+    __tablename__ = 'cache_generations'
+
+    name = db.Column(db.String(50), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+class OutboxMessage(db.Model):
+    """Исходящее письмо: отправляется фоновым потоком website.user.mail с повторами"""
+    __tablename__ = 'mail_outbox'
+    __table_args__ = (
+        db.Index('ix_mail_outbox_pending', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending / sending / sent / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=current_utc_time)
+    last_error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, nullable=False, default=current_utc_time)
+    sent_at = db.Column(db.DateTime)
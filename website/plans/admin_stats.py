@@ -0,0 +1,136 @@
+"""
+Статистика главной страницы админ-панели.
+
+Счетчики пользователей, организаций, планов, тикетов, направлений и справочников
+считаются точно одним запросом (скалярные подзапросы с COUNT ... FILTER). Размер
+больших таблиц данных (мероприятия, показатели планов, уведомления) берется из
+оценки планировщика pg_class.reltuples без полного сканирования и показывается
+как приблизительный.
+
+Результат кэшируется в процессе на ADMIN_STATS_CACHE_TTL секунд; устаревшее
+значение отдается сразу, а пересчет идет в фоновом потоке.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import func, select, text
+
+from .. import db
+from ..models import Direction, EconMeasure, Indicator, Organization, Plan, Ticket, Unit, User, current_utc_time
+
+# Большие таблицы, для которых достаточно оценки числа строк
+ESTIMATED_TABLES = {
+    'execs_count': 'econ_execes',
+    'usages_count': 'indicators_usage',
+    'notifications_count': 'notifications',
+}
+
+ADMIN_STATS_KEYS = (
+    'user_data', 'active_users', 'new_users', 'admins_count', 'auditors_count', 'respondents_count',
+    'orgs_with_users', 'organization_data', 'plan_data', 'draft_plans', 'approved_plans',
+    'units_count', 'directions_count', 'indicators_count', 'tickets_count', 'measures_count',
+    *ESTIMATED_TABLES,
+)
+
+_cache = {'time': None, 'stats': None}
+_lock = threading.Lock()
+_refreshing = threading.Event()
+
+
+def _scalar(column):
+    return select(column).scalar_subquery()
+
+
+def _exact_counts():
+    now = current_utc_time()
+    active_since = now - timedelta(minutes=3)
+    week_ago = now - timedelta(days=7)
+    count_users = func.count(User.id)
+    count_plans = func.count(Plan.id)
+
+    columns = {
+        'user_data': _scalar(count_users),
+        'active_users': _scalar(count_users.filter(User.last_active >= active_since)),
+        'new_users': _scalar(count_users.filter(User.begin_time >= week_ago)),
+        'admins_count': _scalar(count_users.filter(User.is_admin == True)),
+        'auditors_count': _scalar(count_users.filter(User.is_auditor == True)),
+        'respondents_count': _scalar(count_users.filter(User.is_admin == False, User.is_auditor == False)),
+        'orgs_with_users': _scalar(func.count(func.distinct(User.organization_id))),
+        'organization_data': _scalar(func.count(Organization.id)),
+        'plan_data': _scalar(count_plans),
+        'draft_plans': _scalar(count_plans.filter(Plan.is_draft == True)),
+        'approved_plans': _scalar(count_plans.filter(Plan.is_approved == True)),
+        'units_count': _scalar(func.count(Unit.id)),
+        'directions_count': _scalar(func.count(Direction.id)),
+        'indicators_count': _scalar(func.count(Indicator.id)),
+        'tickets_count': _scalar(func.count(Ticket.id)),
+        'measures_count': _scalar(func.count(EconMeasure.id)),
+    }
+    row = db.session.execute(select(*[column.label(name) for name, column in columns.items()])).one()
+    return dict(row._mapping)
+
+
+def _estimated_counts():
+    rows = db.session.execute(
+        text("SELECT t, (SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(t)) "
+             "FROM unnest(CAST(:tables AS text[])) AS t"),
+        {'tables': list(ESTIMATED_TABLES.values())}
+    ).all()
+    estimates = {relname: reltuples for relname, reltuples in rows}
+
+    counts = {}
+    for name, table in ESTIMATED_TABLES.items():
+        estimate = estimates.get(table)
+        if estimate is None or estimate < 0:
+            # таблица еще ни разу не анализировалась - считаем точно
+            estimate = db.session.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+        counts[name] = int(estimate)
+    return counts
+
+
+def compute_admin_stats():
+    stats = _exact_counts()
+    stats.update(_estimated_counts())
+    return stats
+
+
+def _refresh_in_background(app):
+    def run():
+        try:
+            with app.app_context():
+                try:
+                    stats = compute_admin_stats()
+                finally:
+                    db.session.remove()
+            with _lock:
+                _cache['time'], _cache['stats'] = time.monotonic(), stats
+        except Exception:
+            app.logger.exception("Admin stats refresh failed")
+        finally:
+            _refreshing.clear()
+
+    threading.Thread(target=run, name='admin-stats', daemon=True).start()
+
+
+def get_admin_stats():
+    """Статистика админ-панели из кэша; при устаревании - пересчет в фоне"""
+    ttl = current_app.config.get('ADMIN_STATS_CACHE_TTL', 60)
+    with _lock:
+        cached_time, stats = _cache['time'], _cache['stats']
+
+    if stats is None:
+        stats = compute_admin_stats()
+        with _lock:
+            _cache['time'], _cache['stats'] = time.monotonic(), stats
+        return dict(stats)
+
+    if time.monotonic() - cached_time >= ttl:
+        with _lock:
+            start = not _refreshing.is_set()
+            if start:
+                _refreshing.set()
+        if start:
+            _refresh_in_background(current_app._get_current_object())
+    return dict(stats)
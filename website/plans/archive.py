@@ -0,0 +1,57 @@
+import io
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _ZipSink(io.RawIOBase):
+    """Несмещаемый поток-приемник: zipfile пишет в него, генератор забирает куски"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """
+    Потоково формирует ZIP-архив из entries - итератора (имя файла, поток/bytes).
+    Отдает архив кусками, в памяти одновременно находится не больше одного файла.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=compression) as zip_file:
+        for filename, content in entries:
+            if isinstance(content, (bytes, bytearray)):
+                content = io.BytesIO(content)
+            with zip_file.open(filename, "w") as dest:
+                while True:
+                    block = content.read(CHUNK_SIZE)
+                    if not block:
+                        break
+                    dest.write(block)
+                    data = sink.pop()
+                    if data:
+                        yield data
+            content.close()
+            data = sink.pop()
+            if data:
+                yield data
+    data = sink.pop()
+    if data:
+        yield data
@@ -0,0 +1,312 @@
+"""
+Пакетное изменение строк плана (направления, мероприятия, показатели) одним запросом.
+
+Операции сначала проверяются все вместе, затем применяются в одной транзакции;
+расчетные показатели пересчитываются один раз по объединению источников изменений.
+
+Формат операции:
+    {"op": "create" | "update" | "delete",
+     "entity": "econ_measure" | "econ_exec" | "indicator_usage",
+     "id": <id для update/delete>,
+     "ref": <метка создаваемого направления>,
+     "data": {...поля...}}
+Мероприятие, создаваемое в том же пакете, ссылается на новое направление
+через data.measure_ref вместо data.id_measure.
+"""
+from decimal import Decimal, InvalidOperation
+
+from .. import db
+from ..models import EconExec, EconMeasure, IndicatorUsage, to_decimal_3
+from .indicators import ECON_EXECES, PERIODS, indicator_sources, recompute_derived_indicators
+from .reference import get_reference
+
+ECON_MEASURE = 'econ_measure'
+ECON_EXEC = 'econ_exec'
+INDICATOR_USAGE = 'indicator_usage'
+
+MODELS = {ECON_MEASURE: EconMeasure, ECON_EXEC: EconExec, INDICATOR_USAGE: IndicatorUsage}
+OPERATIONS = ('create', 'update', 'delete')
+
+MAX_OPERATIONS = 1000
+
+MEASURE_FIELDS = ('year_econ', 'estim_econ')
+EXEC_INT_FIELDS = ('Volume', 'ExpectedQuarter')
+EXEC_DECIMAL_FIELDS = (
+    'EffTut', 'EffRub', 'EffCurrYear', 'Payback', 'VolumeFin', 'BudgetState', 'BudgetRep',
+    'BudgetLoc', 'BudgetOther', 'MoneyOwn', 'MoneyLoan', 'MoneyOther',
+)
+
+
+class BatchError(ValueError):
+    """Пакет не прошел проверку; errors - список сообщений по операциям"""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def _number(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError(value)
+    try:
+        result = Decimal(str(value).strip().replace(",", "."))
+    except InvalidOperation:
+        raise ValueError(value)
+    if not result.is_finite():
+        raise ValueError(value)
+    return result
+
+
+def _clean_fields(data, decimal_fields, int_fields=()):
+    """Значения переданных полей {поле: значение}; ValueError - поле с некорректным значением"""
+    values = {}
+    for field in decimal_fields + int_fields:
+        if field not in data:
+            continue
+        try:
+            value = _number(data[field])
+        except ValueError:
+            raise ValueError(field)
+        if field in int_fields:
+            values[field] = int(value) if value is not None else None
+        else:
+            values[field] = to_decimal_3(value) if value is not None else None
+    return values
+
+
+def _exec_values(data, creating):
+    values = _clean_fields(data, EXEC_DECIMAL_FIELDS, EXEC_INT_FIELDS)
+    if creating or 'name' in data:
+        name = data.get('name')
+        name = name.strip() if isinstance(name, str) else ""
+        if not name:
+            raise ValueError('name')
+        values['name'] = name
+    quarter = values.get('ExpectedQuarter')
+    if quarter is not None and quarter not in (1, 2, 3, 4):
+        raise ValueError('ExpectedQuarter')
+    return values
+
+
+def _indicator_values(data, indicator):
+    """Значения в единицах показателя пересчитываются в т у.т., как в edit_indicator"""
+    values = _clean_fields(data, PERIODS)
+    coeff = indicator.CoeffToTut or Decimal('0')
+    return {
+        period: to_decimal_3(value * coeff) if value is not None else None
+        for period, value in values.items()
+    }
+
+
+def _load_existing(plan_id, operations):
+    """Существующие строки плана, затронутые update/delete: {entity: {id: объект}}"""
+    operations = [operation for operation in operations if isinstance(operation, dict)]
+    ids = {entity: set() for entity in MODELS}
+    for operation in operations:
+        if operation.get('op') in ('update', 'delete') and operation.get('entity') in MODELS:
+            try:
+                ids[operation['entity']].add(int(operation.get('id')))
+            except (TypeError, ValueError):
+                pass
+
+    existing = {}
+    for entity, model in MODELS.items():
+        existing[entity] = {}
+        if ids[entity]:
+            rows = model.query.filter(model.id_plan == plan_id, model.id.in_(ids[entity])).all()
+            existing[entity] = {row.id: row for row in rows}
+    if any(operation.get('entity') == INDICATOR_USAGE for operation in operations):
+        existing['indicator_ids'] = {
+            row.id_indicator for row in
+            db.session.query(IndicatorUsage.id_indicator).filter(IndicatorUsage.id_plan == plan_id)
+        }
+    return existing
+
+
+def _validate(plan, operations):
+    """Проверяет весь пакет: [(операция, объект или None, значения)]"""
+    if not isinstance(operations, list) or not operations:
+        raise BatchError(["Пустой список операций"])
+    if len(operations) > MAX_OPERATIONS:
+        raise BatchError([f"Не более {MAX_OPERATIONS} операций в одном запросе"])
+
+    reference = get_reference()
+    directions = {d.id for d in reference.directions}
+    existing = _load_existing(plan.id, operations)
+    measure_refs = set()
+    new_indicator_ids = set()
+    exec_measures = []  # (префикс операции, id направления) - создаваемые и изменяемые мероприятия
+    errors = []
+    checked = []
+
+    for index, operation in enumerate(operations, start=1):
+        prefix = f"Операция {index}"
+        if not isinstance(operation, dict):
+            errors.append(f"{prefix}: ожидается объект")
+            continue
+        op, entity = operation.get('op'), operation.get('entity')
+        data = operation.get('data') or {}
+        if op not in OPERATIONS or entity not in MODELS or not isinstance(data, dict):
+            errors.append(f"{prefix}: неизвестная операция")
+            continue
+
+        row = None
+        if op != 'create':
+            try:
+                row = existing[entity].get(int(operation.get('id')))
+            except (TypeError, ValueError):
+                row = None
+            if row is None:
+                errors.append(f"{prefix}: запись не найдена в плане")
+                continue
+            if op == 'delete':
+                checked.append((operation, row, {}))
+                continue
+
+        try:
+            if entity == ECON_MEASURE:
+                values = _clean_fields(data, MEASURE_FIELDS)
+                if op == 'create':
+                    try:
+                        values['id_direction'] = int(data.get('id_direction'))
+                    except (TypeError, ValueError):
+                        raise ValueError('id_direction')
+                    if values['id_direction'] not in directions:
+                        raise ValueError('id_direction')
+                    if isinstance(operation.get('ref'), (str, int)):
+                        measure_refs.add(operation['ref'])
+
+            elif entity == ECON_EXEC:
+                values = _exec_values(data, op == 'create')
+                if op == 'update':
+                    exec_measures.append((prefix, row.id_measure))
+                if op == 'create':
+                    if data.get('measure_ref') is not None:
+                        if not isinstance(data['measure_ref'], (str, int)) or data['measure_ref'] not in measure_refs:
+                            raise ValueError('measure_ref')
+                        values['measure_ref'] = data['measure_ref']
+                    else:
+                        try:
+                            values['id_measure'] = int(data.get('id_measure'))
+                        except (TypeError, ValueError):
+                            raise ValueError('id_measure')
+                        exec_measures.append((prefix, values['id_measure']))
+
+            else:
+                indicator = reference.indicator(data.get('id_indicator') if op == 'create' else row.id_indicator)
+                if indicator is None:
+                    raise ValueError('id_indicator')
+                if op == 'create':
+                    if indicator.id in existing['indicator_ids'] or indicator.id in new_indicator_ids:
+                        errors.append(f"{prefix}: показатель уже есть в плане")
+                        continue
+                    new_indicator_ids.add(indicator.id)
+                values = _indicator_values(data, indicator)
+                values['indicator'] = indicator
+        except ValueError as e:
+            errors.append(f"{prefix}: некорректное поле {e}")
+            continue
+
+        checked.append((operation, row, values))
+
+    # направление, удаляемое в пакете, удаляет и свои мероприятия - ссылаться на него нельзя
+    deleted_measures = {row.id for operation, row, _ in checked
+                        if operation['entity'] == ECON_MEASURE and operation['op'] == 'delete'}
+    for prefix, measure_id in exec_measures:
+        if measure_id in deleted_measures:
+            errors.append(f"{prefix}: направление {measure_id} удаляется в этом же пакете")
+
+    exec_measure_ids = {values['id_measure'] for operation, _, values in checked
+                        if operation['entity'] == ECON_EXEC and 'id_measure' in values}
+    if exec_measure_ids:
+        found = {
+            measure_id for (measure_id,) in
+            db.session.query(EconMeasure.id)
+            .filter(EconMeasure.id_plan == plan.id, EconMeasure.id.in_(exec_measure_ids))
+        }
+        for missing in sorted(exec_measure_ids - found):
+            errors.append(f"Направление {missing} не найдено в плане")
+
+    if errors:
+        raise BatchError(errors)
+    return checked
+
+
+def apply_plan_batch(plan, operations):
+    """
+    Применяет пакет операций к плану в текущей транзакции и пересчитывает
+    расчетные показатели один раз. Коммит и отметка изменения плана - за вызывающим.
+    Возвращает (созданные записи [{index, entity, id}], расчетные строки {код: значения}).
+    """
+    checked = _validate(plan, operations)
+    directions = {d.id: d for d in get_reference().directions}
+
+    sources = set()
+    created = []
+    measures_by_ref = {}
+    deletes = []
+
+    # направления создаются первыми: на них могут ссылаться новые мероприятия
+    for index, (operation, row, values) in enumerate(checked):
+        if operation['entity'] == ECON_MEASURE and operation['op'] == 'create':
+            measure = EconMeasure(id_plan=plan.id, **values)
+            db.session.add(measure)
+            created.append((index, operation, measure))
+            if isinstance(operation.get('ref'), (str, int)):
+                measures_by_ref[operation['ref']] = measure
+    db.session.flush()
+
+    measure_directions = dict(
+        db.session.query(EconMeasure.id, EconMeasure.id_direction).filter(EconMeasure.id_plan == plan.id)
+    )
+
+    for index, (operation, row, values) in enumerate(checked):
+        entity, op = operation['entity'], operation['op']
+        if entity == ECON_MEASURE and op == 'create':
+            continue
+
+        if entity == INDICATOR_USAGE:
+            indicator = values.pop('indicator', None)
+            if indicator is None:
+                indicator = get_reference().indicator(row.id_indicator)
+            sources |= indicator_sources(indicator)
+        elif entity == ECON_EXEC or op == 'delete':
+            sources.add(ECON_EXECES)
+
+        if op == 'delete':
+            deletes.append(row)
+        elif op == 'update':
+            for field, value in values.items():
+                setattr(row, field, value)
+        elif entity == ECON_EXEC:
+            measure_ref = values.pop('measure_ref', None)
+            if measure_ref is not None:
+                values['id_measure'] = measures_by_ref[measure_ref].id
+            direction = directions.get(measure_directions.get(values['id_measure']))
+            econ_exec = EconExec(
+                id_plan=plan.id,
+                is_local=bool(direction.is_local) if direction else False,
+                **values
+            )
+            db.session.add(econ_exec)
+            created.append((index, operation, econ_exec))
+        else:
+            usage = IndicatorUsage(id_plan=plan.id, id_indicator=indicator.id, **values)
+            db.session.add(usage)
+            created.append((index, operation, usage))
+
+    for row in deletes:
+        db.session.delete(row)
+    db.session.flush()
+
+    derived = recompute_derived_indicators(plan.id, sources, commit=False)
+    return (
+        [{'index': index + 1, 'entity': operation['entity'], 'id': obj.id}
+         for index, operation, obj in created],
+        {
+            code: {period: float(getattr(usage, period) or 0) for period in PERIODS}
+            for code, usage in derived.items()
+        }
+    )
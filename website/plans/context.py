@@ -0,0 +1,50 @@
+"""
+План текущего запроса (flask.g).
+
+owner_only один раз загружает план вместе с организацией (нужна для групп
+сводок) и вычисляет права пользователя на него; представления и помощники
+цепочки изменения плана (update_ChangeTimePlan, смена статуса, удаление)
+берут план из контекста, а не запрашивают его повторно.
+"""
+from flask import g
+from sqlalchemy.orm import joinedload
+
+from ..models import Plan
+
+PLAN_CONTEXT_OPTIONS = (
+    joinedload(Plan.organization),
+)
+
+
+def load_current_plan(plan_id, user):
+    """Загружает план в контекст запроса и вычисляет права user; None - план не найден"""
+    plan = Plan.query.options(*PLAN_CONTEXT_OPTIONS).filter(Plan.id == plan_id).first()
+    g.current_plan = plan
+    g.current_plan_id = plan_id if plan is not None else None
+    g.current_plan_is_owner = plan is not None and plan.user_id == user.id
+    g.current_plan_access = plan is not None and bool(
+        user.is_admin or user.is_auditor or g.current_plan_is_owner
+    )
+    return plan
+
+
+def get_plan(plan_id):
+    """
+    План из контекста запроса. Другой план (не проверенный owner_only) загружается
+    и запоминается отдельно, не заменяя g.current_plan и права на него.
+    """
+    plan_id = int(plan_id)
+    if g.get('current_plan_id') == plan_id:
+        return g.current_plan
+    other_plans = g.setdefault('other_plans', {})
+    plan = other_plans.get(plan_id)
+    if plan is None:
+        plan = Plan.query.options(*PLAN_CONTEXT_OPTIONS).filter(Plan.id == plan_id).first()
+        if plan is not None:
+            other_plans[plan_id] = plan
+    return plan
+
+
+def is_plan_owner():
+    """Текущий пользователь - владелец плана из owner_only"""
+    return bool(g.get('current_plan_is_owner'))
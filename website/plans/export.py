@@ -1,115 +1,149 @@
 import io
-import xml.etree.ElementTree as ET
-from ..models import Plan, EconMeasure, EconExec
-from sqlalchemy.orm import joinedload
-from ..views import get_cumulative_econ_metrics
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ..models import Plan
+from .metrics import LOCAL, NON_LOCAL, TOTAL, flat_totals
+from .xml_stream import XmlStreamWriter
+
+def split_econ_execes(plan):
+    """ Мероприятия плана: (местные, не местные) """
+    local = [e for e in plan.econ_execes if e.is_local == True]
+    non_local = [e for e in plan.econ_execes if e.is_local == False]
+    return local, non_local
         
-def export_xml_single(plan: Plan):
-    """Экспорт одного плана в XML с тремя разделами и титульными данными."""
-
-    def build_title_xml(plan):
-        """Формирует XML-узел титульного листа."""
-        title = ET.Element("title")
-
-        approved = ET.SubElement(title, "approved_by")
-        approved.text = (
-            "СОГЛАСОВАНО: Департамент по энергоэффективности Госстандарта. "
-        )
-
-        ministrystr = plan.organization.ministry or "Министерство (концерн, государственный комитет)"
-        confirmed = ET.SubElement(title, "confirmed_by")
-        confirmed.text = (
-            f"УТВЕРЖДАЮ {ministrystr}. "
-        )
-
-        ET.SubElement(title, "header").text = "ПЛАН МЕРОПРИЯТИЙ ПО ЭНЕРГОСБЕРЕЖЕНИЮ"
-        ET.SubElement(title, "organization_name").text = str(plan.organization.name or "")
-        ET.SubElement(title, "year_label").text = f"на {plan.year} год"
-
-        targets = ET.SubElement(title, "targets")
-        ET.SubElement(targets, "label").text = "Целевые показатели: показатель энергосбережения"
-        ET.SubElement(targets, "details").text = (
+def plan_owner_name(plan) -> str:
+    """Наименование организации, министерства или региона - владельца плана"""
+    if plan.organization:
+        return plan.organization.name or ""
+    if plan.ministry:
+        return plan.ministry.name or ""
+    if plan.region:
+        return plan.region.name or ""
+    return ""
+
+def plan_ministry_name(plan) -> str:
+    """Министерство, утверждающее план (для титульного листа)"""
+    if plan.organization and plan.organization.ministry:
+        return plan.organization.ministry.name
+    if plan.ministry:
+        return plan.ministry.name
+    return "Министерство (концерн, государственный комитет)"
+
+def write_plan_xml(writer, plan: Plan):
+    """
+    Пишет элемент <plan> с титульными данными и тремя разделами в XmlStreamWriter.
+
+    Отличия от прежнего формата выгрузки (ElementTree):
+    - документ начинается с объявления <?xml ... encoding="UTF-8"?>;
+    - строки part1/row содержат элемент <code> (код показателя) между <group>
+      и <name> - по нему XML-выгрузка загружается обратно импортом плана;
+    - title/confirmed_by содержит наименование министерства, а не repr модели;
+    - title/targets/details: последний показатель подписан "доля ВИЭ в КПТ"
+      (прежде повторялась подпись "доля местных ТЭР в КПТ").
+    """
+
+    def write_title(plan):
+        """Титульный лист."""
+        writer.start("title")
+        writer.element("approved_by", "СОГЛАСОВАНО: Департамент по энергоэффективности Госстандарта. ")
+        writer.element("confirmed_by", f"УТВЕРЖДАЮ {plan_ministry_name(plan)}. ")
+        writer.element("header", "ПЛАН МЕРОПРИЯТИЙ ПО ЭНЕРГОСБЕРЕЖЕНИЮ")
+        writer.element("organization_name", plan_owner_name(plan))
+        writer.element("year_label", f"на {plan.year} год")
+
+        writer.start("targets")
+        writer.element("label", "Целевые показатели: показатель энергосбережения")
+        writer.element("details", (
             f"показатель энергосбережения - {plan.energy_saving}% "
             f"(задание по экономии ТЭР - {plan.share_fuel} т у.т.); "
             f"доля местных ТЭР в КПТ - {plan.saving_fuel}%; "
-            f"доля местных ТЭР в КПТ - {plan.share_energy}%."
-        )
-        return title
+            f"доля ВИЭ в КПТ - {plan.share_energy}%."
+        ))
+        writer.end()
+        writer.end()
 
-    def build_part1_xml(plan):
+    def write_part1(plan):
         """
-        Формирует XML-раздел 'Часть 1' с показателями использования ТЭР.
+        Раздел 'Часть 1' с показателями использования ТЭР.
         """
-        part1 = ET.Element("part1")
-        
-        ET.SubElement(part1, "title").text = "Часть 1. Показатели использования топливно-энергетических ресурсов"
-        
+        writer.start("part1")
+        writer.element("title", "Часть 1. Показатели использования топливно-энергетических ресурсов")
+
         previous_group = None
         for usage in sorted(plan.indicators_usage, key=lambda u: (u.indicator.Group, u.indicator.RowN)):
             group_value = usage.indicator.Group if usage.indicator.Group != previous_group else ""
             previous_group = usage.indicator.Group
 
-            row = ET.SubElement(part1, "row")
-            ET.SubElement(row, "group").text = str(group_value or "")
-            ET.SubElement(row, "name").text = str(usage.indicator.name or "-")
-            ET.SubElement(row, "unit").text = str(getattr(usage.indicator.unit, "name", "") or "")
-            ET.SubElement(row, "prev_year").text = str(usage.QYearPrev or 0)
-            ET.SubElement(row, "curr_year").text = str(usage.QYearCurr or 0)
-            ET.SubElement(row, "next_year").text = str(usage.QYearNext or 0)
-            ET.SubElement(row, "change").text = str((usage.QYearNext or 0) - (usage.QYearCurr or 0))
-        
-        return part1
+            writer.start("row")
+            writer.element("group", str(group_value or ""))
+            writer.element("code", str(usage.indicator.code or ""))
+            writer.element("name", str(usage.indicator.name or "-"))
+            writer.element("unit", str(getattr(usage.indicator.unit, "name", "") or ""))
+            writer.element("prev_year", str(usage.QYearPrev or 0))
+            writer.element("curr_year", str(usage.QYearCurr or 0))
+            writer.element("next_year", str(usage.QYearNext or 0))
+            writer.element("change", str((usage.QYearNext or 0) - (usage.QYearCurr or 0)))
+            writer.end()
+
+        writer.end()
 
-    def build_part2_xml(plan):
+    def write_part2(plan):
         """
-        Формирует XML-раздел 'Часть 2' с мероприятиями по реализации основных направлений энергосбережения.
+        Раздел 'Часть 2' с мероприятиями по реализации основных направлений энергосбережения.
         """
-        part2 = ET.Element("part2")
-        
-        ET.SubElement(part2, "title").text = f"Часть 2. Мероприятия по реализации основных направлений энергосбережения на {plan.year} год"
-        
+        writer.start("part2")
+        writer.element("title", f"Часть 2. Мероприятия по реализации основных направлений энергосбережения на {plan.year} год")
+
         for idx, measure in enumerate(sorted(plan.econ_measures, key=lambda u: u.direction.code), start=1):
-            row = ET.SubElement(part2, "row")
-            ET.SubElement(row, "number").text = str(idx)
-            ET.SubElement(row, "code").text = str(measure.direction.code or "")
-            ET.SubElement(row, "name").text = str(measure.direction.name or "")
-            ET.SubElement(row, "year_econ").text = str(float(measure.year_econ or 0))
-            ET.SubElement(row, "estim_econ").text = str(float(measure.estim_econ or 0))
-        
-        return part2
+            writer.start("row")
+            writer.element("number", str(idx))
+            writer.element("code", str(measure.direction.code or ""))
+            writer.element("name", str(measure.direction.name or ""))
+            writer.element("year_econ", str(float(measure.year_econ or 0)))
+            writer.element("estim_econ", str(float(measure.estim_econ or 0)))
+            writer.end()
 
-    def build_part3_xml(plan, get_cumulative_econ_metrics, EconExec):
+        writer.end()
+
+    def write_part3(plan):
         """
-        Формирует XML-раздел 'Часть 3' с мероприятиями по увеличению использования местных ТЭР.
+        Раздел 'Часть 3' с мероприятиями по увеличению использования местных ТЭР.
         """
-        part3 = ET.Element("part3")
-        ET.SubElement(part3, "title").text = "Часть 3. Мероприятия по увеличению использования местных топливно-энергетических ресурсов"
+        writer.start("part3")
+        writer.element("title", "Часть 3. Мероприятия по увеличению использования местных топливно-энергетических ресурсов")
 
         local_execs = [e for e in plan.econ_execes if e.is_local]
         non_local_execs = [e for e in plan.econ_execes if not e.is_local]
 
         def add_section(title, execs, start_number=1):
-            section = ET.SubElement(part3, "section", {"title": title})
+            writer.start("section", {"title": title})
             for idx, econ in enumerate(execs, start=start_number):
-                row = ET.SubElement(section, "row")
-                ET.SubElement(row, "number").text = str(idx)
-                ET.SubElement(row, "code").text = str(econ.econ_measures.direction.code if econ.econ_measures and econ.econ_measures.direction else "")
-                ET.SubElement(row, "name").text = str(econ.name if hasattr(econ, "name") else "")
-                ET.SubElement(row, "unit").text = str(econ.econ_measures.direction.unit.name if econ.econ_measures and econ.econ_measures.direction and econ.econ_measures.direction.unit else "")
-                ET.SubElement(row, "volume").text = str(getattr(econ, "Volume", 0))
-                ET.SubElement(row, "eff_tut").text = str(getattr(econ, "EffTut", 0))
-                ET.SubElement(row, "eff_rub").text = str(getattr(econ, "EffRub", 0))
-                ET.SubElement(row, "expected_quarter").text = str(getattr(econ, "ExpectedQuarter", ""))
-                ET.SubElement(row, "eff_curr_year").text = str(getattr(econ, "EffCurrYear", 0))
-                ET.SubElement(row, "payback").text = str(getattr(econ, "Payback", 0))
-                ET.SubElement(row, "volume_fin").text = str(getattr(econ, "VolumeFin", 0))
-                ET.SubElement(row, "budget_state").text = str(getattr(econ, "BudgetState", 0))
-                ET.SubElement(row, "budget_rep").text = str(getattr(econ, "BudgetRep", 0))
-                ET.SubElement(row, "budget_loc").text = str(getattr(econ, "BudgetLoc", 0))
-                ET.SubElement(row, "budget_other").text = str(getattr(econ, "BudgetOther", 0))
-                ET.SubElement(row, "money_own").text = str(getattr(econ, "MoneyOwn", 0))
-                ET.SubElement(row, "money_loan").text = str(getattr(econ, "MoneyLoan", 0))
-                ET.SubElement(row, "money_other").text = str(getattr(econ, "MoneyOther", 0))
+                direction = econ.econ_measures.direction if econ.econ_measures else None
+                writer.start("row")
+                writer.element("number", str(idx))
+                writer.element("code", str(direction.code if direction else ""))
+                writer.element("name", str(econ.name or ""))
+                writer.element("unit", str(direction.unit.name if direction and direction.unit else ""))
+                writer.element("volume", str(econ.Volume))
+                writer.element("eff_tut", str(econ.EffTut))
+                writer.element("eff_rub", str(econ.EffRub))
+                writer.element("expected_quarter", str(econ.ExpectedQuarter))
+                writer.element("eff_curr_year", str(econ.EffCurrYear))
+                writer.element("payback", str(econ.Payback))
+                writer.element("volume_fin", str(econ.VolumeFin))
+                writer.element("budget_state", str(econ.BudgetState))
+                writer.element("budget_rep", str(econ.BudgetRep))
+                writer.element("budget_loc", str(econ.BudgetLoc))
+                writer.element("budget_other", str(econ.BudgetOther))
+                writer.element("money_own", str(econ.MoneyOwn))
+                writer.element("money_loan", str(econ.MoneyLoan))
+                writer.element("money_other", str(econ.MoneyOther))
+                writer.end()
+            writer.end()
             return start_number + len(execs)
 
         next_number = add_section("Раздел 2.1 Мероприятия по экономии ТЭР (первоначальная ред.)", non_local_execs, 1)
@@ -121,52 +155,66 @@ def export_xml_single(plan: Plan):
             ("Январь–Сентябрь", "jan_sep"),
             ("Январь–Декабрь", "jan_dec")
         ]
-        local_totals = get_cumulative_econ_metrics(plan.id, True)
-        non_local_totals = get_cumulative_econ_metrics(plan.id, False)
+        totals = plan.quarterly_metrics[TOTAL]
 
-        totals_elem = ET.SubElement(part3, "totals")
+        writer.start("totals")
         for q_label, q_key in quarters:
-            quarter = ET.SubElement(totals_elem, "quarter", {"name": q_label})
-            ET.SubElement(quarter, "eff_curr_year").text = str(local_totals[q_key]["eff_curr_year"] + non_local_totals[q_key]["eff_curr_year"])
-            ET.SubElement(quarter, "volume_fin").text = str(local_totals[q_key]["volume_fin"] + non_local_totals[q_key]["volume_fin"])
+            writer.start("quarter", {"name": q_label})
+            writer.element("eff_curr_year", str(totals[q_key]["eff_curr_year"]))
+            writer.element("volume_fin", str(totals[q_key]["volume_fin"]))
+            writer.end()
+        writer.end()
 
-        return part3
+        writer.end()
 
-    root = ET.Element("plan", attrib={
+    writer.start("plan", {
         "id": str(plan.id),
         "year": str(plan.year or "")
     })
+    write_title(plan)
+    write_part1(plan)
+    write_part2(plan)
+    write_part3(plan)
+    writer.end()
 
-    root.append(build_title_xml(plan))
-    root.append(build_part1_xml(plan))
-    root.append(build_part2_xml(plan))
-    root.append(build_part3_xml(plan, get_cumulative_econ_metrics, EconExec))
-
-    def prettify(elem, level=0):
-        indent = "  "
-        i = "\n" + level * indent
-        if len(elem):
-            if not elem.text or not elem.text.strip():
-                elem.text = i + indent
-            for child in elem:
-                prettify(child, level + 1)
-            if not child.tail or not child.tail.strip():
-                child.tail = i
-        if level and (not elem.tail or not elem.tail.strip()):
-            elem.tail = i
-
-    prettify(root)
-
-    xml_content = ET.tostring(root, encoding="utf-8").decode("utf-8")
-
+def export_xml_single(plan: Plan, indent="  "):
+    """Экспорт одного плана в XML с тремя разделами и титульными данными."""
     file_stream = io.BytesIO()
-    file_stream.write(xml_content.encode("utf-8"))
+    writer = XmlStreamWriter(file_stream, indent=indent)
+    writer.declaration()
+    write_plan_xml(writer, plan)
     file_stream.seek(0)
-    filename = f"{plan.okpo}_{plan.year}.xml"
+    filename = plan_filename(plan, "xml")
     return file_stream, "application/xml", filename
-    
+
+def iter_xml_feed(snapshots, indent="  "):
+    """
+    Сводный XML нескольких планов (<plans><plan/>...</plans>) для обмена данными
+    с министерствами. Отдается кусками по одному плану, память не зависит от их числа.
+    """
+    buffer = io.BytesIO()
+    writer = XmlStreamWriter(buffer, indent=indent)
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.declaration()
+    writer.start("plans")
+    for snapshot in snapshots:
+        write_plan_xml(writer, snapshot)
+        yield flush()
+    writer.end()
+    yield flush()
+
 def export_pdf_single(plan: Plan):
-    pass
+    """Экспорт одного плана в PDF: титульный лист и три части."""
+    from .pdf import render_plan_pdf
+
+    file_stream = render_plan_pdf(plan)
+    return file_stream, "application/pdf", plan_filename(plan, "pdf")
 
 def type_of_export(plan: Plan) -> str:
     if plan.org_id:
@@ -177,6 +225,12 @@ def type_of_export(plan: Plan) -> str:
         return "region"
     raise ValueError("Erorr for read type of plan")
 
+def plan_filename(plan: Plan, extension: str) -> str:
+    """Имя файла экспорта плана (уникально в пределах архива)"""
+    if type_of_export(plan) == "org":
+        return f"{plan.organization.okpo}_{plan.year}_{plan.id}.{extension}"
+    return f"{plan.year}_{plan.id}.{extension}"
+
 def export_xlsx_single(plan: Plan):
     from openpyxl import Workbook
     from openpyxl.styles import Font, Alignment, Border, Side
@@ -1347,21 +1401,7 @@ def export_xlsx_single(plan: Plan):
             cell.alignment = center
             cell.font = regular_font_10
 
-        local_econ_execes = (EconExec.query
-            .join(EconMeasure)
-            .join(Plan)
-            .filter(Plan.id == plan.id, EconExec.is_local == True)
-            .options(joinedload(EconExec.econ_measures).joinedload(EconMeasure.plan))
-            .all()
-        )
-
-        non_local_econ_execes = (EconExec.query
-            .join(EconMeasure)
-            .join(Plan)
-            .filter(Plan.id == plan.id, EconExec.is_local == False)
-            .options(joinedload(EconExec.econ_measures).joinedload(EconMeasure.plan))
-            .all()
-        )
+        local_econ_execes, non_local_econ_execes = split_econ_execes(plan)
 
         def add_section(title, execs, start_number=1):
             nonlocal row_index
@@ -1449,30 +1489,7 @@ def export_xlsx_single(plan: Plan):
             ("      январь–сентябрь", "jan_sep"),
             ("      январь–декабрь", "jan_dec")
         ]
-        local_totals = get_cumulative_econ_metrics(plan.id, False)
-        
-        non_local_totals = get_cumulative_econ_metrics(plan.id, False)
-        # total_metrics = {
-        #     'jan_mar_eff': local_totals['jan_mar']['eff_curr_year'] + non_local_totals['jan_mar']['eff_curr_year'],
-        #     'jan_mar_vol': local_totals['jan_mar']['volume_fin'] + non_local_totals['jan_mar']['volume_fin'],
-        #     'jan_jun_eff': local_totals['jan_jun']['eff_curr_year'] + non_local_totals['jan_jun']['eff_curr_year'],
-        #     'jan_jun_vol': local_totals['jan_jun']['volume_fin'] + non_local_totals['jan_jun']['volume_fin'],
-        #     'jan_sep_eff': local_totals['jan_sep']['eff_curr_year'] + non_local_totals['jan_sep']['eff_curr_year'],
-        #     'jan_sep_vol': local_totals['jan_sep']['volume_fin'] + non_local_totals['jan_sep']['volume_fin'],
-        #     'jan_dec_eff': local_totals['jan_dec']['eff_curr_year'] + non_local_totals['jan_dec']['eff_curr_year'],
-        #     'jan_dec_vol': local_totals['jan_dec']['volume_fin'] + non_local_totals['jan_dec']['volume_fin']
-        # }
-        
-        total_metrics = {
-            'jan_mar_eff': local_totals['jan_mar']['eff_curr_year'],
-            'jan_mar_vol': local_totals['jan_mar']['volume_fin'],
-            'jan_jun_eff': local_totals['jan_jun']['eff_curr_year'],
-            'jan_jun_vol': local_totals['jan_jun']['volume_fin'],
-            'jan_sep_eff': local_totals['jan_sep']['eff_curr_year'],
-            'jan_sep_vol': local_totals['jan_sep']['volume_fin'],
-            'jan_dec_eff': local_totals['jan_dec']['eff_curr_year'],
-            'jan_dec_vol': local_totals['jan_dec']['volume_fin']
-        }
+        total_metrics = flat_totals(plan.quarterly_metrics[NON_LOCAL])
 
 
         for q_label, q_key in quarters:
@@ -1799,21 +1816,7 @@ def export_xlsx_single(plan: Plan):
             cell.alignment = center
             cell.font = regular_font_10
 
-        local_econ_execes = (EconExec.query
-            .join(EconMeasure)
-            .join(Plan)
-            .filter(Plan.id == plan.id, EconExec.is_local == True)
-            .options(joinedload(EconExec.econ_measures).joinedload(EconMeasure.plan))
-            .all()
-        )
-
-        non_local_econ_execes = (EconExec.query
-            .join(EconMeasure)
-            .join(Plan)
-            .filter(Plan.id == plan.id, EconExec.is_local == False)
-            .options(joinedload(EconExec.econ_measures).joinedload(EconMeasure.plan))
-            .all()
-        )
+        local_econ_execes, non_local_econ_execes = split_econ_execes(plan)
 
         def add_section(title, execs, start_number=1):
             nonlocal row_index
@@ -1900,19 +1903,7 @@ def export_xlsx_single(plan: Plan):
             ("      январь–сентябрь", "jan_sep"),
             ("      январь–декабрь", "jan_dec")
         ]
-        local_totals = get_cumulative_econ_metrics(plan.id, True)
-        non_local_totals = get_cumulative_econ_metrics(plan.id, True)
-        
-        total_metrics = {
-            'jan_mar_eff': non_local_totals['jan_mar']['eff_curr_year'],
-            'jan_mar_vol': non_local_totals['jan_mar']['volume_fin'],
-            'jan_jun_eff': non_local_totals['jan_jun']['eff_curr_year'],
-            'jan_jun_vol': non_local_totals['jan_jun']['volume_fin'],
-            'jan_sep_eff': non_local_totals['jan_sep']['eff_curr_year'],
-            'jan_sep_vol': non_local_totals['jan_sep']['volume_fin'],
-            'jan_dec_eff': non_local_totals['jan_dec']['eff_curr_year'],
-            'jan_dec_vol': non_local_totals['jan_dec']['volume_fin']
-        }
+        total_metrics = flat_totals(plan.quarterly_metrics[LOCAL])
 
         for q_label, q_key in quarters:
             row_index += 1
@@ -2157,17 +2148,64 @@ def export_xlsx_single(plan: Plan):
     wb.save(file_stream)
     file_stream.seek(0)
 
-    if export_type == "org":
-        filename = f"{plan.organization.okpo}_{plan.year}_{plan.id}.xlsx"
-    elif export_type == "ministry":
-            filename = f"{plan.year}_{plan.id}.xlsx"
-    elif export_type == "region":
-        filename = f"{plan.year}_{plan.id}.xlsx"
-    else:
-        ValueError("Erorr export_type filename")
-   
     return (
         file_stream,
         "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        filename
-    )
\ No newline at end of file
+        plan_filename(plan, "xlsx")
+    )
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def _get_render_pool(processes):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            # spawn: рабочие процессы не наследуют соединения с БД и потоки сервера.
+            # Дочерний процесс импортирует __main__ запуска как __mp_main__ - точка входа
+            # (main.py) не должна создавать приложение при таком импорте
+            _render_pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _render_pool
+
+def _reset_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False)
+            _render_pool = None
+
+def render_export(exporter, snapshot):
+    """ Экспорт одного снимка плана: (имя файла, bytes). Выполняется и в процессах пула """
+    f_stream, _, filename = exporter(snapshot)
+    return filename, f_stream.getvalue()
+
+def render_many(exporter, snapshots, processes=1):
+    """
+    Рендерит снимки планов, отдает (имя файла, bytes) в исходном порядке.
+    При processes > 1 файлы строятся в пуле процессов, в работе одновременно
+    не больше 2 * processes снимков, чтобы память не росла с числом планов.
+    """
+    if not processes or processes <= 1:
+        for snapshot in snapshots:
+            yield render_export(exporter, snapshot)
+        return
+
+    pool = _get_render_pool(processes)
+    window = 2 * processes
+    pending = deque()
+    try:
+        for snapshot in snapshots:
+            pending.append(pool.submit(render_export, exporter, snapshot))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        _reset_render_pool()
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
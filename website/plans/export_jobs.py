@@ -0,0 +1,140 @@
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from .. import db, socketio
+from ..events import user_room
+from .archive import iter_zip
+from .export import render_many
+from .snapshot import load_plan_snapshots
+
+_executor = None
+
+
+def _jobs_dir(app):
+    path = app.config.get('EXPORT_JOBS_DIR') or os.path.join(app.instance_path, 'exports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _get_executor(app):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=app.config.get('EXPORT_JOBS_WORKERS', 2),
+            thread_name_prefix='export-job'
+        )
+    return _executor
+
+
+def _meta_path(app, job_id):
+    return os.path.join(_jobs_dir(app), f"{job_id}.json")
+
+
+def archive_path(app, job_id):
+    return os.path.join(_jobs_dir(app), f"{job_id}.zip")
+
+
+def _save_meta(app, job):
+    path = _meta_path(app, job['id'])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+
+
+def _emit_progress(job):
+    socketio.emit('export_progress', {
+        'job_id': job['id'],
+        'status': job['status'],
+        'done': job['done'],
+        'total': job['total'],
+        'error': job.get('error'),
+    }, to=user_room(job['user_id']))
+
+
+def get_job(job_id):
+    """Состояние задания экспорта или None"""
+    try:
+        uuid.UUID(job_id)
+    except (ValueError, TypeError):
+        return None
+    try:
+        with open(_meta_path(current_app, job_id), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def cleanup_expired_jobs(app=None):
+    """Удаляет архивы и состояния заданий старше EXPORT_JOBS_TTL"""
+    app = app or current_app._get_current_object()
+    ttl = app.config.get('EXPORT_JOBS_TTL', 3600)
+    now = time.time()
+    path = _jobs_dir(app)
+    for name in os.listdir(path):
+        file_path = os.path.join(path, name)
+        try:
+            if now - os.path.getmtime(file_path) > ttl:
+                os.remove(file_path)
+        except OSError:
+            pass
+
+
+def submit_export_job(user_id, plan_ids, format, exporter, processes=1):
+    """Ставит экспорт выбранных планов в очередь, возвращает id задания"""
+    app = current_app._get_current_object()
+    cleanup_expired_jobs(app)
+
+    job = {
+        'id': str(uuid.uuid4()),
+        'user_id': user_id,
+        'format': format,
+        'status': 'queued',
+        'done': 0,
+        'total': len(plan_ids),
+        'error': None,
+        'created_at': time.time(),
+    }
+    _save_meta(app, job)
+    _get_executor(app).submit(_run_job, app, job, list(plan_ids), exporter, processes)
+    return job['id']
+
+
+def _run_job(app, job, plan_ids, exporter, processes):
+    with app.app_context():
+        final_path = archive_path(app, job['id'])
+        tmp_path = f"{final_path}.part"
+        job['status'] = 'running'
+        _save_meta(app, job)
+        _emit_progress(job)
+
+        def entries():
+            snapshots = load_plan_snapshots(plan_ids)
+            for fname, content in render_many(exporter, snapshots, processes):
+                yield fname, content
+                job['done'] += 1
+                _save_meta(app, job)
+                _emit_progress(job)
+
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter_zip(entries()):
+                    f.write(chunk)
+            os.replace(tmp_path, final_path)
+            job['status'] = 'finished'
+        except Exception as e:
+            app.logger.error(f"Export job {job['id']} failed: {str(e)}")
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            db.session.remove()
+
+        _save_meta(app, job)
+        _emit_progress(job)
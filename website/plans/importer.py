@@ -0,0 +1,323 @@
+"""
+Массовая загрузка мероприятий и показателей плана из файлов выгрузки (XLSX/XML).
+
+Принимаются те же макеты, что формирует export.py. Все строки проверяются
+за один проход (ошибки собираются списком), мероприятия вставляются одним
+INSERT (executemany), расчетные показатели пересчитываются один раз.
+"""
+from decimal import Decimal, InvalidOperation
+
+from .. import db
+from ..models import EconExec, EconMeasure, IndicatorUsage, to_decimal_3
+from .indicators import DERIVED_ORDER, ECON_EXECES, indicator_sources, recompute_derived_indicators
+from .reference import get_reference
+
+ALLOWED_EXTENSIONS = {'xlsx', 'xml'}
+
+# Колонки строки мероприятия в листах 'Часть 2'/'Часть 3' (после №, кода, наименования, ед. изм.)
+EXEC_COLUMNS = (
+    'Volume', 'EffTut', 'EffRub', 'ExpectedQuarter', 'EffCurrYear', 'Payback',
+    'VolumeFin', 'BudgetState', 'BudgetRep', 'BudgetLoc', 'BudgetOther',
+    'MoneyOwn', 'MoneyLoan', 'MoneyOther',
+)
+
+# Элементы <row> раздела part3 в XML -> колонки EconExec
+XML_EXEC_FIELDS = dict(zip((
+    'volume', 'eff_tut', 'eff_rub', 'expected_quarter', 'eff_curr_year', 'payback',
+    'volume_fin', 'budget_state', 'budget_rep', 'budget_loc', 'budget_other',
+    'money_own', 'money_loan', 'money_other',
+), EXEC_COLUMNS))
+
+XML_PERIOD_FIELDS = {'prev_year': 'QYearPrev', 'curr_year': 'QYearCurr', 'next_year': 'QYearNext'}
+
+XLSX_EXEC_SHEETS = ('Часть 2', 'Часть 3')
+XLSX_EXEC_FIRST_ROW = 8       # строки 3-6 - шапка, 7 - номера колонок
+XLSX_INDICATORS_SHEET = 'Часть 1'
+XLSX_INDICATORS_FIRST_ROW = 4
+
+
+class PlanImportError(ValueError):
+    """Файл не прошел проверку; errors - список сообщений по строкам"""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def _is_empty(value):
+    return value is None or (isinstance(value, str) and value.strip() in ("", "None", "-"))
+
+
+def _decimal(value):
+    if _is_empty(value):
+        return None
+    if isinstance(value, str):
+        value = value.strip().replace(" ", "").replace(",", ".")
+    try:
+        result = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(value)
+    if not result.is_finite():
+        raise ValueError(value)
+    return result
+
+
+def _exec_row(source, code, name, values, directions, errors):
+    """Проверенная строка мероприятия {колонка: значение} или None"""
+    row = {'code': code, 'name': (name or "").strip()}
+    ok = True
+
+    if not row['name']:
+        errors.append(f"{source}: не указано наименование мероприятия")
+        ok = False
+    if code not in directions:
+        errors.append(f"{source}: неизвестный код направления «{code}»")
+        ok = False
+
+    for column, raw in values.items():
+        try:
+            value = _decimal(raw)
+        except ValueError:
+            errors.append(f"{source}: некорректное значение «{raw}» в поле {column}")
+            ok = False
+            continue
+        if column in ('Volume', 'ExpectedQuarter'):
+            value = int(value) if value is not None else None
+        elif value is not None:
+            value = to_decimal_3(value)
+        row[column] = value
+
+    quarter = row.get('ExpectedQuarter')
+    if quarter is not None and quarter not in (1, 2, 3, 4):
+        errors.append(f"{source}: квартал внедрения должен быть от 1 до 4")
+        ok = False
+
+    return row if ok else None
+
+
+def _indicator_row(source, key, values, indicators, errors):
+    """Проверенная строка показателя {'indicator': IndicatorRef, период: значение} или None"""
+    indicator = indicators.get(key)
+    if indicator is None:
+        errors.append(f"{source}: неизвестный показатель «{key}»")
+        return None
+
+    row = {'indicator': indicator}
+    for period, raw in values.items():
+        try:
+            value = _decimal(raw)
+        except ValueError:
+            errors.append(f"{source}: некорректное значение «{raw}»")
+            return None
+        row[period] = to_decimal_3(value) if value is not None else None
+    return row
+
+
+def _reference_maps():
+    reference = get_reference()
+    directions = {d.code: d for d in reference.directions}
+    by_code = {}
+    by_name = {}
+    for indicator in reference.indicators.values():
+        by_code[indicator.code] = indicator
+        if indicator.name:
+            by_name.setdefault(indicator.name.strip(), indicator)
+    return directions, by_code, by_name
+
+
+def parse_xml(stream):
+    """Разбор XML выгрузки одного плана: (мероприятия, значения направлений part2, показатели)"""
+    import xml.etree.ElementTree as ET
+
+    directions, indicators_by_code, indicators_by_name = _reference_maps()
+    errors = []
+
+    try:
+        root = ET.parse(stream).getroot()
+    except ET.ParseError as e:
+        raise PlanImportError([f"Некорректный XML: {e}"])
+
+    plans = [root] if root.tag == 'plan' else root.findall('plan')
+    if len(plans) != 1:
+        raise PlanImportError(["Файл должен содержать ровно один план"])
+    plan = plans[0]
+
+    def text(row, tag):
+        return (row.findtext(tag) or "").strip()
+
+    indicators = []
+    for number, row in enumerate(plan.iterfind('part1/row'), start=1):
+        code = text(row, 'code')
+        name = text(row, 'name')
+        lookup = indicators_by_code if code else indicators_by_name
+        key = code or name
+        if lookup.get(key) is not None and lookup[key].code in DERIVED_ORDER:
+            continue
+        values = {period: text(row, tag) for tag, period in XML_PERIOD_FIELDS.items()}
+        parsed = _indicator_row(f"Часть 1, строка {number}", key, values, lookup, errors)
+        if parsed:
+            indicators.append(parsed)
+
+    measures = {}
+    for number, row in enumerate(plan.iterfind('part2/row'), start=1):
+        source = f"Часть 2, строка {number}"
+        code = text(row, 'code')
+        if code not in directions:
+            errors.append(f"{source}: неизвестный код направления «{code}»")
+            continue
+        try:
+            measures[code] = {
+                'year_econ': to_decimal_3(_decimal(text(row, 'year_econ')) or 0),
+                'estim_econ': to_decimal_3(_decimal(text(row, 'estim_econ')) or 0),
+            }
+        except ValueError:
+            errors.append(f"{source}: некорректное значение экономии")
+
+    execs = []
+    for section in plan.iterfind('part3/section'):
+        title = section.get('title') or "Часть 3"
+        for number, row in enumerate(section.iterfind('row'), start=1):
+            values = {column: text(row, tag) for tag, column in XML_EXEC_FIELDS.items()}
+            parsed = _exec_row(f"{title}, строка {number}", text(row, 'code'), text(row, 'name'),
+                               values, directions, errors)
+            if parsed:
+                execs.append(parsed)
+
+    if errors:
+        raise PlanImportError(errors)
+    return execs, measures, indicators
+
+
+def parse_xlsx(stream):
+    """Разбор XLSX выгрузки плана: (мероприятия, {}, показатели) - экономия по направлениям в XLSX не выгружается"""
+    from openpyxl import load_workbook
+
+    directions, _, indicators_by_name = _reference_maps()
+    errors = []
+
+    try:
+        wb = load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise PlanImportError([f"Некорректный файл XLSX: {e}"])
+
+    indicators = []
+    if XLSX_INDICATORS_SHEET in wb.sheetnames:
+        ws = wb[XLSX_INDICATORS_SHEET]
+        for row_number, row in enumerate(
+                ws.iter_rows(min_row=XLSX_INDICATORS_FIRST_ROW, max_col=7, values_only=True),
+                start=XLSX_INDICATORS_FIRST_ROW):
+            name = row[1] if len(row) > 1 else None
+            # строки подписей и пустые строки не содержат значений по годам
+            if not isinstance(name, str) or not name.strip() or not any(
+                    isinstance(value, (int, float, Decimal)) for value in row[3:6]):
+                continue
+            indicator = indicators_by_name.get(name.strip())
+            if indicator is not None and indicator.code in DERIVED_ORDER:
+                continue
+            values = dict(zip(('QYearPrev', 'QYearCurr', 'QYearNext'), row[3:6]))
+            parsed = _indicator_row(f"{XLSX_INDICATORS_SHEET}, строка {row_number}", name.strip(),
+                                    values, indicators_by_name, errors)
+            if parsed:
+                indicators.append(parsed)
+
+    execs = []
+    for sheet in XLSX_EXEC_SHEETS:
+        if sheet not in wb.sheetnames:
+            continue
+        ws = wb[sheet]
+        for row_number, row in enumerate(
+                ws.iter_rows(min_row=XLSX_EXEC_FIRST_ROW, max_col=18, values_only=True),
+                start=XLSX_EXEC_FIRST_ROW):
+            # строка мероприятия: № п/п - число, наименование - текст;
+            # заголовки разделов, «Итого по разделу» и поквартальные итоги пропускаются
+            if len(row) < 18 or isinstance(row[0], bool) or not isinstance(row[0], (int, float)):
+                continue
+            if not isinstance(row[2], str):
+                continue
+            code = str(row[1]).strip() if row[1] is not None else ""
+            values = dict(zip(EXEC_COLUMNS, row[4:18]))
+            parsed = _exec_row(f"{sheet}, строка {row_number}", code, row[2],
+                               values, directions, errors)
+            if parsed:
+                execs.append(parsed)
+
+    wb.close()
+
+    if errors:
+        raise PlanImportError(errors)
+    return execs, {}, indicators
+
+
+def import_plan_file(plan, uploaded_file, replace=False):
+    """
+    Загружает мероприятия и показатели из файла выгрузки в план.
+    replace=True - мероприятия плана заменяются загруженными, иначе добавляются.
+    Показатели обновляются по индикатору, отсутствующие - добавляются.
+    Коммит и отметка изменения плана - за вызывающим.
+    Возвращает (число мероприятий, число показателей).
+    """
+    filename = uploaded_file.filename or ""
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ""
+    if extension not in ALLOWED_EXTENSIONS:
+        raise PlanImportError([
+            f'Неверный формат файла. Разрешены только: {", ".join(sorted(ALLOWED_EXTENSIONS))}'
+        ])
+
+    parser = parse_xlsx if extension == 'xlsx' else parse_xml
+    execs, measure_values, indicators = parser(uploaded_file.stream)
+    if not execs and not measure_values and not indicators:
+        raise PlanImportError(["В файле нет мероприятий и показателей"])
+
+    directions = {d.code: d for d in get_reference().directions}
+    measures = {m.id_direction: m for m in EconMeasure.query.filter_by(id_plan=plan.id)}
+
+    for code in {row['code'] for row in execs} | set(measure_values):
+        direction = directions[code]
+        measure = measures.get(direction.id)
+        if measure is None:
+            measure = EconMeasure(id_plan=plan.id, id_direction=direction.id,
+                                  year_econ=Decimal('0.000'), estim_econ=Decimal('0.000'))
+            db.session.add(measure)
+            measures[direction.id] = measure
+        if code in measure_values:
+            measure.year_econ = measure_values[code]['year_econ']
+            measure.estim_econ = measure_values[code]['estim_econ']
+    db.session.flush()
+
+    sources = set()
+    if execs or replace:
+        sources.add(ECON_EXECES)
+    if replace:
+        EconExec.query.filter_by(id_plan=plan.id).delete(synchronize_session=False)
+
+    if execs:
+        db.session.execute(EconExec.__table__.insert(), [
+            {
+                'id_measure': measures[directions[row['code']].id].id,
+                'id_plan': plan.id,
+                'name': row['name'],
+                'is_local': bool(directions[row['code']].is_local),
+                **{column: row.get(column) for column in EXEC_COLUMNS},
+            }
+            for row in execs
+        ])
+
+    if indicators:
+        usages = {u.id_indicator: u for u in IndicatorUsage.query.filter_by(id_plan=plan.id)}
+        new_usages = {}
+        for row in indicators:
+            indicator = row['indicator']
+            values = {period: row[period] for period in ('QYearPrev', 'QYearCurr', 'QYearNext')}
+            usage = usages.get(indicator.id)
+            if usage is not None:
+                for period, value in values.items():
+                    setattr(usage, period, value)
+            else:
+                new_usages[indicator.id] = {'id_plan': plan.id, 'id_indicator': indicator.id, **values}
+            sources |= indicator_sources(indicator)
+        if new_usages:
+            db.session.execute(IndicatorUsage.__table__.insert(), list(new_usages.values()))
+
+    db.session.flush()
+    recompute_derived_indicators(plan.id, sources, commit=False)
+    return len(execs), len(indicators)
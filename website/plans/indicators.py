@@ -0,0 +1,154 @@
+from decimal import Decimal
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .. import db
+from ..models import EconExec, Indicator, IndicatorUsage, to_decimal_3
+
+PERIODS = ('QYearPrev', 'QYearCurr', 'QYearNext')
+
+# Источники изменений, не являющиеся строками показателей
+ECON_EXECES = 'econ_execes'      # мероприятия плана (EconExec)
+NON_MANDATORY = 'non_mandatory'  # любой необязательный показатель
+
+# Граф зависимостей расчетных строк: код -> от чего зависит
+DERIVED_DEPENDENCIES = {
+    '1000': {NON_MANDATORY},
+    '260': {'1000', '1105', '1405', '1104', '1404'},
+    '9900': {ECON_EXECES},
+    '9999': {'9900', '9910'},
+}
+
+# Порядок расчета (топологический порядок графа)
+DERIVED_ORDER = ('1000', '260', '9900', '9999')
+
+
+def indicator_sources(indicator):
+    """Источник изменения для отредактированного показателя"""
+    if indicator is None:
+        return set(DERIVED_ORDER)
+    if not indicator.IsMandatory:
+        return {NON_MANDATORY}
+    return {indicator.code}
+
+
+def affected_nodes(sources=None):
+    """Расчетные строки, которые нужно пересчитать после изменения sources"""
+    if sources is None:
+        return list(DERIVED_ORDER)
+
+    changed = set(sources)
+    affected = []
+    for code in DERIVED_ORDER:
+        if code in changed or DERIVED_DEPENDENCIES[code] & changed:
+            affected.append(code)
+            changed.add(code)
+    return affected
+
+
+def _value(usage, period):
+    if usage is None:
+        return Decimal('0')
+    value = getattr(usage, period)
+    return value if value is not None else Decimal('0')
+
+
+def _load_usages(plan_id, nodes):
+    codes = set(nodes)
+    for code in nodes:
+        codes |= DERIVED_DEPENDENCIES[code]
+
+    row_filter = Indicator.code.in_(codes - {NON_MANDATORY, ECON_EXECES})
+    if NON_MANDATORY in codes:
+        row_filter = or_(row_filter, Indicator.IsMandatory == False)
+
+    return (IndicatorUsage.query
+            .join(IndicatorUsage.indicator)
+            .options(contains_eager(IndicatorUsage.indicator))
+            .filter(IndicatorUsage.id_plan == plan_id, row_filter)
+            .all())
+
+
+def _compute(code, by_code, non_mandatory, econ_total):
+    """Новые значения расчетной строки {период: значение}"""
+    if code == '1000':
+        return {
+            period: to_decimal_3(sum(_value(u, period) for u in non_mandatory))
+            for period in PERIODS
+        }
+
+    if code == '260':
+        if any(c not in by_code for c in DERIVED_DEPENDENCIES['260']):
+            return {}
+
+        def calculate_period(period):
+            base = _value(by_code['1000'], period)
+            diff1 = _value(by_code['1105'], period) - _value(by_code['1405'], period)
+            diff2 = _value(by_code['1104'], period) - _value(by_code['1404'], period)
+            return to_decimal_3(base + (diff1 * Decimal('0.123')) + (diff2 * Decimal('0.143')))
+
+        return {period: calculate_period(period) for period in PERIODS}
+
+    if code == '9900':
+        return {'QYearNext': to_decimal_3(econ_total)}
+
+    if code == '9999':
+        if '9900' not in by_code or '9910' not in by_code:
+            return {}
+        return {'QYearNext': _value(by_code['9900'], 'QYearNext') + _value(by_code['9910'], 'QYearNext')}
+
+    return {}
+
+
+def recompute_derived_indicators(plan_id, sources=None, commit=True):
+    """
+    Пересчитывает расчетные строки (1000, 260, 9900, 9999) плана,
+    затронутые изменением sources, и записывает их одним UPDATE.
+    sources=None - пересчитать все расчетные строки.
+    """
+    nodes = affected_nodes(sources)
+    if not nodes:
+        return {}
+
+    usages = _load_usages(plan_id, nodes)
+    by_code = {u.indicator.code: u for u in usages}
+    non_mandatory = [u for u in usages if not u.indicator.IsMandatory]
+
+    econ_total = 0
+    if '9900' in nodes:
+        econ_total = db.session.query(func.sum(EconExec.EffCurrYear))\
+            .filter(EconExec.id_plan == plan_id, EconExec.EffCurrYear.isnot(None))\
+            .scalar() or 0
+
+    changes = {}
+    for code in nodes:
+        usage = by_code.get(code)
+        if usage is None:
+            continue
+        for period, value in _compute(code, by_code, non_mandatory, econ_total).items():
+            if getattr(usage, period) != value:
+                changes.setdefault(usage.id, {})[period] = value
+            # следующие узлы графа читают уже пересчитанное значение
+            set_committed_value(usage, period, value)
+
+    if changes:
+        table = IndicatorUsage.__table__
+        columns = {period for values in changes.values() for period in values}
+        db.session.execute(
+            table.update()
+            .where(table.c.id.in_(list(changes)))
+            .values({
+                period: case(
+                    {usage_id: values[period] for usage_id, values in changes.items() if period in values},
+                    value=table.c.id,
+                    else_=table.c[period]
+                )
+                for period in columns
+            })
+        )
+
+    if commit:
+        db.session.commit()
+
+    return {code: by_code[code] for code in nodes if code in by_code}
@@ -0,0 +1,107 @@
+"""
+Нарастающие итоги мероприятий плана по кварталам (январь-март ... январь-декабрь).
+
+Итоги по местным, не местным мероприятиям и по всем вместе считаются одним
+запросом для пачки планов: суммы EffCurrYear и VolumeFin группируются по
+(план, is_local, квартал), а нарастающие итоги строят оконные функции.
+Окно по плану без is_local (RANGE до текущего квартала включительно) сразу
+дает общий итог. Если мероприятия плана уже загружены, те же итоги считает
+metrics_from_execes без обращения к БД.
+"""
+from decimal import Decimal
+
+from sqlalchemy import func
+
+from .. import db
+from ..models import EconExec
+
+QUARTER_KEYS = ('jan_mar', 'jan_jun', 'jan_sep', 'jan_dec')
+
+LOCAL = 'local'
+NON_LOCAL = 'non_local'
+TOTAL = 'total'
+
+
+def _zero_totals():
+    return {key: {'eff_curr_year': Decimal('0'), 'volume_fin': Decimal('0')} for key in QUARTER_KEYS}
+
+
+def empty_quarterly_metrics():
+    """Итоги плана без мероприятий: нули по всем кварталам"""
+    return {kind: _zero_totals() for kind in (LOCAL, NON_LOCAL, TOTAL)}
+
+
+def quarterly_metrics(plan_ids):
+    """
+    Нарастающие итоги для пачки планов одним запросом:
+    {plan_id: {'local' | 'non_local' | 'total': {'jan_mar': {'eff_curr_year', 'volume_fin'}, ...}}}.
+    Мероприятия без квартала внедрения или признака is_local в итоги не входят.
+    """
+    plan_ids = {int(plan_id) for plan_id in plan_ids}
+    result = {plan_id: empty_quarterly_metrics() for plan_id in plan_ids}
+    if not plan_ids:
+        return result
+
+    eff = func.sum(EconExec.EffCurrYear)
+    vol = func.sum(EconExec.VolumeFin)
+    by_kind = {'partition_by': (EconExec.id_plan, EconExec.is_local), 'order_by': EconExec.ExpectedQuarter}
+    by_plan = {'partition_by': EconExec.id_plan, 'order_by': EconExec.ExpectedQuarter}
+
+    rows = (db.session.query(
+                EconExec.id_plan, EconExec.is_local, EconExec.ExpectedQuarter,
+                func.sum(eff).over(**by_kind), func.sum(vol).over(**by_kind),
+                func.sum(eff).over(**by_plan), func.sum(vol).over(**by_plan))
+            .filter(EconExec.id_plan.in_(plan_ids),
+                    EconExec.is_local.isnot(None),
+                    EconExec.ExpectedQuarter.between(1, 4))
+            .group_by(EconExec.id_plan, EconExec.is_local, EconExec.ExpectedQuarter)
+            .order_by(EconExec.id_plan, EconExec.ExpectedQuarter)
+            .all())
+
+    # итог квартала без мероприятий равен итогу предыдущего: строка переносится на все следующие кварталы
+    for plan_id, is_local, quarter, kind_eff, kind_vol, total_eff, total_vol in rows:
+        metrics = result[plan_id]
+        kind = LOCAL if is_local else NON_LOCAL
+        for key in QUARTER_KEYS[quarter - 1:]:
+            metrics[kind][key] = {'eff_curr_year': kind_eff or Decimal('0'), 'volume_fin': kind_vol or Decimal('0')}
+            metrics[TOTAL][key] = {'eff_curr_year': total_eff or Decimal('0'), 'volume_fin': total_vol or Decimal('0')}
+    return result
+
+
+def metrics_from_execes(econ_execes):
+    """Те же итоги одного плана по уже загруженным мероприятиям, без запроса"""
+    sums = {kind: {quarter: [Decimal('0'), Decimal('0')] for quarter in (1, 2, 3, 4)}
+            for kind in (LOCAL, NON_LOCAL)}
+    for econ in econ_execes:
+        if econ.is_local is None or econ.ExpectedQuarter not in (1, 2, 3, 4):
+            continue
+        quarter = sums[LOCAL if econ.is_local else NON_LOCAL][econ.ExpectedQuarter]
+        quarter[0] += econ.EffCurrYear or 0
+        quarter[1] += econ.VolumeFin or 0
+
+    result = empty_quarterly_metrics()
+    running = {kind: [Decimal('0'), Decimal('0')] for kind in (LOCAL, NON_LOCAL)}
+    for quarter, key in zip((1, 2, 3, 4), QUARTER_KEYS):
+        for kind in (LOCAL, NON_LOCAL):
+            running[kind][0] += sums[kind][quarter][0]
+            running[kind][1] += sums[kind][quarter][1]
+            result[kind][key] = {'eff_curr_year': running[kind][0], 'volume_fin': running[kind][1]}
+        result[TOTAL][key] = {
+            'eff_curr_year': running[LOCAL][0] + running[NON_LOCAL][0],
+            'volume_fin': running[LOCAL][1] + running[NON_LOCAL][1],
+        }
+    return result
+
+
+def plan_quarterly_metrics(plan_id):
+    """Нарастающие итоги одного плана"""
+    return quarterly_metrics([plan_id])[int(plan_id)]
+
+
+def flat_totals(totals):
+    """{'jan_mar_eff': ..., 'jan_mar_vol': ...} - плоский вид итогов для шаблонов и XLSX"""
+    flat = {}
+    for key in QUARTER_KEYS:
+        flat[f'{key}_eff'] = totals[key]['eff_curr_year']
+        flat[f'{key}_vol'] = totals[key]['volume_fin']
+    return flat
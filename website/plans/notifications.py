@@ -0,0 +1,175 @@
+"""
+Уведомления пользователей: запись в таблицу notifications и доставка через Socket.IO.
+
+notify() добавляет уведомление в текущую транзакцию; событие 'notification'
+уходит в комнату пользователя только после успешного коммита (при откате
+ничего не отправляется). Клиент получает дельты по сокету, а после
+переподключения догружает пропущенное через /api/notifications?since=<id>.
+
+Число непрочитанных хранится в users.unread_notifications и меняется вместе
+с уведомлениями; прочитанные уведомления старше NOTIFICATIONS_RETENTION_DAYS
+переносятся в notifications_archive командой flask archive-notifications.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, insert, literal, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from .. import db, socketio
+from ..events import user_room
+from ..models import Notification, NotificationArchive, User, current_utc_time
+from .search import decode_cursor, encode_cursor
+
+PAGE_SIZE = 20
+
+_PENDING_KEY = 'pending_notifications'
+_READY_KEY = 'flushed_notifications'
+
+
+def serialize_notification(notification):
+    return {
+        'id': notification.id,
+        'message': notification.message,
+        'is_read': notification.is_read,
+        'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def notify(user_id, message):
+    """Добавляет уведомление пользователю; отправка по сокету - после коммита"""
+    notification = Notification(user_id=user_id, message=message, is_read=False,
+                                created_at=current_utc_time())
+    db.session.add(notification)
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(unread_notifications=User.unread_notifications + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.info.setdefault(_PENDING_KEY, []).append(notification)
+    return notification
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed(session, flush_context):
+    pending = session.info.get(_PENDING_KEY)
+    if not pending:
+        return
+    # данные снимаются сразу после вставки: после коммита атрибуты истекают
+    ready = session.info.setdefault(_READY_KEY, [])
+    for notification in [n for n in pending if n.id is not None]:
+        ready.append((notification.user_id, serialize_notification(notification)))
+        pending.remove(notification)
+
+
+@event.listens_for(Session, 'after_commit')
+def _emit_committed(session):
+    session.info.pop(_PENDING_KEY, None)
+    for user_id, payload in session.info.pop(_READY_KEY, []):
+        socketio.emit('notification', payload, to=user_room(user_id))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_pending(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_READY_KEY, None)
+
+
+def _encode(notification):
+    return encode_cursor([notification.created_at.isoformat(), notification.id])
+
+
+def _decode(cursor):
+    values = decode_cursor(cursor)
+    if not values or len(values) != 2:
+        return None
+    try:
+        return datetime.fromisoformat(values[0]), int(values[1])
+    except (TypeError, ValueError):
+        return None
+
+
+def notifications_page(user_id, cursor=None, page_size=PAGE_SIZE):
+    """Страница уведомлений от новых к старым: (уведомления, next_cursor)"""
+    query = Notification.query.filter(Notification.user_id == user_id)
+    key = _decode(cursor)
+    if key is not None:
+        query = query.filter(tuple_(Notification.created_at, Notification.id) < key)
+
+    rows = (query
+            .order_by(Notification.created_at.desc(), Notification.id.desc())
+            .limit(page_size + 1)
+            .all())
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = _encode(rows[-1])
+    return rows, next_cursor
+
+
+def notifications_since(user_id, last_id, limit=PAGE_SIZE):
+    """
+    Уведомления новее last_id от старых к новым (догрузка после переподключения
+    сокета): (уведомления, has_more). Пока has_more - клиент запрашивает
+    следующую порцию от id последнего полученного уведомления.
+    """
+    rows = (Notification.query
+            .filter(Notification.user_id == user_id, Notification.id > last_id)
+            .order_by(Notification.id)
+            .limit(limit + 1)
+            .all())
+    return rows[:limit], len(rows) > limit
+
+
+def unread_count(user_id):
+    """Число непрочитанных - счетчик в users, без COUNT(*) по уведомлениям"""
+    return db.session.query(User.unread_notifications).filter(User.id == user_id).scalar() or 0
+
+
+def mark_all_read(user_id):
+    """
+    Отмечает уведомления прочитанными. Счетчик уменьшается на число реально
+    отмеченных строк: уведомление, добавленное параллельно, остается непрочитанным.
+    """
+    marked = Notification.query.filter(
+        Notification.user_id == user_id, Notification.is_read == False
+    ).update({'is_read': True}, synchronize_session=False)
+    if marked:
+        db.session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(unread_notifications=func.greatest(User.unread_notifications - marked, 0))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def sync_unread_counters(user_id=None):
+    """Пересчитывает счетчики непрочитанных (после правок уведомлений в админ-панели)"""
+    unread = (select(func.count(Notification.id))
+              .where(Notification.user_id == User.id, Notification.is_read == False)
+              .scalar_subquery())
+    stmt = update(User).values(unread_notifications=unread)
+    if user_id is not None:
+        stmt = stmt.where(User.id == user_id)
+    db.session.execute(stmt.execution_options(synchronize_session=False))
+
+
+def archive_notifications(retention_days):
+    """
+    Переносит прочитанные уведомления старше retention_days в notifications_archive
+    одним запросом (DELETE ... RETURNING внутри INSERT ... SELECT). Возвращает число строк.
+    """
+    cutoff = current_utc_time() - timedelta(days=retention_days)
+    table = Notification.__table__
+    moved = (delete(table)
+             .where(table.c.is_read == True, table.c.created_at < cutoff)
+             .returning(table.c.id, table.c.user_id, table.c.message, table.c.is_read, table.c.created_at)
+             .cte('moved'))
+    result = db.session.execute(
+        insert(NotificationArchive.__table__).from_select(
+            ['id', 'user_id', 'message', 'is_read', 'created_at', 'archived_at'],
+            select(moved.c.id, moved.c.user_id, moved.c.message, moved.c.is_read, moved.c.created_at,
+                   literal(current_utc_time()))
+        )
+    )
+    return result.rowcount
@@ -0,0 +1,266 @@
+"""
+PDF-экспорт плана: титульный лист и части 1-3.
+
+Страницы верстаются напрямую из снимка плана средствами reportlab.
+Шрифты и стили регистрируются один раз на процесс (_resources), поэтому
+пакетный экспорт сотен планов не разбирает TTF-файлы заново.
+"""
+import io
+import os
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import (
+    PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+)
+
+from .export import (
+    plan_ministry_name, plan_owner_name, split_econ_execes
+)
+from .metrics import LOCAL, NON_LOCAL
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'fonts')
+
+FONTS = {
+    'Montserrat': 'Montserrat-Regular.ttf',
+    'Montserrat-Bold': 'Montserrat-Bold.ttf',
+    'Montserrat-Italic': 'Montserrat-Italic.ttf',
+    'Montserrat-BoldItalic': 'Montserrat-BoldItalic.ttf',
+}
+
+PAGE_SIZE = landscape(A4)
+MARGIN = 10 * mm
+
+QUARTERS = (
+    ("Январь–Март", "jan_mar"),
+    ("Январь–Июнь", "jan_jun"),
+    ("Январь–Сентябрь", "jan_sep"),
+    ("Январь–Декабрь", "jan_dec"),
+)
+
+EXEC_HEADERS = (
+    "№ п/п", "Код", "Наименование мероприятия", "Ед. изм.", "Объем внедрения",
+    "Эффект, т у.т.", "Эффект, тыс. руб.", "Квартал внедрения",
+    "Эффект в текущем году, т у.т.", "Срок окупаемости, лет",
+    "Объем финансирования, тыс. руб.", "Респ. бюджет (госпрограмма)",
+    "Респ. бюджет", "Местный бюджет", "Другие бюджетные",
+    "Собственные средства", "Кредиты, займы", "Иные",
+)
+EXEC_FIELDS = (
+    'Volume', 'EffTut', 'EffRub', 'ExpectedQuarter', 'EffCurrYear', 'Payback',
+    'VolumeFin', 'BudgetState', 'BudgetRep', 'BudgetLoc', 'BudgetOther',
+    'MoneyOwn', 'MoneyLoan', 'MoneyOther',
+)
+EXEC_SUM_FIELDS = (
+    'Volume', 'EffTut', 'EffRub', 'EffCurrYear', 'VolumeFin', 'BudgetState',
+    'BudgetRep', 'BudgetLoc', 'BudgetOther', 'MoneyOwn', 'MoneyLoan', 'MoneyOther',
+)
+
+
+@lru_cache(maxsize=None)
+def _resources():
+    """Шрифты, стили абзацев и таблиц - один раз на процесс"""
+    for name, filename in FONTS.items():
+        pdfmetrics.registerFont(TTFont(name, os.path.join(FONTS_DIR, filename)))
+    pdfmetrics.registerFontFamily(
+        'Montserrat', normal='Montserrat', bold='Montserrat-Bold',
+        italic='Montserrat-Italic', boldItalic='Montserrat-BoldItalic'
+    )
+
+    styles = {
+        'title': ParagraphStyle('title', fontName='Montserrat-Bold', fontSize=16,
+                                leading=20, alignment=TA_CENTER, spaceAfter=6 * mm),
+        'heading': ParagraphStyle('heading', fontName='Montserrat-Bold', fontSize=11,
+                                  leading=14, alignment=TA_CENTER, spaceAfter=4 * mm),
+        'text': ParagraphStyle('text', fontName='Montserrat', fontSize=10, leading=13),
+        'center': ParagraphStyle('center', fontName='Montserrat', fontSize=11,
+                                 leading=14, alignment=TA_CENTER),
+        'right': ParagraphStyle('right', fontName='Montserrat', fontSize=10,
+                                leading=13, alignment=TA_RIGHT),
+        'cell': ParagraphStyle('cell', fontName='Montserrat', fontSize=6.5,
+                               leading=8, alignment=TA_LEFT),
+        'header_cell': ParagraphStyle('header_cell', fontName='Montserrat-Bold',
+                                      fontSize=6, leading=7.5, alignment=TA_CENTER),
+    }
+
+    base = [
+        ('FONTNAME', (0, 0), (-1, -1), 'Montserrat'),
+        ('FONTSIZE', (0, 0), (-1, -1), 6.5),
+        ('LEADING', (0, 0), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 0.4, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#EEEEEE')),
+        ('TOPPADDING', (0, 0), (-1, -1), 1.5),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 1.5),
+    ]
+    table_styles = {
+        'part1': TableStyle(base + [('ALIGN', (1, 1), (1, -1), 'LEFT')]),
+        'part2': TableStyle(base + [('ALIGN', (2, 1), (2, -1), 'LEFT')]),
+        'totals': TableStyle(base),
+    }
+
+    width = PAGE_SIZE[0] - 2 * MARGIN
+    name_width = width * 0.22
+    rest = (width - name_width) / (len(EXEC_HEADERS) - 1)
+    col_widths = {
+        'part1': [width * w for w in (0.06, 0.44, 0.1, 0.09, 0.09, 0.09, 0.13)],
+        'exec': [rest, rest, name_width] + [rest] * (len(EXEC_HEADERS) - 3),
+        'totals': [width * 0.25, width * 0.25, width * 0.25],
+    }
+    return styles, table_styles, col_widths
+
+
+def _fmt(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def _group(value):
+    if value in (None, ""):
+        return ""
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _title_page(plan, styles):
+    story = [
+        Paragraph("СОГЛАСОВАНО<br/>Департамент по энергоэффективности Госстандарта", styles['text']),
+        Spacer(1, 4 * mm),
+        Paragraph(f"УТВЕРЖДАЮ<br/>{escape(plan_ministry_name(plan))}", styles['right']),
+        Spacer(1, 30 * mm),
+        Paragraph("ПЛАН МЕРОПРИЯТИЙ ПО ЭНЕРГОСБЕРЕЖЕНИЮ", styles['title']),
+        Paragraph(escape(plan_owner_name(plan)), styles['center']),
+        Paragraph(f"на {plan.year} год", styles['center']),
+        Spacer(1, 20 * mm),
+        Paragraph("Целевые показатели:", styles['text']),
+        Paragraph(
+            f"показатель энергосбережения - {_fmt(plan.energy_saving)}% "
+            f"(задание по экономии ТЭР - {_fmt(plan.share_fuel)} т у.т.); "
+            f"доля местных ТЭР в КПТ - {_fmt(plan.saving_fuel)}%; "
+            f"доля возобновляемых источников энергии в КПТ - {_fmt(plan.share_energy)}%.",
+            styles['text']
+        ),
+        PageBreak(),
+    ]
+    return story
+
+
+def _part1(plan, styles, table_styles, col_widths):
+    headers = [
+        "№ п/п", "Основные показатели использования ТЭР", "Единица измерения",
+        f"{plan.year - 1} г. отчет", f"{plan.year} г. оценка", f"{plan.year + 1} г. прогноз",
+        "Изменение к предыдущему году",
+    ]
+    rows = [[Paragraph(text, styles['header_cell']) for text in headers]]
+
+    previous_group = None
+    for usage in sorted(plan.indicators_usage, key=lambda u: (u.indicator.Group or 0, u.indicator.RowN or 0)):
+        indicator = usage.indicator
+        group_value = indicator.Group if indicator.Group != previous_group else ""
+        previous_group = indicator.Group
+        rows.append([
+            _group(group_value),
+            Paragraph(escape(indicator.name or "-"), styles['cell']),
+            indicator.unit.name if indicator.unit else "",
+            _fmt(usage.QYearPrev or 0),
+            _fmt(usage.QYearCurr or 0),
+            _fmt(usage.QYearNext or 0),
+            _fmt((usage.QYearNext or 0) - (usage.QYearCurr or 0)),
+        ])
+
+    return [
+        Paragraph("Часть 1. Показатели использования топливно-энергетических ресурсов", styles['heading']),
+        Table(rows, colWidths=col_widths['part1'], repeatRows=1, style=table_styles['part1']),
+        PageBreak(),
+    ]
+
+
+def _exec_table(execs, styles, table_styles, col_widths):
+    rows = [[Paragraph(text, styles['header_cell']) for text in EXEC_HEADERS]]
+    sums = dict.fromkeys(EXEC_SUM_FIELDS, 0)
+    for idx, econ in enumerate(execs, start=1):
+        direction = econ.econ_measures.direction if econ.econ_measures else None
+        row = [
+            str(idx),
+            direction.code if direction else "",
+            Paragraph(escape(econ.name or ""), styles['cell']),
+            direction.unit.name if direction and direction.unit else "",
+        ]
+        row.extend(_fmt(getattr(econ, field)) for field in EXEC_FIELDS)
+        rows.append(row)
+        for field in EXEC_SUM_FIELDS:
+            sums[field] += getattr(econ, field) or 0
+
+    totals = ["Итого по разделу:", "", "", ""]
+    totals.extend(_fmt(sums[field]) if field in sums else "" for field in EXEC_FIELDS)
+    rows.append(totals)
+
+    style = TableStyle(table_styles['part2'].getCommands() + [
+        ('SPAN', (0, -1), (3, -1)),
+        ('FONTNAME', (0, -1), (-1, -1), 'Montserrat-Italic'),
+    ])
+    return Table(rows, colWidths=col_widths['exec'], repeatRows=1, style=style)
+
+
+def _quarter_totals(totals, styles, table_styles, col_widths):
+    rows = [[
+        Paragraph("Период", styles['header_cell']),
+        Paragraph("Эффект нарастающим итогом, т у.т.", styles['header_cell']),
+        Paragraph("Объем финансирования нарастающим итогом, тыс. руб.", styles['header_cell']),
+    ]]
+    for label, key in QUARTERS:
+        rows.append([label, _fmt(totals[key]['eff_curr_year']), _fmt(totals[key]['volume_fin'])])
+    return Table(rows, colWidths=col_widths['totals'], style=table_styles['totals'], hAlign='LEFT')
+
+
+def _exec_part(title, section, execs, totals, resources):
+    styles, table_styles, col_widths = resources
+    return [
+        Paragraph(title, styles['heading']),
+        Paragraph(section, styles['text']),
+        Spacer(1, 2 * mm),
+        _exec_table(execs, styles, table_styles, col_widths),
+        Spacer(1, 4 * mm),
+        _quarter_totals(totals, styles, table_styles, col_widths),
+    ]
+
+
+def render_plan_pdf(plan):
+    """PDF плана (титул и части 1-3) в BytesIO"""
+    resources = _resources()
+    styles, table_styles, col_widths = resources
+    local_execs, non_local_execs = split_econ_execes(plan)
+
+    story = _title_page(plan, styles)
+    story += _part1(plan, styles, table_styles, col_widths)
+    story += _exec_part(
+        f"Часть 2. Мероприятия по экономии топливно-энергетических ресурсов на {plan.year} год",
+        "Раздел 2. Мероприятия по экономии топливно-энергетических ресурсов",
+        non_local_execs, plan.quarterly_metrics[NON_LOCAL], resources
+    )
+    story.append(PageBreak())
+    story += _exec_part(
+        "Часть 3. Мероприятия по увеличению использования местных топливно-энергетических ресурсов",
+        "Раздел 3. Мероприятия по увеличению использования местных топливно-энергетических ресурсов",
+        local_execs, plan.quarterly_metrics[LOCAL], resources
+    )
+
+    file_stream = io.BytesIO()
+    doc = SimpleDocTemplate(
+        file_stream, pagesize=PAGE_SIZE,
+        leftMargin=MARGIN, rightMargin=MARGIN, topMargin=MARGIN, bottomMargin=MARGIN,
+        title=f"План мероприятий по энергосбережению на {plan.year} год",
+    )
+    doc.build(story)
+    file_stream.seek(0)
+    return file_stream
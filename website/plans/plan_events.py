@@ -0,0 +1,39 @@
+"""
+Данные страницы мероприятий плана (plan_events) за два запроса.
+
+Направления плана загружаются вместе с направлением и единицей измерения,
+мероприятия - одним запросом; ссылка мероприятия на направление плана берется
+из уже загруженных объектов (identity map), без отдельных SELECT. Разделение на
+местные и не местные мероприятия и нарастающие итоги по кварталам считаются
+в памяти по тем же строкам.
+"""
+from sqlalchemy.orm import contains_eager, joinedload
+
+from ..models import Direction, EconExec, EconMeasure
+from .metrics import TOTAL, flat_totals, metrics_from_execes
+
+
+def _direction_code(econ):
+    direction = econ.econ_measures.direction if econ.econ_measures else None
+    return (direction.code or '') if direction else ''
+
+
+def load_plan_events(plan_id):
+    """Переменные шаблона plan_events.html для плана"""
+    econ_measures = (
+        EconMeasure.query
+        .filter(EconMeasure.id_plan == plan_id)
+        .join(EconMeasure.direction)
+        .options(contains_eager(EconMeasure.direction).joinedload(Direction.unit))
+        .order_by(Direction.code)
+        .all()
+    )
+    econ_execes = EconExec.query.filter(EconExec.id_plan == plan_id).order_by(EconExec.id).all()
+
+    return {
+        'econ_measures': econ_measures,
+        'econ_exec': sorted(econ_execes, key=_direction_code),
+        'local_econ_execes': [econ for econ in econ_execes if econ.is_local == True],
+        'non_local_econ_execes': [econ for econ in econ_execes if econ.is_local == False],
+        'total_metrics': flat_totals(metrics_from_execes(econ_execes)[TOTAL]),
+    }
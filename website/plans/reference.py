@@ -0,0 +1,141 @@
+"""
+Кэш справочников (единицы измерения, направления, показатели) в памяти процесса.
+
+Справочники меняются только через админ-панель. Каждое изменение увеличивает
+счетчик поколения в таблице cache_generations; воркеры сверяют его не чаще
+раза в REFERENCE_CACHE_CHECK_INTERVAL секунд и перечитывают справочники,
+только если поколение изменилось. В кэше лежат неизменяемые копии, а не
+ORM-объекты, поэтому они не привязаны к сессии запроса.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+
+from .. import db
+from ..models import CacheGeneration, Direction, Indicator, Unit
+
+GENERATION_NAME = 'reference'
+
+
+@dataclass(frozen=True)
+class UnitRef:
+    id: int
+    code: str
+    name: str
+
+
+@dataclass(frozen=True)
+class DirectionRef:
+    id: int
+    code: str
+    name: str
+    is_local: Optional[bool]
+    id_unit: int
+    unit: Optional[UnitRef]
+
+
+@dataclass(frozen=True)
+class IndicatorRef:
+    id: int
+    code: str
+    name: str
+    CoeffToTut: Optional[Decimal]
+    IsMandatory: Optional[bool]
+    Group: Optional[float]
+    RowN: Optional[int]
+    id_unit: int
+    unit: Optional[UnitRef]
+
+
+@dataclass(frozen=True)
+class ReferenceData:
+    generation: int
+    units: Dict[int, UnitRef]
+    directions: Tuple[DirectionRef, ...]
+    indicators: Dict[int, IndicatorRef]
+
+    @property
+    def mandatory_indicators(self):
+        return [i for i in self.indicators.values() if i.IsMandatory]
+
+    @property
+    def non_mandatory_indicators(self):
+        return [i for i in self.indicators.values() if not i.IsMandatory]
+
+    def indicator(self, indicator_id):
+        try:
+            return self.indicators.get(int(indicator_id))
+        except (TypeError, ValueError):
+            return None
+
+
+_cache = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _current_generation():
+    generation = db.session.query(CacheGeneration.generation)\
+        .filter(CacheGeneration.name == GENERATION_NAME)\
+        .scalar()
+    return generation or 0
+
+
+def _load(generation):
+    units = {
+        unit.id: UnitRef(id=unit.id, code=unit.code, name=unit.name)
+        for unit in Unit.query.all()
+    }
+    directions = tuple(
+        DirectionRef(
+            id=d.id, code=d.code, name=d.name, is_local=d.is_local,
+            id_unit=d.id_unit, unit=units.get(d.id_unit)
+        )
+        for d in Direction.query.order_by(Direction.code, Direction.id).all()
+    )
+    indicators = {
+        i.id: IndicatorRef(
+            id=i.id, code=i.code, name=i.name, CoeffToTut=i.CoeffToTut,
+            IsMandatory=i.IsMandatory, Group=i.Group, RowN=i.RowN,
+            id_unit=i.id_unit, unit=units.get(i.id_unit)
+        )
+        for i in Indicator.query.order_by(Indicator.Group, Indicator.RowN, Indicator.id).all()
+    }
+    return ReferenceData(generation=generation, units=units, directions=directions, indicators=indicators)
+
+
+def get_reference():
+    """Справочники текущего поколения"""
+    global _cache, _checked_at
+    interval = current_app.config.get('REFERENCE_CACHE_CHECK_INTERVAL', 5)
+
+    with _lock:
+        cache, checked_at = _cache, _checked_at
+    if cache is not None and time.monotonic() - checked_at < interval:
+        return cache
+
+    generation = _current_generation()
+    if cache is None or cache.generation != generation:
+        cache = _load(generation)
+
+    with _lock:
+        _cache, _checked_at = cache, time.monotonic()
+    return cache
+
+
+def bump_reference_generation():
+    """Отмечает изменение справочников для всех воркеров и сбрасывает кэш текущего"""
+    global _cache
+    stmt = insert(CacheGeneration).values(name=GENERATION_NAME, generation=1)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[CacheGeneration.name],
+        set_={'generation': CacheGeneration.generation + 1}
+    ))
+    db.session.commit()
+    with _lock:
+        _cache = None
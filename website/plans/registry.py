@@ -0,0 +1,304 @@
+"""
+Загрузка и синхронизация реестра организаций и министерств из DBF-выгрузок.
+
+Записи DBF читаются потоком, дубликаты по ОКПО (и по коду министерства)
+отбрасываются в памяти - выигрывает первая запись, как при прежней загрузке
+строка за строкой. В базу данные пишутся пакетами INSERT ... ON CONFLICT DO UPDATE,
+поэтому загрузку можно повторять: существующие строки обновляются, только
+если изменились. Порядок вставки сохраняется - от него зависят id организаций.
+
+sync_registry применяет ежемесячную выгрузку инкрементально: сравнивает ее
+с таблицами и выполняет только вставки, обновления и деактивации (is_active).
+Обе функции сообщают, сколько организаций сменили министерство: сводки
+(rollups) группируются по министерству, команды после этого пересчитывают их.
+"""
+import os
+
+from sqlalchemy import bindparam, or_, update
+from sqlalchemy.dialects.postgresql import insert
+
+from .. import db
+from ..models import Ministry, Organization
+
+REGISTRY_BATCH_SIZE = 1000
+
+ORGANIZATION_COLUMNS = ('OKPO', 'NAME', 'MIN', 'UNP')
+MINISTRY_COLUMNS = ('MIN', 'NAME')
+
+_FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'files')
+
+# Порядок файлов определяет id организаций, на которые ссылаются начальные пользователи
+ORGANIZATION_FILES = tuple(
+    os.path.join(_FILES_DIR, 'organizations', name) for name in (
+        'Брест.dbf', 'Витебск.dbf', 'Гомель.dbf', 'Гродно.dbf',
+        'Минск.dbf', 'Минск_область.dbf', 'Могилев.dbf',
+    )
+)
+MINISTRY_FILES = (
+    os.path.join(_FILES_DIR, 'ministerstvo', 'MinskReg_min.dbf'),
+)
+
+# Служебные организации (областные управления и Департамент), которых нет в реестре:
+# создаются при первичном заполнении и не деактивируются синхронизацией
+SERVICE_ORGANIZATIONS = (
+    ('Брестское областное управление', '100000001000'),
+    ('Витебское областное управление', '200000002000'),
+    ('Гомельское областное управление', '300000003000'),
+    ('Гродненское областное управление', '400000004000'),
+    ('Управление г. Минск', '500000005000'),
+    ('Минское областное управление', '600000006000'),
+    ('Могилевское областное управление', '700000007000'),
+    ('Департамент по энергоэффективности', '800000008000'),
+)
+
+
+def iter_dbf(path, columns):
+    """Записи DBF по одной, без загрузки файла целиком"""
+    from dbfread import DBF
+    for record in DBF(path, load=False):
+        yield {column: record.get(column) for column in columns}
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _code(value):
+    """Код министерства из DBF (число или строка) -> int или None"""
+    value = _text(value)
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+def read_ministries(paths):
+    """{код министерства: наименование} - первая запись по коду"""
+    ministries = {}
+    for path in paths:
+        for record in iter_dbf(path, MINISTRY_COLUMNS):
+            code, name = _code(record['MIN']), _text(record['NAME'])
+            if code is not None and name and code not in ministries:
+                ministries[code] = name
+    return ministries
+
+
+def read_organizations(paths):
+    """{ОКПО: {name, ministry_id, ynp}} в порядке файлов - первая запись по ОКПО"""
+    organizations = {}
+    for path in paths:
+        for record in iter_dbf(path, ORGANIZATION_COLUMNS):
+            okpo, name = _text(record['OKPO']), _text(record['NAME'])
+            if not okpo or not name or okpo in organizations:
+                continue
+            organizations[okpo] = {
+                'name': name,
+                'ministry_id': _code(record['MIN']),
+                'ynp': _text(record['UNP']),
+            }
+    return organizations
+
+
+def _batches(rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
+def upsert_ministries(ministries, batch_size=REGISTRY_BATCH_SIZE):
+    """Вставляет/обновляет министерства пакетами; возвращает число затронутых строк"""
+    rows = [{'id': code, 'name': name, 'is_active': True} for code, name in ministries.items()]
+    table = Ministry.__table__
+    affected = 0
+    for batch in _batches(rows, batch_size):
+        stmt = insert(table).values(batch)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={'name': stmt.excluded.name},
+            where=table.c.name.is_distinct_from(stmt.excluded.name)
+        )
+        affected += db.session.execute(stmt).rowcount
+    return affected
+
+
+def upsert_organizations(organizations, known_ministries, batch_size=REGISTRY_BATCH_SIZE):
+    """
+    Вставляет/обновляет организации пакетами по ОКПО.
+    Код министерства, которого нет в known_ministries, не записывается (NULL).
+    Возвращает (затронуто строк, организаций с неизвестным министерством,
+    существующих организаций, перешедших в другое министерство).
+    """
+    current_ministries = dict(db.session.query(Organization.okpo, Organization.ministry_id))
+    rows = []
+    moved = 0
+    unknown_ministry = 0
+    for okpo, org in organizations.items():
+        ministry_id = org['ministry_id']
+        if ministry_id is not None and ministry_id not in known_ministries:
+            ministry_id = None
+            unknown_ministry += 1
+        if okpo in current_ministries and current_ministries[okpo] != ministry_id:
+            moved += 1
+        rows.append({
+            'okpo': okpo, 'name': org['name'], 'ministry_id': ministry_id,
+            'ynp': org['ynp'], 'is_active': True,
+        })
+
+    table = Organization.__table__
+    affected = 0
+    for batch in _batches(rows, batch_size):
+        stmt = insert(table).values(batch)
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.okpo],
+            set_={'name': excluded.name, 'ministry_id': excluded.ministry_id, 'ynp': excluded.ynp},
+            where=or_(
+                table.c.name.is_distinct_from(excluded.name),
+                table.c.ministry_id.is_distinct_from(excluded.ministry_id),
+                table.c.ynp.is_distinct_from(excluded.ynp),
+            )
+        )
+        affected += db.session.execute(stmt).rowcount
+    return affected, unknown_ministry, moved
+
+
+def load_registry(organization_files=ORGANIZATION_FILES, ministry_files=MINISTRY_FILES,
+                  batch_size=REGISTRY_BATCH_SIZE):
+    """Полная (повторяемая) загрузка реестра; коммит - за вызывающим. Возвращает сводку."""
+    ministries = read_ministries(ministry_files)
+    ministries_affected = upsert_ministries(ministries, batch_size)
+
+    known_ministries = {ministry_id for (ministry_id,) in db.session.query(Ministry.id)}
+    organizations = read_organizations(organization_files)
+    organizations_affected, unknown_ministry, organizations_moved = upsert_organizations(
+        organizations, known_ministries, batch_size)
+
+    return {
+        'ministries': len(ministries),
+        'ministries_changed': ministries_affected,
+        'organizations': len(organizations),
+        'organizations_changed': organizations_affected,
+        'unknown_ministry': unknown_ministry,
+        'organizations_moved': organizations_moved,
+    }
+
+
+def _apply_updates(table, key_column, rows, columns, batch_size):
+    """UPDATE по ключу для каждой строки rows; executemany пакетами"""
+    if not rows:
+        return
+    stmt = (update(table)
+            .where(table.c[key_column] == bindparam('_key'))
+            .values({column: bindparam(f'_{column}') for column in columns}))
+    for batch in _batches(rows, batch_size):
+        db.session.execute(stmt, [
+            {'_key': row[key_column], **{f'_{column}': row[column] for column in columns}}
+            for row in batch
+        ])
+
+
+def _set_active(table, key_column, keys, is_active, batch_size):
+    keys = list(keys)
+    for batch in _batches(keys, batch_size):
+        db.session.execute(
+            table.update().where(table.c[key_column].in_(batch)).values(is_active=is_active)
+        )
+
+
+def _diff(current, incoming, fields, protected=()):
+    """
+    Разница между строками в базе и в новой выгрузке (словари по ключу):
+    (новые ключи, ключи с измененными полями, ключи к деактивации).
+    Возвращенные в реестр неактивные строки попадают в измененные.
+    """
+    inserts, updates, deactivations = [], [], []
+    for key, row in incoming.items():
+        existing = current.get(key)
+        if existing is None:
+            inserts.append(key)
+        elif not existing['is_active'] or any(existing[field] != row[field] for field in fields):
+            updates.append(key)
+    for key, existing in current.items():
+        if key not in incoming and existing['is_active'] and key not in protected:
+            deactivations.append(key)
+    return inserts, updates, deactivations
+
+
+def sync_registry(organization_files=ORGANIZATION_FILES, ministry_files=MINISTRY_FILES,
+                  dry_run=False, batch_size=REGISTRY_BATCH_SIZE):
+    """
+    Инкрементальная синхронизация с новой выгрузкой реестра: вставляются новые
+    министерства/организации, обновляются измененные (и вновь появившиеся -
+    активируются), отсутствующие в выгрузке - деактивируются (is_active=False).
+    Коммит - за вызывающим. dry_run=True - только подсчет изменений.
+    Возвращает сводку {'ministries': {...}, 'organizations': {...}}.
+    """
+    ministry_table = Ministry.__table__
+    organization_table = Organization.__table__
+
+    incoming_ministries = {
+        code: {'id': code, 'name': name, 'is_active': True}
+        for code, name in read_ministries(ministry_files).items()
+    }
+    current_ministries = {
+        row.id: {'id': row.id, 'name': row.name, 'is_active': bool(row.is_active)}
+        for row in db.session.query(Ministry.id, Ministry.name, Ministry.is_active)
+    }
+    m_inserts, m_updates, m_deactivations = _diff(current_ministries, incoming_ministries, ('name',))
+
+    known_ministries = set(current_ministries) | set(incoming_ministries)
+    incoming_organizations = {}
+    unknown_ministry = 0
+    for okpo, org in read_organizations(organization_files).items():
+        ministry_id = org['ministry_id']
+        if ministry_id is not None and ministry_id not in known_ministries:
+            ministry_id = None
+            unknown_ministry += 1
+        incoming_organizations[okpo] = {
+            'okpo': okpo, 'name': org['name'], 'ministry_id': ministry_id,
+            'ynp': org['ynp'], 'is_active': True,
+        }
+    current_organizations = {
+        row.okpo: {'okpo': row.okpo, 'name': row.name, 'ministry_id': row.ministry_id,
+                   'ynp': row.ynp, 'is_active': bool(row.is_active)}
+        for row in db.session.query(
+            Organization.okpo, Organization.name, Organization.ministry_id,
+            Organization.ynp, Organization.is_active
+        )
+    }
+    o_inserts, o_updates, o_deactivations = _diff(
+        current_organizations, incoming_organizations, ('name', 'ministry_id', 'ynp'),
+        protected={okpo for _, okpo in SERVICE_ORGANIZATIONS}
+    )
+    # смена министерства переносит планы организации в другие группы сводок
+    o_moved = [okpo for okpo in o_updates
+               if current_organizations[okpo]['ministry_id'] != incoming_organizations[okpo]['ministry_id']]
+
+    if not dry_run:
+        for batch in _batches([incoming_ministries[key] for key in m_inserts], batch_size):
+            db.session.execute(insert(ministry_table).values(batch).on_conflict_do_nothing())
+        _apply_updates(ministry_table, 'id', [incoming_ministries[key] for key in m_updates],
+                       ('name', 'is_active'), batch_size)
+
+        for batch in _batches([incoming_organizations[key] for key in o_inserts], batch_size):
+            db.session.execute(insert(organization_table).values(batch).on_conflict_do_nothing())
+        _apply_updates(organization_table, 'okpo', [incoming_organizations[key] for key in o_updates],
+                       ('name', 'ministry_id', 'ynp', 'is_active'), batch_size)
+
+        # организации деактивируются раньше министерств, но ссылки на министерства сохраняются
+        _set_active(organization_table, 'okpo', o_deactivations, False, batch_size)
+        _set_active(ministry_table, 'id', m_deactivations, False, batch_size)
+
+    return {
+        'ministries': {
+            'inserted': len(m_inserts), 'updated': len(m_updates), 'deactivated': len(m_deactivations),
+        },
+        'organizations': {
+            'inserted': len(o_inserts), 'updated': len(o_updates), 'deactivated': len(o_deactivations),
+            'unknown_ministry': unknown_ministry, 'moved': len(o_moved),
+        },
+    }
@@ -0,0 +1,330 @@
+"""
+Сводные данные планов организаций по министерствам и регионам.
+
+Сводки считаются в SQL (INSERT ... SELECT ... GROUP BY) и хранятся в таблицах
+IndicatorRollup / EconExecRollup (суммы утвержденных планов) и PlanStatusRollup
+(число планов по статусам). При изменении плана пересчитываются только его
+группы: (министерство, год) и (регион, год); суммы - только при входе плана
+в утвержденные и выходе из них, счетчики статусов - при любой смене статуса.
+Группа пересчитывается как DELETE + INSERT, поэтому параллельные пересчеты
+одной группы сериализуются транзакционными advisory-блокировками.
+Регион - Organization.region_digit (4-я цифра с конца ОКПО), как в get_plans_by_okpo.
+"""
+from sqlalchemy import String, case, cast, delete, func, insert, literal, literal_column, select, text
+
+from .. import db
+from ..models import (
+    Direction, EconExec, EconExecRollup, EconMeasure, Indicator, IndicatorRollup,
+    IndicatorUsage, Organization, Plan, PlanStatusRollup, current_utc_time
+)
+
+MINISTRY = 'ministry'
+REGION = 'region'
+SCOPES = (MINISTRY, REGION)
+
+# Цифра ОКПО, которой соответствует вся республика (Департамент по энергоэффективности)
+ALL_REGIONS_DIGIT = '8'
+
+EXEC_SUM_COLUMNS = (
+    'EffTut', 'EffRub', 'EffCurrYear', 'VolumeFin', 'BudgetState', 'BudgetRep',
+    'BudgetLoc', 'BudgetOther', 'MoneyOwn', 'MoneyLoan', 'MoneyOther',
+)
+
+
+def _scope_key_expr(scope):
+    if scope == MINISTRY:
+        return cast(Organization.ministry_id, String)
+    if scope == REGION:
+        return Organization.region_digit
+    raise ValueError(f"Unknown rollup scope: {scope}")
+
+
+# Статус плана одним выражением; флаги is_* взаимоисключающие
+# (константы - literal_column, чтобы выражение в SELECT и GROUP BY совпадало без параметров)
+PLAN_STATUS_EXPR = case(
+    (Plan.is_approved == True, literal_column("'approved'")),
+    (Plan.is_error == True, literal_column("'error'")),
+    (Plan.is_sent == True, literal_column("'sent'")),
+    (Plan.is_control == True, literal_column("'control'")),
+    else_=literal_column("'draft'")
+)
+
+
+def plan_status(plan):
+    """Статус плана по флагам is_* - в том же порядке, что PLAN_STATUS_EXPR"""
+    for status in ('approved', 'error', 'sent', 'control'):
+        if getattr(plan, f'is_{status}'):
+            return status
+    return 'draft'
+
+
+def _group_filters(scope, scope_key, year, approved_only=True):
+    filters = [Plan.org_id.isnot(None)]
+    if approved_only:
+        filters.append(Plan.is_approved == True)
+    key_expr = _scope_key_expr(scope)
+    if scope == MINISTRY:
+        filters.append(Organization.ministry_id.isnot(None))
+    if scope_key is not None:
+        filters.append(key_expr == str(scope_key))
+    if year is not None:
+        filters.append(Plan.year == year)
+    return key_expr, filters
+
+
+def _advisory_lock(key, shared=False):
+    function = 'pg_advisory_xact_lock_shared' if shared else 'pg_advisory_xact_lock'
+    db.session.execute(text(f"SELECT {function}(hashtext(:key))"), {'key': key})
+
+
+def _lock_groups(groups):
+    """
+    Блокировки до конца транзакции: разделяемые - на scope (полный пересчет
+    берет исключительную), исключительные - на каждую группу. Порядок захвата
+    фиксирован (scope по SCOPES, группы по сортировке), чтобы не было взаимоблокировок.
+    """
+    for scope in SCOPES:
+        if any(group[0] == scope for group in groups):
+            _advisory_lock(f'rollup:{scope}', shared=True)
+    for scope, scope_key, year in groups:
+        _advisory_lock(f'rollup:{scope}:{scope_key}:{year}')
+
+
+def _delete_group(model, scope, scope_key, year):
+    stmt = delete(model).where(model.scope == scope)
+    if scope_key is not None:
+        stmt = stmt.where(model.scope_key == str(scope_key))
+    if year is not None:
+        stmt = stmt.where(model.year == year)
+    db.session.execute(stmt)
+
+
+def _refresh_status_counts(scope, scope_key=None, year=None):
+    """Пересчитывает счетчики планов по статусам; scope_key/year=None - по всем группам"""
+    key_expr, filters = _group_filters(scope, scope_key, year, approved_only=False)
+    _delete_group(PlanStatusRollup, scope, scope_key, year)
+
+    counts = (
+        select(literal(scope), key_expr, Plan.year, PLAN_STATUS_EXPR,
+               func.count(Plan.id), literal(current_utc_time()))
+        .select_from(Plan)
+        .join(Organization, Organization.id == Plan.org_id)
+        .where(*filters, key_expr.isnot(None))
+        .group_by(key_expr, Plan.year, PLAN_STATUS_EXPR)
+    )
+    db.session.execute(insert(PlanStatusRollup).from_select([
+        'scope', 'scope_key', 'year', 'status', 'plans_count', 'refreshed_at'
+    ], counts))
+
+
+def _refresh_scope(scope, scope_key=None, year=None):
+    """Пересчитывает сводки scope; scope_key/year=None - по всем группам"""
+    key_expr, filters = _group_filters(scope, scope_key, year)
+    now = current_utc_time()
+
+    for model in (IndicatorRollup, EconExecRollup):
+        _delete_group(model, scope, scope_key, year)
+
+    indicators = (
+        select(
+            literal(scope), key_expr, Plan.year, IndicatorUsage.id_indicator,
+            func.sum(IndicatorUsage.QYearPrev),
+            func.sum(IndicatorUsage.QYearCurr),
+            func.sum(IndicatorUsage.QYearNext),
+            func.count(func.distinct(Plan.id)),
+            literal(now)
+        )
+        .select_from(IndicatorUsage)
+        .join(Plan, Plan.id == IndicatorUsage.id_plan)
+        .join(Organization, Organization.id == Plan.org_id)
+        .where(*filters)
+        .group_by(key_expr, Plan.year, IndicatorUsage.id_indicator)
+    )
+    db.session.execute(insert(IndicatorRollup).from_select([
+        'scope', 'scope_key', 'year', 'id_indicator',
+        'QYearPrev', 'QYearCurr', 'QYearNext', 'plans_count', 'refreshed_at'
+    ], indicators))
+
+    execs = (
+        select(
+            literal(scope), key_expr, Plan.year, EconMeasure.id_direction,
+            EconExec.ExpectedQuarter, EconExec.is_local,
+            func.count(EconExec.id),
+            *[func.sum(getattr(EconExec, column)) for column in EXEC_SUM_COLUMNS],
+            literal(now)
+        )
+        .select_from(EconExec)
+        .join(EconMeasure, EconMeasure.id == EconExec.id_measure)
+        .join(Plan, Plan.id == EconExec.id_plan)
+        .join(Organization, Organization.id == Plan.org_id)
+        .where(*filters)
+        .group_by(key_expr, Plan.year, EconMeasure.id_direction,
+                  EconExec.ExpectedQuarter, EconExec.is_local)
+    )
+    db.session.execute(insert(EconExecRollup).from_select([
+        'scope', 'scope_key', 'year', 'id_direction', 'quarter', 'is_local',
+        'execs_count', *EXEC_SUM_COLUMNS, 'refreshed_at'
+    ], execs))
+
+
+def _groups(ministry_id, region_digit, year):
+    groups = []
+    if ministry_id:
+        groups.append((MINISTRY, str(ministry_id), year))
+    if region_digit:
+        groups.append((REGION, region_digit, year))
+    return groups
+
+
+def plan_rollup_groups(plan):
+    """Группы сводок, в которые входит план: [(scope, scope_key, year)]"""
+    organization = plan.organization
+    if not organization:
+        return []
+    return _groups(organization.ministry_id, organization.region_digit, plan.year)
+
+
+def stored_plan_rollup_groups(plan_id, approved_only=False):
+    """
+    Группы сводок плана по данным в БД, без несохраненных изменений сессии
+    (например, прежние год и организация плана до правки в админ-панели).
+    approved_only=True - пусто, если план в БД не утвержден.
+    """
+    if plan_id is None:
+        return []
+    with db.session.no_autoflush:
+        row = (db.session.query(Plan.year, Plan.is_approved, Organization.ministry_id, Organization.region_digit)
+               .join(Organization, Organization.id == Plan.org_id)
+               .filter(Plan.id == plan_id)
+               .first())
+    if row is None or (approved_only and not row.is_approved):
+        return []
+    return _groups(row.ministry_id, row.region_digit, row.year)
+
+
+def stored_organization_rollup_groups(org_id):
+    """
+    Группы сводок всех планов организации по данным в БД, без несохраненных
+    изменений сессии (до и после смены министерства или ОКПО в админ-панели).
+    """
+    if org_id is None:
+        return []
+    with db.session.no_autoflush:
+        rows = (db.session.query(Plan.year, Organization.ministry_id, Organization.region_digit)
+                .join(Organization, Organization.id == Plan.org_id)
+                .filter(Organization.id == org_id)
+                .distinct()
+                .all())
+    return [group for row in rows for group in _groups(row.ministry_id, row.region_digit, row.year)]
+
+
+def refresh_rollup_groups(groups, sums=True):
+    """
+    Пересчитывает перечисленные группы в текущей транзакции (коммит - за вызывающим).
+    sums=False - только счетчики статусов (план не входил в утвержденные и не выходил из них).
+    """
+    groups = sorted(set(groups), key=lambda group: tuple(str(part) for part in group))
+    if not groups:
+        return
+    db.session.flush()
+    _lock_groups(groups)
+    for scope, scope_key, year in groups:
+        _refresh_status_counts(scope, scope_key, year)
+        if sums:
+            _refresh_scope(scope, scope_key, year)
+
+
+def refresh_plan_rollups(plan, sums=True):
+    """Пересчитывает сводки министерства и региона, в которые входит план"""
+    refresh_rollup_groups(plan_rollup_groups(plan), sums)
+
+
+def rebuild_rollups():
+    """Полный пересчет всех сводок"""
+    for scope in SCOPES:
+        _advisory_lock(f'rollup:{scope}')
+    for scope in SCOPES:
+        _refresh_status_counts(scope)
+        _refresh_scope(scope)
+    db.session.commit()
+
+
+def user_rollup_scope(user):
+    """
+    Сводка, доступная пользователю: (scope, scope_key) или None.
+    scope_key=None - все регионы (администраторы и аудиторы Департамента).
+    """
+    if user.plan_type == MINISTRY and user.ministry_id:
+        return MINISTRY, str(user.ministry_id)
+    if user.plan_type == REGION and user.region_id:
+        # регионы заведены в порядке цифр ОКПО: 1 - Брестская ... 7 - Могилевская
+        return REGION, str(user.region_id)
+    if user.is_admin:
+        return REGION, None
+    if user.is_auditor and user.organization:
+        digit = user.organization.region_digit
+        return REGION, None if digit == ALL_REGIONS_DIGIT else digit
+    return None
+
+
+def _num(value):
+    return float(value) if value is not None else 0.0
+
+
+def get_rollup(scope, scope_key, year):
+    """Сводка группы в виде словаря для JSON; scope_key=None - сумма по всем группам scope"""
+    indicator_filters = [IndicatorRollup.scope == scope, IndicatorRollup.year == year]
+    exec_filters = [EconExecRollup.scope == scope, EconExecRollup.year == year]
+    if scope_key is not None:
+        indicator_filters.append(IndicatorRollup.scope_key == str(scope_key))
+        exec_filters.append(EconExecRollup.scope_key == str(scope_key))
+
+    indicator_rows = (
+        db.session.query(
+            Indicator.code, Indicator.name,
+            func.sum(IndicatorRollup.QYearPrev),
+            func.sum(IndicatorRollup.QYearCurr),
+            func.sum(IndicatorRollup.QYearNext),
+            func.sum(IndicatorRollup.plans_count)
+        )
+        .join(Indicator, Indicator.id == IndicatorRollup.id_indicator)
+        .filter(*indicator_filters)
+        .group_by(Indicator.code, Indicator.name, Indicator.Group, Indicator.RowN)
+        .order_by(Indicator.Group, Indicator.RowN)
+        .all()
+    )
+
+    exec_rows = (
+        db.session.query(
+            Direction.code, Direction.name, EconExecRollup.quarter, EconExecRollup.is_local,
+            func.sum(EconExecRollup.execs_count),
+            *[func.sum(getattr(EconExecRollup, column)) for column in EXEC_SUM_COLUMNS]
+        )
+        .join(Direction, Direction.id == EconExecRollup.id_direction)
+        .filter(*exec_filters)
+        .group_by(Direction.code, Direction.name, EconExecRollup.quarter, EconExecRollup.is_local)
+        .order_by(Direction.code, EconExecRollup.quarter)
+        .all()
+    )
+
+    return {
+        'scope': scope,
+        'scope_key': scope_key,
+        'year': year,
+        'indicators': [{
+            'code': code,
+            'name': name,
+            'QYearPrev': _num(prev),
+            'QYearCurr': _num(curr),
+            'QYearNext': _num(next_),
+            'plans_count': int(plans or 0)
+        } for code, name, prev, curr, next_, plans in indicator_rows],
+        'econ_execes': [{
+            'direction_code': code,
+            'direction_name': name,
+            'quarter': quarter,
+            'is_local': is_local,
+            'execs_count': int(count or 0),
+            **{column: _num(value) for column, value in zip(EXEC_SUM_COLUMNS, sums)}
+        } for code, name, quarter, is_local, count, *sums in exec_rows]
+    }
@@ -0,0 +1,123 @@
+"""
+Поиск по справочникам организаций, министерств и регионов для подсказок ввода.
+
+- ОКПО/УНП из одних цифр: точное совпадение по индексу, затем префикс ОКПО;
+- короткие запросы (< MIN_TRIGRAM_LENGTH): префикс lower(name) по btree-индексу;
+- остальные: ILIKE по триграммному GIN-индексу, сначала совпадения с начала
+  наименования, затем по убыванию similarity().
+Страницы отдаются по ключу (keyset) без COUNT(*): клиент передает next_cursor.
+similarity() (real) в ключе округляется до numeric: в курсоре она передается
+строкой и сравнивается точно, без потерь float при переходе через JSON.
+"""
+import base64
+import json
+from decimal import Decimal
+
+from sqlalchemy import Numeric, case, cast, func, literal, or_, tuple_
+
+from .. import db
+from ..models import Ministry, Organization, Region
+
+PAGE_SIZE = 10
+MIN_TRIGRAM_LENGTH = 3
+SIMILARITY_TYPE = Numeric(5, 4)
+
+
+def encode_cursor(values):
+    # Decimal (ключ similarity) - строкой, чтобы значение вернулось без округления
+    return base64.urlsafe_b64encode(json.dumps(list(values), default=str).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Ключ последней строки предыдущей страницы или None для некорректного курсора"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _like_escape(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _name_keys(query, name_column, id_column, q):
+    """Фильтр по наименованию и ключ сортировки (он же ключ keyset-пагинации)"""
+    if not q:
+        return query, (name_column, id_column)
+
+    prefix = f"{_like_escape(q.lower())}%"
+    if len(q) < MIN_TRIGRAM_LENGTH:
+        query = query.filter(func.lower(name_column).like(prefix, escape="\\"))
+        return query, (name_column, id_column)
+
+    query = query.filter(name_column.ilike(f"%{_like_escape(q)}%", escape="\\"))
+    prefix_miss = case((func.lower(name_column).like(prefix, escape="\\"), 0), else_=1)
+    distance = cast(-func.similarity(name_column, q), SIMILARITY_TYPE)
+    return query, (prefix_miss, distance, name_column, id_column)
+
+
+def _page(query, keys, cursor, page_size=PAGE_SIZE):
+    """Страница строк по ключу keys после cursor: (строки, next_cursor)"""
+    if cursor is not None:
+        if len(cursor) != len(keys):
+            return [], None
+        try:
+            values = [Decimal(value) if isinstance(key.type, Numeric) else value
+                      for key, value in zip(keys, cursor)]
+        except (ArithmeticError, TypeError):
+            return [], None
+        query = query.filter(tuple_(*keys) > tuple_(*[literal(value, key.type) for key, value in zip(keys, values)]))
+
+    key_labels = [f"_key{i}" for i in range(len(keys))]
+    query = query.add_columns(*[key.label(label) for key, label in zip(keys, key_labels)])
+    rows = query.order_by(*keys).limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, label) for label in key_labels)
+    return rows, next_cursor
+
+
+def search_organizations(q, cursor=None, page_size=PAGE_SIZE):
+    """Организации для подсказок: (строки с полями id/name/okpo/ynp/ministry, next_cursor)"""
+    query = (
+        db.session.query(
+            Organization.id, Organization.name, Organization.okpo, Organization.ynp,
+            Ministry.name.label("ministry")
+        )
+        .outerjoin(Ministry, Ministry.id == Organization.ministry_id)
+        .filter(Organization.is_active.isnot(False))
+    )
+    cursor = decode_cursor(cursor)
+
+    if q.isdigit():
+        if cursor is None:
+            exact = (query
+                     .filter(or_(Organization.okpo == q, Organization.ynp == q))
+                     .order_by(Organization.id)
+                     .limit(page_size)
+                     .all())
+            if exact:
+                return exact, None
+        query = query.filter(Organization.okpo.like(f"{q}%"))
+        return _page(query, (Organization.okpo, Organization.id), cursor, page_size)
+
+    query, keys = _name_keys(query, Organization.name, Organization.id, q)
+    return _page(query, keys, cursor, page_size)
+
+
+def search_ministries(q, cursor=None, page_size=PAGE_SIZE):
+    query = db.session.query(Ministry.id, Ministry.name).filter(Ministry.is_active == True)
+    query, keys = _name_keys(query, Ministry.name, Ministry.id, q)
+    return _page(query, keys, decode_cursor(cursor), page_size)
+
+
+def search_regions(q, cursor=None, page_size=PAGE_SIZE):
+    query = db.session.query(Region.id, Region.name)
+    query, keys = _name_keys(query, Region.name, Region.id, q)
+    return _page(query, keys, decode_cursor(cursor), page_size)
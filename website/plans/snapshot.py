@@ -0,0 +1,287 @@
+"""
+Неизменяемые снимки плана для экспорта.
+
+Снимок повторяет имена атрибутов ORM-моделей, поэтому экспортеры работают
+одинаково с Plan и PlanSnapshot. Снимок не держит сессию БД и сериализуется
+pickle, поэтому его можно передавать в другие процессы.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from .. import db
+from ..models import (
+    Direction, EconExec, EconMeasure, Indicator, IndicatorUsage, Organization, Plan
+)
+from .metrics import quarterly_metrics
+
+SNAPSHOT_BATCH_SIZE = 50
+
+# Весь граф плана, нужный экспортерам: 4 запроса на пачку планов (и 1 - на итоги по кварталам)
+PLAN_GRAPH_OPTIONS = (
+    joinedload(Plan.organization).joinedload(Organization.ministry),
+    joinedload(Plan.ministry),
+    joinedload(Plan.region),
+    selectinload(Plan.indicators_usage)
+        .joinedload(IndicatorUsage.indicator)
+        .joinedload(Indicator.unit),
+    selectinload(Plan.econ_measures)
+        .joinedload(EconMeasure.direction)
+        .joinedload(Direction.unit),
+    selectinload(Plan.econ_execes)
+        .joinedload(EconExec.econ_measures)
+        .joinedload(EconMeasure.direction)
+        .joinedload(Direction.unit),
+)
+
+
+@dataclass(frozen=True)
+class UnitSnapshot:
+    code: str
+    name: str
+
+
+@dataclass(frozen=True)
+class NamedSnapshot:
+    name: str
+
+    def __str__(self):
+        return self.name or ""
+
+
+@dataclass(frozen=True)
+class OrganizationSnapshot:
+    name: str
+    okpo: str
+    ynp: Optional[str]
+    ministry: Optional[NamedSnapshot]
+
+
+@dataclass(frozen=True)
+class DirectionSnapshot:
+    code: str
+    name: str
+    is_local: Optional[bool]
+    unit: Optional[UnitSnapshot]
+
+
+@dataclass(frozen=True)
+class EconMeasureSnapshot:
+    id: int
+    direction: Optional[DirectionSnapshot]
+    year_econ: Optional[Decimal]
+    estim_econ: Optional[Decimal]
+
+
+@dataclass(frozen=True)
+class EconExecSnapshot:
+    id: int
+    econ_measures: Optional[EconMeasureSnapshot]
+    name: str
+    Volume: Optional[int]
+    EffTut: Optional[Decimal]
+    EffRub: Optional[Decimal]
+    ExpectedQuarter: Optional[int]
+    EffCurrYear: Optional[Decimal]
+    Payback: Optional[Decimal]
+    VolumeFin: Optional[Decimal]
+    BudgetState: Optional[Decimal]
+    BudgetRep: Optional[Decimal]
+    BudgetLoc: Optional[Decimal]
+    BudgetOther: Optional[Decimal]
+    MoneyOwn: Optional[Decimal]
+    MoneyLoan: Optional[Decimal]
+    MoneyOther: Optional[Decimal]
+    is_local: Optional[bool]
+
+
+@dataclass(frozen=True)
+class IndicatorSnapshot:
+    code: str
+    name: str
+    CoeffToTut: Optional[Decimal]
+    IsMandatory: Optional[bool]
+    Group: Optional[float]
+    RowN: Optional[int]
+    unit: Optional[UnitSnapshot]
+
+
+@dataclass(frozen=True)
+class IndicatorUsageSnapshot:
+    id: int
+    indicator: IndicatorSnapshot
+    QYearPrev: Optional[Decimal]
+    QYearCurr: Optional[Decimal]
+    QYearNext: Optional[Decimal]
+
+
+@dataclass(frozen=True)
+class PlanSnapshot:
+    id: int
+    year: int
+    org_id: Optional[int]
+    ministry_id: Optional[int]
+    region_id: Optional[int]
+    energy_saving: Optional[Decimal]
+    share_fuel: Optional[Decimal]
+    saving_fuel: Optional[Decimal]
+    share_energy: Optional[Decimal]
+    organization: Optional[OrganizationSnapshot]
+    ministry: Optional[NamedSnapshot]
+    region: Optional[NamedSnapshot]
+    indicators_usage: Tuple[IndicatorUsageSnapshot, ...]
+    econ_measures: Tuple[EconMeasureSnapshot, ...]
+    econ_execes: Tuple[EconExecSnapshot, ...]
+    # нарастающие итоги по кварталам (website.plans.metrics): local / non_local / total
+    quarterly_metrics: Dict[str, dict]
+
+
+def _unit(unit):
+    return UnitSnapshot(code=unit.code, name=unit.name) if unit else None
+
+
+def _named(obj):
+    return NamedSnapshot(name=obj.name) if obj else None
+
+
+def snapshot_plan(plan, metrics=None):
+    """Снимок ORM-плана со всеми данными, нужными экспортерам; metrics - итоги из quarterly_metrics"""
+    units = {}
+    directions = {}
+    measures = {}
+
+    def unit_of(unit):
+        if unit is None:
+            return None
+        if unit.id not in units:
+            units[unit.id] = _unit(unit)
+        return units[unit.id]
+
+    def direction_of(direction):
+        if direction is None:
+            return None
+        if direction.id not in directions:
+            directions[direction.id] = DirectionSnapshot(
+                code=direction.code,
+                name=direction.name,
+                is_local=direction.is_local,
+                unit=unit_of(direction.unit)
+            )
+        return directions[direction.id]
+
+    def measure_of(measure):
+        if measure is None:
+            return None
+        if measure.id not in measures:
+            measures[measure.id] = EconMeasureSnapshot(
+                id=measure.id,
+                direction=direction_of(measure.direction),
+                year_econ=measure.year_econ,
+                estim_econ=measure.estim_econ
+            )
+        return measures[measure.id]
+
+    organization = None
+    if plan.organization:
+        organization = OrganizationSnapshot(
+            name=plan.organization.name,
+            okpo=plan.organization.okpo,
+            ynp=plan.organization.ynp,
+            ministry=_named(plan.organization.ministry)
+        )
+
+    indicators_usage = tuple(
+        IndicatorUsageSnapshot(
+            id=usage.id,
+            indicator=IndicatorSnapshot(
+                code=usage.indicator.code,
+                name=usage.indicator.name,
+                CoeffToTut=usage.indicator.CoeffToTut,
+                IsMandatory=usage.indicator.IsMandatory,
+                Group=usage.indicator.Group,
+                RowN=usage.indicator.RowN,
+                unit=unit_of(usage.indicator.unit)
+            ),
+            QYearPrev=usage.QYearPrev,
+            QYearCurr=usage.QYearCurr,
+            QYearNext=usage.QYearNext
+        )
+        for usage in plan.indicators_usage
+    )
+
+    econ_measures = tuple(measure_of(measure) for measure in plan.econ_measures)
+
+    econ_execes = tuple(
+        EconExecSnapshot(
+            id=econ.id,
+            econ_measures=measure_of(econ.econ_measures),
+            name=econ.name,
+            Volume=econ.Volume,
+            EffTut=econ.EffTut,
+            EffRub=econ.EffRub,
+            ExpectedQuarter=econ.ExpectedQuarter,
+            EffCurrYear=econ.EffCurrYear,
+            Payback=econ.Payback,
+            VolumeFin=econ.VolumeFin,
+            BudgetState=econ.BudgetState,
+            BudgetRep=econ.BudgetRep,
+            BudgetLoc=econ.BudgetLoc,
+            BudgetOther=econ.BudgetOther,
+            MoneyOwn=econ.MoneyOwn,
+            MoneyLoan=econ.MoneyLoan,
+            MoneyOther=econ.MoneyOther,
+            is_local=econ.is_local
+        )
+        for econ in plan.econ_execes
+    )
+
+    return PlanSnapshot(
+        id=plan.id,
+        year=plan.year,
+        org_id=plan.org_id,
+        ministry_id=plan.ministry_id,
+        region_id=plan.region_id,
+        energy_saving=plan.energy_saving,
+        share_fuel=plan.share_fuel,
+        saving_fuel=plan.saving_fuel,
+        share_energy=plan.share_energy,
+        organization=organization,
+        ministry=_named(plan.ministry),
+        region=_named(plan.region),
+        indicators_usage=indicators_usage,
+        econ_measures=econ_measures,
+        econ_execes=econ_execes,
+        quarterly_metrics=metrics if metrics is not None else quarterly_metrics([plan.id])[plan.id]
+    )
+
+
+def load_plan_snapshots(plan_ids, batch_size=SNAPSHOT_BATCH_SIZE):
+    """
+    Снимки планов в порядке plan_ids. Планы загружаются пачками вместе со всеми
+    связями (PLAN_GRAPH_OPTIONS), после снятия снимка освобождаются из сессии.
+    Несуществующие id пропускаются.
+    """
+    plan_ids = list(plan_ids)
+    for start in range(0, len(plan_ids), batch_size):
+        batch_ids = plan_ids[start:start + batch_size]
+        plans = {
+            plan.id: plan
+            for plan in Plan.query.options(*PLAN_GRAPH_OPTIONS).filter(Plan.id.in_(batch_ids))
+        }
+        metrics = quarterly_metrics(plans)
+        snapshots = []
+        for plan_id in batch_ids:
+            plan = plans.get(int(plan_id))
+            if plan is not None:
+                snapshots.append(snapshot_plan(plan, metrics[plan.id]))
+        for plan in plans.values():
+            db.session.expire(plan)
+        del plans
+        yield from snapshots
+
+
+def load_plan_snapshot(plan_id):
+    """Снимок одного плана или None"""
+    return next(load_plan_snapshots([plan_id]), None)
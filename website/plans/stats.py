@@ -0,0 +1,126 @@
+"""
+Данные страницы статистики (/stats) из предрасчитанных сводок rollups.
+
+Ничего не считается по econ_execes и plans на запрос: планы по году, статусу
+и региону/министерству берутся из PlanStatusRollup, экономия ТЭР по
+направлениям (строка 9900 - сумма EffCurrYear мероприятий) и источники
+финансирования по кварталам - из EconExecRollup утвержденных планов.
+"""
+from sqlalchemy import func
+
+from .. import db
+from ..models import Direction, EconExecRollup, Ministry, PlanStatusRollup, Region
+from .rollups import MINISTRY
+from .status import STATUSES
+
+FINANCING_COLUMNS = (
+    'VolumeFin', 'BudgetState', 'BudgetRep', 'BudgetLoc', 'BudgetOther',
+    'MoneyOwn', 'MoneyLoan', 'MoneyOther',
+)
+
+
+def _num(value):
+    return float(value) if value is not None else 0.0
+
+
+def _scope_filters(model, scope, scope_key):
+    filters = [model.scope == scope]
+    if scope_key is not None:
+        filters.append(model.scope_key == str(scope_key))
+    return filters
+
+
+def _group_names(scope, keys):
+    """Наименования министерств/регионов по ключам сводок"""
+    ids = [int(key) for key in keys if key.isdigit()]
+    if not ids:
+        return {}
+    model = Ministry if scope == MINISTRY else Region
+    return {str(row.id): row.name for row in db.session.query(model.id, model.name).filter(model.id.in_(ids))}
+
+
+def stats_years(scope, scope_key):
+    """Годы, за которые есть планы в сводках (по убыванию)"""
+    return [
+        year for (year,) in
+        db.session.query(PlanStatusRollup.year)
+        .filter(*_scope_filters(PlanStatusRollup, scope, scope_key))
+        .distinct()
+        .order_by(PlanStatusRollup.year.desc())
+    ]
+
+
+def plans_by_year(scope, scope_key):
+    """{год: {статус: число планов}} по всем годам"""
+    rows = (db.session.query(PlanStatusRollup.year, PlanStatusRollup.status,
+                             func.sum(PlanStatusRollup.plans_count))
+            .filter(*_scope_filters(PlanStatusRollup, scope, scope_key))
+            .group_by(PlanStatusRollup.year, PlanStatusRollup.status)
+            .all())
+    result = {}
+    for year, status, count in rows:
+        result.setdefault(year, dict.fromkeys(STATUSES, 0))[status] = int(count or 0)
+    return result
+
+
+def plans_by_group(scope, scope_key, year):
+    """Планы года по регионам/министерствам и статусам: [{key, name, статусы..., all}]"""
+    rows = (db.session.query(PlanStatusRollup.scope_key, PlanStatusRollup.status, PlanStatusRollup.plans_count)
+            .filter(*_scope_filters(PlanStatusRollup, scope, scope_key), PlanStatusRollup.year == year)
+            .all())
+    groups = {}
+    for key, status, count in rows:
+        groups.setdefault(key, dict.fromkeys(STATUSES, 0))[status] += count or 0
+
+    names = _group_names(scope, groups)
+    return [
+        {'key': key, 'name': names.get(key, key), **counts, 'all': sum(counts.values())}
+        for key, counts in sorted(groups.items(), key=lambda item: (len(item[0]), item[0]))
+    ]
+
+
+def ter_by_direction(scope, scope_key, year):
+    """Экономия ТЭР (EffCurrYear, строка 9900) утвержденных планов по кодам направлений"""
+    rows = (db.session.query(Direction.code, Direction.name,
+                             func.sum(EconExecRollup.EffCurrYear), func.sum(EconExecRollup.execs_count))
+            .join(Direction, Direction.id == EconExecRollup.id_direction)
+            .filter(*_scope_filters(EconExecRollup, scope, scope_key), EconExecRollup.year == year)
+            .group_by(Direction.code, Direction.name)
+            .order_by(Direction.code)
+            .all())
+    return [{
+        'direction_code': code,
+        'direction_name': name,
+        'EffCurrYear': _num(saving),
+        'execs_count': int(count or 0),
+    } for code, name, saving, count in rows]
+
+
+def financing_by_quarter(scope, scope_key, year):
+    """Источники финансирования утвержденных планов по кварталам внедрения"""
+    rows = (db.session.query(EconExecRollup.quarter,
+                             *[func.sum(getattr(EconExecRollup, column)) for column in FINANCING_COLUMNS])
+            .filter(*_scope_filters(EconExecRollup, scope, scope_key), EconExecRollup.year == year)
+            .group_by(EconExecRollup.quarter)
+            .order_by(EconExecRollup.quarter.nullslast())
+            .all())
+    return [{
+        'quarter': quarter,
+        **{column: _num(value) for column, value in zip(FINANCING_COLUMNS, sums)}
+    } for quarter, *sums in rows]
+
+
+def get_stats(scope, scope_key, year):
+    """Все данные страницы статистики за год в виде словаря для JSON"""
+    return {
+        'scope': scope,
+        'scope_key': scope_key,
+        'year': year,
+        'plans_by_year': [
+            {'year': plan_year, **counts, 'all': sum(counts.values())}
+            for plan_year, counts in sorted(plans_by_year(scope, scope_key).items())
+        ],
+        'plans_by_group': plans_by_group(scope, scope_key, year),
+        'ter_by_direction': ter_by_direction(scope, scope_key, year),
+        'financing_by_quarter': financing_by_quarter(scope, scope_key, year),
+    }
@@ -0,0 +1,93 @@
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from .. import db
+from ..models import Plan
+
+STATUSES = ('draft', 'control', 'sent', 'error', 'approved')
+
+STATUS_COLUMNS = {
+    'draft': Plan.is_draft,
+    'control': Plan.is_control,
+    'sent': Plan.is_sent,
+    'error': Plan.is_error,
+    'approved': Plan.is_approved
+}
+
+# Кэш счетчиков: (user_id, status_filter, year_filter) -> (время, счетчики)
+_cache = {}
+_auditor_users = set()
+_lock = threading.Lock()
+
+_PENDING_KEY = 'pending_status_invalidations'
+
+
+def count_statuses(query):
+    """Счетчики планов по всем статусам одним запросом (COUNT ... FILTER)"""
+    row = (query
+           .order_by(None)
+           .with_entities(
+               func.count(Plan.id),
+               *[func.count(Plan.id).filter(STATUS_COLUMNS[status] == True) for status in STATUSES]
+           )
+           .one())
+
+    counts = {'all': row[0]}
+    for status, value in zip(STATUSES, row[1:]):
+        counts[status] = value
+    return counts
+
+
+def get_status_counts(user, query, status_filter='all', year_filter='all'):
+    """Счетчики статусов для пользователя с кэшированием в процессе"""
+    key = (user.id, status_filter, year_filter)
+    ttl = current_app.config.get('STATUS_COUNTS_CACHE_TTL', 60)
+
+    with _lock:
+        cached = _cache.get(key)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return dict(cached[1])
+
+    counts = count_statuses(query)
+
+    with _lock:
+        _cache[key] = (time.monotonic(), counts)
+        if user.is_auditor:
+            _auditor_users.add(user.id)
+    return dict(counts)
+
+
+def _invalidate_now(user_ids):
+    with _lock:
+        if None in user_ids:
+            _cache.clear()
+            return
+        affected = _auditor_users | set(user_ids)
+        for key in [k for k in _cache if k[0] in affected]:
+            del _cache[key]
+
+
+def invalidate_status_counts(user_id=None):
+    """
+    Сбрасывает кэш счетчиков владельца плана и всех аудиторов
+    (аудиторы видят планы чужих пользователей). user_id=None - сбросить все.
+    Внутри транзакции сброс откладывается до ее завершения: иначе параллельный
+    запрос до коммита снова закэширует старые счетчики на весь TTL.
+    """
+    session = db.session()
+    if session.in_transaction():
+        session.info.setdefault(_PENDING_KEY, set()).add(user_id)
+    else:
+        _invalidate_now({user_id})
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_pending(session):
+    # после отката сброс тоже выполняется: лишний промах кэша безопаснее потерянного сброса
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        _invalidate_now(pending)
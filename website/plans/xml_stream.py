@@ -0,0 +1,92 @@
+"""
+Потоковая запись XML: элементы пишутся в поток сразу, без построения дерева.
+Вывод совпадает с ElementTree.tostring (с тем же отступом, что давал prettify).
+"""
+
+
+def _escape_text(text):
+    text = str(text)
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def _escape_attrib(value):
+    value = _escape_text(value)
+    if '"' in value:
+        value = value.replace('"', "&quot;")
+    if "\r" in value:
+        value = value.replace("\r", "&#13;")
+    if "\n" in value:
+        value = value.replace("\n", "&#10;")
+    if "\t" in value:
+        value = value.replace("\t", "&#09;")
+    return value
+
+
+class XmlStreamWriter:
+    """
+    Пишет XML в бинарный поток по мере вызовов start/element/end.
+    indent=None - без переносов строк и отступов.
+    """
+
+    def __init__(self, stream, indent="  ", encoding="utf-8"):
+        self._stream = stream
+        self._encoding = encoding
+        self._indent = indent
+        self._stack = []
+        # открыт ли последний тег без '>' (еще неизвестно, будут ли дочерние)
+        self._pending = False
+        self._has_children = []
+        self._at_start = True
+
+    def _write(self, text):
+        self._stream.write(text.encode(self._encoding))
+
+    def _open_child(self):
+        if self._pending:
+            self._write(">")
+            self._pending = False
+        if self._has_children:
+            self._has_children[-1] = True
+        if self._indent is not None and not self._at_start:
+            self._write("\n" + self._indent * len(self._stack))
+        self._at_start = False
+
+    @staticmethod
+    def _attrs(attrib):
+        if not attrib:
+            return ""
+        return "".join(f' {key}="{_escape_attrib(value)}"' for key, value in attrib.items())
+
+    def declaration(self):
+        self._write(f"<?xml version='1.0' encoding='{self._encoding}'?>\n")
+
+    def start(self, tag, attrib=None):
+        self._open_child()
+        self._write(f"<{tag}{self._attrs(attrib)}")
+        self._pending = True
+        self._stack.append(tag)
+        self._has_children.append(False)
+
+    def element(self, tag, text=None, attrib=None):
+        self._open_child()
+        if text is None or text == "":
+            self._write(f"<{tag}{self._attrs(attrib)} />")
+        else:
+            self._write(f"<{tag}{self._attrs(attrib)}>{_escape_text(text)}</{tag}>")
+
+    def end(self):
+        tag = self._stack.pop()
+        had_children = self._has_children.pop()
+        if self._pending:
+            self._write(" />")
+            self._pending = False
+            return
+        if had_children and self._indent is not None:
+            self._write("\n" + self._indent * len(self._stack))
+        self._write(f"</{tag}>")
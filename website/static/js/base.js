@@ -171,44 +171,108 @@ const Notifications = {
     notifListEl: null,
     notifCountEl: null,
     markAllBtn: null,
+    items: [],
+    nextCursor: null,
+    lastId: 0,
+    unread: 0,
+
+    async fetchPage(params) {
+        const response = await fetch(`/api/notifications?${new URLSearchParams(params)}`);
+        if (!response.ok) throw new Error("Ошибка запроса");
+        return response.json();
+    },
 
     async load() {
         try {
-            const response = await fetch("/api/notifications");
-            const data = await response.json();
-            this.render(data);
+            const data = await this.fetchPage({});
+            this.items = data.items;
+            this.nextCursor = data.next_cursor;
+            this.unread = data.unread;
+            this.lastId = Math.max(0, ...this.items.map(n => n.id));
+            this.render();
+        } catch (err) {
+            console.error("Ошибка загрузки уведомлений:", err);
+        }
+    },
+
+    async loadMore() {
+        if (!this.nextCursor) return;
+        try {
+            const data = await this.fetchPage({ cursor: this.nextCursor });
+            this.items = this.items.concat(data.items);
+            this.nextCursor = data.next_cursor;
+            this.render();
+        } catch (err) {
+            console.error("Ошибка загрузки уведомлений:", err);
+        }
+    },
+
+    // уведомления, пропущенные пока сокет был отключен
+    async catchUp() {
+        try {
+            // порции приходят от старых к новым; запрашиваем, пока сервер сообщает has_more
+            let data;
+            do {
+                data = await this.fetchPage({ since: this.lastId });
+                data.items.forEach(n => this.prepend(n));
+            } while (data.has_more && data.items.length);
+            this.unread = data.unread;
+            this.render();
         } catch (err) {
             console.error("Ошибка загрузки уведомлений:", err);
         }
     },
 
-    render(data) {
+    prepend(n) {
+        if (this.items.some(item => item.id === n.id)) return false;
+        this.items.unshift(n);
+        this.lastId = Math.max(this.lastId, n.id);
+        return true;
+    },
+
+    receive(n) {
+        if (this.prepend(n) && !n.is_read) this.unread++;
+        this.render();
+    },
+
+    render() {
         this.notifListEl.innerHTML = ""; 
 
-        if (!data || data.length === 0) {
+        if (this.items.length === 0) {
             this.notifListEl.innerHTML = "<div class='notif empty'>Нет уведомлений</div>";
-            this.hideCounter();
+            this.updateCounter(0);
             return;
         }
 
-        let unreadCount = 0;
-
-        data.forEach(n => {
+        this.items.forEach(n => {
             const notif = document.createElement("div");
             notif.classList.add("notif");
             if (!n.is_read) {
                 notif.classList.add("unread");
-                unreadCount++;
             }
 
             notif.innerHTML = `
-                <div class="notif-message">${n.message}</div>
-                <div class="notif-time">${n.created_at}</div>
+                <div class="notif-message"></div>
+                <div class="notif-time"></div>
             `;
+            notif.querySelector(".notif-message").textContent = n.message;
+            notif.querySelector(".notif-time").textContent = n.created_at;
             this.notifListEl.appendChild(notif);
         });
 
-        this.updateCounter(unreadCount);
+        if (this.nextCursor) {
+            const more = document.createElement("div");
+            more.classList.add("notif", "empty");
+            more.style.cursor = "pointer";
+            more.textContent = "Показать еще";
+            more.addEventListener("click", (e) => {
+                e.stopPropagation();
+                this.loadMore();
+            });
+            this.notifListEl.appendChild(more);
+        }
+
+        this.updateCounter(this.unread);
     },
 
     updateCounter(count) {
@@ -221,11 +285,6 @@ const Notifications = {
         }
     },
 
-    hideCounter() {
-        this.notifCountEl.style.display = "none";
-        this.notifCountEl.innerText = "";
-    },
-
     async markAllRead() {
         try {
             const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute("content");
@@ -241,10 +300,9 @@ const Notifications = {
 
             if (!response.ok) throw new Error("Ошибка запроса");
 
-            const result = await response.json();
-            console.log(result.message);
-
-            this.load();
+            this.items.forEach(n => { n.is_read = true; });
+            this.unread = 0;
+            this.render();
         } catch (err) {
             console.error("Ошибка при отметке уведомлений:", err);
         }
@@ -259,6 +317,17 @@ const Notifications = {
             this.markAllBtn.addEventListener("click", () => this.markAllRead());
         }
 
+        const socket = AppSocket.get();
+        if (socket) {
+            socket.on("notification", (n) => this.receive(n));
+            // первое подключение - обычная загрузка, повторные - догрузка пропущенного
+            let connectedBefore = false;
+            socket.on("connect", () => {
+                if (connectedBefore) this.catchUp();
+                connectedBefore = true;
+            });
+        }
+
         this.load();
     }
 };
@@ -1407,9 +1476,84 @@ function initExportPage() {
 
     checkboxes.forEach(cb => cb.addEventListener("change", updateButtonState));
 
+    // большие выборки экспортируются фоновым заданием
+    const jobThreshold = parseInt(form.dataset.jobThreshold || "0", 10);
+    if (jobThreshold) {
+        AppSocket.get();
+    }
+    form.addEventListener("submit", (e) => {
+        const selected = Array.from(checkboxes).filter(cb => cb.checked).length;
+        // сводный XML отдается потоком и не требует фонового задания
+        if (!jobThreshold || selected <= jobThreshold || formatInput.value === "xml-feed" || !AppSocket.get()) {
+            return;
+        }
+        e.preventDefault();
+        ExportJob.start(form, formatInput.value, exportBtn);
+    });
+
     updateButtonState();
 }
 
+// socket.io connection
+const AppSocket = {
+    socket: null,
+
+    get() {
+        if (!this.socket && typeof io !== "undefined") {
+            this.socket = io();
+        }
+        return this.socket;
+    }
+};
+
+// background export job
+const ExportJob = {
+    async start(form, format, button) {
+        const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute("content");
+        const buttonText = button.innerText;
+        button.disabled = true;
+
+        try {
+            const response = await fetch(`/export-jobs/${format}`, {
+                method: "POST",
+                headers: { "X-CSRFToken": csrfToken },
+                body: new FormData(form)
+            });
+            const job = await response.json();
+            if (!response.ok) throw new Error(job.error || "Ошибка запроса");
+
+            const socket = AppSocket.get();
+            const onProgress = (data) => {
+                if (data.job_id !== job.job_id) return;
+
+                if (data.status === "finished") {
+                    socket.off("export_progress", onProgress);
+                    button.innerText = buttonText;
+                    button.disabled = false;
+                    window.location.href = job.download_url;
+                } else if (data.status === "failed") {
+                    socket.off("export_progress", onProgress);
+                    button.innerText = buttonText;
+                    button.disabled = false;
+                    messageFlash.addMessage(data.error || "Ошибка экспорта", "error");
+                } else {
+                    button.innerText = `${data.done} / ${data.total}`;
+                }
+            };
+            socket.on("export_progress", onProgress);
+
+            // задание могло завершиться до подписки на события
+            const state = await (await fetch(job.status_url)).json();
+            onProgress({ ...state, job_id: state.id });
+        } catch (err) {
+            console.error("Ошибка экспорта:", err);
+            button.innerText = buttonText;
+            button.disabled = false;
+            messageFlash.addMessage(err.message, "error");
+        }
+    }
+};
+
 function Edit_econmeasure_modal() {
     const EditDirectionsModal = document.getElementById('EditDirectionModal');
     if (!EditDirectionsModal) {
@@ -1737,6 +1881,7 @@ class MultiTypeSearchManager {
         this.currentPage = 1;
         this.currentQuery = '';
         this.hasNextPage = false;
+        this.nextCursor = null;
         this.selectedItemType = 'organization'; // По умолчанию организация
         this.selectedItemId = null;
         this.allItems = []; // Для хранения всех загруженных данных
@@ -1862,7 +2007,10 @@ class MultiTypeSearchManager {
 
             // console.log(`Загрузка данных: тип=${this.selectedItemType}, endpoint=${apiUrl}, ключ=${dataKey}`);
 
-            const url = `${apiUrl}?q=${encodeURIComponent(this.currentQuery)}&page=${this.currentPage}`;
+            let url = `${apiUrl}?q=${encodeURIComponent(this.currentQuery)}`;
+            if (append && this.nextCursor) {
+                url += `&cursor=${encodeURIComponent(this.nextCursor)}`;
+            }
             const response = await fetch(url);
             
             if (!response.ok) throw new Error(`HTTP error: ${response.status}`);
@@ -1881,6 +2029,7 @@ class MultiTypeSearchManager {
             }
             
             this.hasNextPage = data.has_next;
+            this.nextCursor = data.next_cursor || null;
             this.renderItems();
             this.updateLoadMoreButton();
             
@@ -2844,9 +2993,9 @@ class MultiStepForm {
         this.currentEntityType = 'organization';
         this.selectedItem = null;
         this.searchData = {
-            organization: { page: 1, query: '', hasMore: false, loading: false },
-            ministry: { page: 1, query: '', hasMore: false, loading: false },
-            region: { page: 1, query: '', hasMore: false, loading: false }
+            organization: { page: 1, query: '', hasMore: false, cursor: null, loading: false },
+            ministry: { page: 1, query: '', hasMore: false, cursor: null, loading: false },
+            region: { page: 1, query: '', hasMore: false, cursor: null, loading: false }
         };
         this.debounceTimers = {};
         this.init();
@@ -3313,7 +3462,10 @@ class MultiStepForm {
         
         try {
             const endpoint = this.config.endpoints[type] || `/api/${type}`;
-            const url = `${endpoint}?q=${encodeURIComponent(query)}&page=${page}`;
+            let url = `${endpoint}?q=${encodeURIComponent(query)}`;
+            if (append && this.searchData[type].cursor) {
+                url += `&cursor=${encodeURIComponent(this.searchData[type].cursor)}`;
+            }
             
             console.log(`Fetching ${type}:`, url);
             
@@ -3362,6 +3514,7 @@ class MultiStepForm {
             });
             
             this.searchData[type].hasMore = data.has_next || false;
+            this.searchData[type].cursor = data.next_cursor || null;
             if (moreButton) {
                 moreButton.style.display = data.has_next ? 'block' : 'none';
             }
@@ -3514,6 +3667,7 @@ class MultiStepForm {
                 page: 1, 
                 query: '', 
                 hasMore: false, 
+                cursor: null,
                 loading: false 
             };
         });
@@ -4203,9 +4357,6 @@ document.addEventListener('DOMContentLoaded', () => {
             popup: "#notifPopup"
         });
         Notifications.init();
-        // setInterval(() => {
-        //     Notifications.init();
-        // }, 60000);
 
     }
 
@@ -1,13 +1,10 @@
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-import os
 import random
-import smtplib
 import string
 from flask import current_app, flash, redirect, request, session, url_for
 from sqlalchemy import func
 from website import db
 from website.models import User
+from website.user.mail import queue_email
 import base64
 
 from flask import (
@@ -26,9 +23,7 @@ from sqlalchemy import func
 from werkzeug.security import check_password_hash, generate_password_hash
 
 def mes_on_email(message_body, recipient_email, email_type):
-    sender = os.getenv('EMAILNAME')
-    password = os.getenv('EMAILPASS')
-
+    """Формирует письмо и ставит его в очередь отправки (website.user.mail); коммит - за вызывающим"""
     if email_type == "code":
         content = f"""
         <div style='padding:20px 40px; color:#000000; font-size:15px;'>
@@ -91,27 +86,14 @@ def mes_on_email(message_body, recipient_email, email_type):
     </html>
     """
 
-    server = smtplib.SMTP('smtp.gmail.com', 587)
-    server.starttls()
+    # Обновляем тему письма в зависимости от типа
+    if email_type == "reset_link":
+        subject = "Сброс пароля - ErespondentS"
+    else:
+        subject = "Оповещение"
 
-    try:
-        server.login(sender, password)
-        msg = MIMEMultipart()
-        msg["From"] = sender
-        msg["To"] = recipient_email
-        # Обновляем тему письма в зависимости от типа
-        if email_type == "reset_link":
-            msg["Subject"] = "Сброс пароля - ErespondentS"
-        else:
-            msg["Subject"] = "Оповещение"
-        
-        msg.attach(MIMEText(html_template, "html"))
-        server.sendmail(sender, recipient_email, msg.as_string())
-        return "Email sent successfully"
-    except Exception as _ex:
-        return f"{_ex}\nCheck log ..."
-    finally:
-        server.quit()
+    queue_email(recipient_email, subject, html_template)
+    return "Email queued"
 
 def gener_password():
     length=5
@@ -141,7 +123,8 @@ def sign_def(email, password1, password2):
                 'password': generate_password_hash(password1)
             }
             session.permanent = True
-            send_activation_email(email) 
+            send_activation_email(email)
+            db.session.commit()
             flash('Проверьте свою почту для активации аккаунта.', 'success')
             return redirect(url_for('auth.code'))
     else:
@@ -0,0 +1,237 @@
+"""
+Исходящая почта: очередь писем в таблице mail_outbox и фоновый отправитель.
+
+Запрос только добавляет письмо в очередь в своей транзакции (одна вставка);
+поток отправки будится после ее коммита.
+Поток держит одно SMTP-соединение (STARTTLS и вход - один раз), переиспользует
+его для всех писем и закрывает после MAIL_IDLE_TIMEOUT секунд простоя.
+Пачка писем сначала помечается sending и коммитится, SMTP-отправка идет вне
+транзакции. Неудачные отправки повторяются с экспоненциальной задержкой, после
+MAIL_MAX_ATTEMPTS попыток письмо помечается failed.
+
+MAIL_TRANSPORT='memory' подменяет SMTP локальной заглушкой: письма складываются
+в список MemoryTransport.messages (для тестов и локальной разработки).
+"""
+import smtplib
+import threading
+import time
+from datetime import timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from flask import current_app
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from website import db
+from website.models import OutboxMessage, current_utc_time
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+_worker = None
+_worker_lock = threading.Lock()
+_wakeup = threading.Event()
+
+_QUEUED_KEY = 'queued_mail'
+
+
+class SmtpTransport:
+    """Постоянное SMTP-соединение, открываемое при первой отправке"""
+
+    def __init__(self, config):
+        self.host = config.get('MAIL_SERVER', 'smtp.gmail.com')
+        self.port = config.get('MAIL_PORT', 587)
+        self.use_tls = config.get('MAIL_USE_TLS', True)
+        self.username = config.get('MAIL_USERNAME')
+        self.password = config.get('MAIL_PASSWORD')
+        self.timeout = config.get('MAIL_TIMEOUT', 30)
+        self._server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()
+        if self.username:
+            server.login(self.username, self.password)
+        self._server = server
+
+    def send(self, sender, recipient, message):
+        if self._server is None:
+            self._connect()
+        try:
+            self._server.sendmail(sender, recipient, message)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # сервер закрыл простаивающее соединение - переподключаемся один раз
+            self.close()
+            self._connect()
+            self._server.sendmail(sender, recipient, message)
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+
+class MemoryTransport:
+    """Локальная заглушка SMTP: письма остаются в памяти процесса"""
+
+    messages = []
+
+    def __init__(self, config):
+        pass
+
+    def send(self, sender, recipient, message):
+        MemoryTransport.messages.append((sender, recipient, message))
+
+    def close(self):
+        pass
+
+
+TRANSPORTS = {
+    'smtp': SmtpTransport,
+    'memory': MemoryTransport,
+}
+
+
+def _build_message(sender, recipient, subject, html):
+    msg = MIMEMultipart()
+    msg["From"] = sender
+    msg["To"] = recipient
+    msg["Subject"] = subject
+    msg.attach(MIMEText(html, "html"))
+    return msg.as_string()
+
+
+def _backoff(app, attempts):
+    base = app.config.get('MAIL_RETRY_BASE_DELAY', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), app.config.get('MAIL_RETRY_MAX_DELAY', 3600)))
+
+
+def _claim_due(app, batch_size):
+    """
+    Забирает пачку писем, которые пора отправить: строки выбираются с SKIP LOCKED,
+    помечаются sending и коммитятся - блокировки не держатся во время SMTP.
+    Письмо, зависшее в sending (воркер упал после захвата), снова становится
+    доступным через MAIL_SENDING_TIMEOUT секунд.
+    """
+    now = current_utc_time()
+    messages = (OutboxMessage.query
+                .filter(OutboxMessage.status.in_((PENDING, SENDING)),
+                        OutboxMessage.next_attempt_at <= now)
+                .order_by(OutboxMessage.id)
+                .with_for_update(skip_locked=True)
+                .limit(batch_size)
+                .all())
+    lease_until = now + timedelta(seconds=app.config.get('MAIL_SENDING_TIMEOUT', 300))
+    claimed = []
+    for message in messages:
+        message.status = SENDING
+        message.attempts += 1
+        message.next_attempt_at = lease_until
+        claimed.append((message.id, message.recipient, message.subject, message.html, message.attempts))
+    db.session.commit()
+    return claimed
+
+
+def _finish(message_id, **values):
+    db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id == message_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def deliver_pending(app, transport):
+    """Отправляет все письма, срок которых наступил; возвращает число отправленных"""
+    sender = app.config.get('MAIL_USERNAME')
+    batch_size = app.config.get('MAIL_BATCH_SIZE', 20)
+    max_attempts = app.config.get('MAIL_MAX_ATTEMPTS', 5)
+    delivered = 0
+
+    while True:
+        claimed = _claim_due(app, batch_size)
+        if not claimed:
+            return delivered
+
+        # отправка вне транзакции; результат каждого письма коммитится отдельно
+        for message_id, recipient, subject, html, attempts in claimed:
+            try:
+                transport.send(sender, recipient, _build_message(sender, recipient, subject, html))
+            except Exception as e:
+                transport.close()
+                if attempts >= max_attempts:
+                    _finish(message_id, status=FAILED, last_error=str(e)[:500])
+                else:
+                    _finish(message_id, status=PENDING, last_error=str(e)[:500],
+                            next_attempt_at=current_utc_time() + _backoff(app, attempts))
+                app.logger.warning("Mail to %s failed (attempt %s): %s", recipient, attempts, e)
+            else:
+                _finish(message_id, status=SENT, sent_at=current_utc_time(), last_error=None)
+                delivered += 1
+
+
+def _run_worker(app):
+    transport = TRANSPORTS[app.config.get('MAIL_TRANSPORT', 'smtp')](app.config)
+    poll_interval = app.config.get('MAIL_POLL_INTERVAL', 30)
+    idle_timeout = app.config.get('MAIL_IDLE_TIMEOUT', 60)
+    last_sent = None
+
+    while True:
+        # сброс до выборки: письмо, поставленное во время отправки, разбудит следующий цикл
+        _wakeup.clear()
+        with app.app_context():
+            try:
+                if deliver_pending(app, transport):
+                    last_sent = time.monotonic()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Mail outbox worker failed")
+            finally:
+                db.session.remove()
+
+        if last_sent is not None and time.monotonic() - last_sent > idle_timeout:
+            transport.close()
+            last_sent = None
+
+        _wakeup.wait(poll_interval)
+
+
+def start_mail_worker(app):
+    """Запускает поток отправки в текущем процессе (один раз)"""
+    global _worker
+    with _worker_lock:
+        if _worker is not None and _worker.is_alive():
+            return
+        _worker = threading.Thread(target=_run_worker, args=(app,), name='mail-outbox', daemon=True)
+        _worker.start()
+
+
+def queue_email(recipient, subject, html):
+    """
+    Добавляет письмо в очередь в текущей транзакции; коммит - за вызывающим.
+    Поток отправки будится после коммита (при откате письма нет и будить некого).
+    """
+    db.session.add(OutboxMessage(recipient=recipient, subject=subject, html=html))
+    db.session.info[_QUEUED_KEY] = current_app._get_current_object()
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_after_commit(session):
+    app = session.info.pop(_QUEUED_KEY, None)
+    if app is not None:
+        start_mail_worker(app)
+        _wakeup.set()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_queued(session):
+    session.info.pop(_QUEUED_KEY, None)
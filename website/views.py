@@ -1,8 +1,6 @@
 from datetime import timedelta
-import io
-import zipfile
 from flask import (
-    Blueprint, abort, current_app, logging, render_template, redirect, send_file, url_for, flash, request, jsonify, session, g
+    Blueprint, Response, abort, current_app, logging, render_template, redirect, send_file, stream_with_context, url_for, flash, request, jsonify, session, g
 )
 
 from flask_login import (
@@ -10,6 +8,7 @@ from flask_login import (
 )
 from sqlalchemy.orm import joinedload
 from sqlalchemy import func, asc, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from .models import Ministry, Region, User, Organization, Plan, Ticket, Unit, Direction, Indicator, EconMeasure, EconExec, IndicatorUsage, Notification, current_utc_time
@@ -20,6 +19,21 @@ from functools import wraps
 from decimal import Decimal, InvalidOperation
 
 from .auth import user_with_all_params
+from .plans.indicators import recompute_derived_indicators, indicator_sources, ECON_EXECES
+from .plans.status import STATUS_COLUMNS, get_status_counts, invalidate_status_counts
+from .plans.archive import iter_zip
+from .plans.rollups import (
+    plan_rollup_groups, plan_status, refresh_plan_rollups, refresh_rollup_groups, stored_plan_rollup_groups
+)
+from .plans.reference import get_reference
+from .plans.importer import PlanImportError, import_plan_file
+from .plans.batch import BatchError, apply_plan_batch
+from .plans.context import get_plan, is_plan_owner, load_current_plan
+from .plans.notifications import (
+    mark_all_read, notifications_page, notifications_since, notify, serialize_notification, unread_count
+)
+
+IMPORT_ERRORS_SHOWN = 10
 
 views = Blueprint('views', __name__)
 
@@ -38,23 +52,17 @@ def owner_only(f):
             flash('ID плана не указан', 'error')
             return redirect(url_for('views.plans', user=current_user.id))
         
-        plan = Plan.query.get(plan_id)
+        # план и права на него загружаются один раз на запрос (g.current_plan)
+        plan = load_current_plan(plan_id, current_user)
         
         if plan is None:
             flash('План не найден', 'error')
             return redirect(url_for('views.plans', user=current_user.id))
         
-        has_access = (
-            current_user.is_admin or 
-            current_user.is_auditor or 
-            plan.user_id == current_user.id
-        )
-        
-        if not has_access:
+        if not g.current_plan_access:
             flash('У вас нет доступа к этому плану', 'error')
             return redirect(url_for('views.plans', user=current_user.id))
     
-        g.current_plan = plan
         return f(*args, **kwargs)
     
     return decorated_function
@@ -169,21 +177,10 @@ def edit_user_org():
 @login_required
 def get_organizations_api():
     try:
-        page = request.args.get("page", 1, type=int)
+        from .plans.search import search_organizations
         search_query = request.args.get("q", "", type=str).strip()
+        rows, next_cursor = search_organizations(search_query, request.args.get("cursor"))
 
-        query = Organization.query
-        if search_query:
-            query = query.filter(
-                db.or_(
-                    Organization.name.ilike(f"%{search_query}%"),
-                    Organization.okpo.ilike(f"%{search_query}%")
-                )
-            )
-
-        per_page = 10
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        
         return jsonify({
             "organizations": [
                 {
@@ -191,14 +188,12 @@ def get_organizations_api():
                     "name": org.name,
                     "okpo": org.okpo or "",
                     "ynp": org.ynp or "",
-                    "ministry": org.ministry.name if org.ministry else "",
+                    "ministry": org.ministry or "",
                 }
-                for org in pagination.items
+                for org in rows
             ],
-            "page": pagination.page,
-            "has_next": pagination.has_next,
-            "total_pages": pagination.pages,
-            "total_items": pagination.total
+            "has_next": next_cursor is not None,
+            "next_cursor": next_cursor
         })
     except Exception as e:
         logging.error(f"Error fetching organizations: {str(e)}")
@@ -208,17 +203,9 @@ def get_organizations_api():
 @login_required
 def get_ministries_api():
     try:
-        page = request.args.get("page", 1, type=int)
+        from .plans.search import search_ministries
         search_query = request.args.get("q", "", type=str).strip()
-        
-        query = Ministry.query.filter(Ministry.is_active == True)
-        
-        if search_query:
-            query = query.filter(Ministry.name.ilike(f"%{search_query}%"))
-        
-        query = query.order_by(Ministry.name)
-        per_page = 10
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        rows, next_cursor = search_ministries(search_query, request.args.get("cursor"))
         
         return jsonify({
             "ministrys": [
@@ -226,36 +213,23 @@ def get_ministries_api():
                     "id": ministry.id,
                     "name": ministry.name
                 }
-                for ministry in pagination.items
+                for ministry in rows
             ],
-            "page": pagination.page,
-            "has_next": pagination.has_next,
-            "total_pages": pagination.pages,
-            "total_items": pagination.total
+            "has_next": next_cursor is not None,
+            "next_cursor": next_cursor
         })
         
     except Exception as e:
         logging.error(f"Error fetching Ministries: {str(e)}")
-        print(f"ERROR: {str(e)}") 
         return jsonify({"error": "Internal server error"}), 500
 
 @views.route('/api/regions')
 @login_required
 def get_regions_api():
     try:
-        page = request.args.get("page", 1, type=int)
+        from .plans.search import search_regions
         search_query = request.args.get("q", "", type=str).strip()
-
-        query = Region.query
-        if search_query:
-            query = query.filter(
-                db.or_(
-                    Region.name.ilike(f"%{search_query}%")
-                )
-            )
-
-        per_page = 10
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        rows, next_cursor = search_regions(search_query, request.args.get("cursor"))
         
         return jsonify({
             "regions": [
@@ -263,20 +237,18 @@ def get_regions_api():
                     "id": region.id,
                     "name": region.name
                 }
-                for region in pagination.items
+                for region in rows
             ],
-            "page": pagination.page,
-            "has_next": pagination.has_next,
-            "total_pages": pagination.pages,
-            "total_items": pagination.total
+            "has_next": next_cursor is not None,
+            "next_cursor": next_cursor
         })
     except Exception as e:
         logging.error(f"Error fetching regions: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
 def get_plans_by_okpo():
-    okpo_digit = str(current_user.organization.okpo)[-4]
-    """Фильтрация по 4-ой цифре с конца OKPO: {okpo_digit}"""
+    okpo_digit = current_user.organization.region_digit
+    """Фильтрация по цифре региона (4-ая с конца OKPO): {okpo_digit}"""
     
     status_filter = or_(
         Plan.is_sent == True,
@@ -284,34 +256,31 @@ def get_plans_by_okpo():
         Plan.is_approved == True
     )
     
-    if current_user.is_admin or (current_user.is_auditor and str(current_user.organization.okpo)[-4] == "8"):
+    if current_user.is_admin or (current_user.is_auditor and okpo_digit == "8"):
         """Доступ для администраторов/аудиторов"""
         return Plan.query.filter(
             status_filter
         ).order_by(Plan.year.asc())
     else:
-        """Доступ для других аудиторов с фильтрацией по OKPO"""
+        """Доступ для других аудиторов: индексированный region_digit организации"""
         return Plan.query.join(Organization).filter(
             status_filter,
-            func.substr(Organization.okpo, func.length(Organization.okpo) - 3, 1) == okpo_digit
+            Organization.region_digit == okpo_digit
         ).order_by(Plan.year.asc())
 
+def visible_plans_query(user):
+    """Планы, доступные пользователю: аудитору - по региону, остальным - свои"""
+    if user.is_auditor:
+        return get_plans_by_okpo()
+    return Plan.query.filter_by(user_id=user.id)
+
 def get_filtered_plans(user, status_filter="all", year_filter="all"):
     """Возвращает планы и счетчики по фильтрам для конкретного пользователя"""
     
-    if user.is_auditor:
-        base_query = get_plans_by_okpo()
-    else:
-        base_query = Plan.query.filter_by(user_id=user.id)
-    
-    display_query = base_query
+    display_query = visible_plans_query(user)
 
     status_filters = {
-        'draft': Plan.is_draft == True,
-        'control': Plan.is_control == True,
-        'sent': Plan.is_sent == True,
-        'error': Plan.is_error == True,
-        'approved': Plan.is_approved == True
+        status: column == True for status, column in STATUS_COLUMNS.items()
     }
 
     if status_filter != 'all' and status_filter in status_filters:
@@ -322,20 +291,7 @@ def get_filtered_plans(user, status_filter="all", year_filter="all"):
 
     plans = display_query.all()
 
-    count_query = base_query
-    if year_filter != 'all':
-        count_query = count_query.filter(Plan.year == int(year_filter))
-    if status_filter != 'all' and status_filter in status_filters:
-        count_query = count_query.filter(status_filters[status_filter])
-
-    status_counts = {
-        'all': count_query.count(),
-        'draft': count_query.filter(Plan.is_draft == True).count(),
-        'control': count_query.filter(Plan.is_control == True).count(),
-        'sent': count_query.filter(Plan.is_sent == True).count(),
-        'error': count_query.filter(Plan.is_error == True).count(),
-        'approved': count_query.filter(Plan.is_approved == True).count()
-    }
+    status_counts = get_status_counts(user, display_query, status_filter, year_filter)
     return plans, status_counts
 
 @views.route('/plans', methods=['GET'])
@@ -399,47 +355,100 @@ def export_to(format):
         flash("Не выбраны планы.", "error")
         return redirect(request.url)
 
-    plans = Plan.query.filter(Plan.id.in_(ids)).all()
-    if not plans:
+    plan_ids = [plan_id for (plan_id,) in visible_plans_query(current_user).filter(Plan.id.in_(ids)).with_entities(Plan.id).all()]
+    if not plan_ids:
         flash("Не найдены выбранные планы.", "error")
         return redirect(request.url)
     
+    from .plans.snapshot import load_plan_snapshot, load_plan_snapshots
+    if format == "xml-feed":
+        from .plans.export import iter_xml_feed
+        return Response(
+            stream_with_context(iter_xml_feed(load_plan_snapshots(plan_ids))),
+            mimetype="application/xml",
+            headers={"Content-Disposition": 'attachment; filename="plans.xml"'}
+        )
+
+    exporter = get_exporter(format)
+    if exporter is None:
+        flash("Неизвестный формат.", "error")
+        return redirect(request.url)
+
+    if len(plan_ids) == 1:
+        file_stream, mime, filename = exporter(load_plan_snapshot(plan_ids[0]))
+        return send_file(file_stream, as_attachment=True, download_name=filename, mimetype=mime)
+
+    from .plans.export import render_many
+    entries = render_many(exporter, load_plan_snapshots(plan_ids), export_processes(format))
+
+    return Response(
+        stream_with_context(iter_zip(entries)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="plans.zip"'}
+    )
+
+def get_exporter(format):
     from .plans.export import (
-        export_pdf_single, 
+        export_pdf_single,
         export_xlsx_single,
         export_xml_single
-        
     )
-    if len(plans) == 1:
-        plan = plans[0]
-        if format == "xml":
-            file_stream, mime, filename = export_xml_single(plan)
-        elif format == "xlsx":
-            file_stream, mime, filename = export_xlsx_single(plan)
-        elif format == "pdf":
-            file_stream, mime, filename = export_pdf_single(plan)
-        else:
-            flash("Неизвестный формат.", "error")
-            return redirect(request.url)
-        return send_file(file_stream, as_attachment=True, download_name=filename, mimetype=mime)
-    
-    zip_stream = io.BytesIO()
-    with zipfile.ZipFile(zip_stream, "w") as zip_file:
-        for plan in plans:
-            if format == "xml":
-                f_stream, _, fname = export_xml_single(plan)
-            elif format == "xlsx":
-                f_stream, _, fname = export_xlsx_single(plan)
-            elif format == "pdf":
-                f_stream, _, fname = export_pdf_single(plan)
-            else:
-                flash("Неизвестный формат.", "error")
-                return redirect(request.url)
+    return {
+        "xml": export_xml_single,
+        "xlsx": export_xlsx_single,
+        "pdf": export_pdf_single,
+    }.get(format)
+
+def export_processes(format):
+    """Число процессов для рендера пакетного экспорта (XLSX и PDF строятся дольше всего)"""
+    if format in ("xlsx", "pdf"):
+        return current_app.config.get('EXPORT_PROCESSES', 1)
+    return 1
+
+@views.route('/export-jobs/<string:format>', methods=['POST'])
+@user_with_all_params()
+@login_required
+def export_job_submit(format):
+    ids = request.form.getlist("ids")
+    if not ids:
+        return jsonify({'error': 'Не выбраны планы.'}), 400
+
+    exporter = get_exporter(format)
+    if exporter is None:
+        return jsonify({'error': 'Неизвестный формат.'}), 400
 
-            zip_file.writestr(fname, f_stream.getvalue())
+    plan_ids = [plan_id for (plan_id,) in visible_plans_query(current_user).filter(Plan.id.in_(ids)).with_entities(Plan.id).all()]
+    if not plan_ids:
+        return jsonify({'error': 'Не найдены выбранные планы.'}), 404
 
-    zip_stream.seek(0)
-    return send_file(zip_stream, as_attachment=True, download_name="plans.zip", mimetype="application/zip")
+    from .plans.export_jobs import submit_export_job
+    job_id = submit_export_job(current_user.id, plan_ids, format, exporter, export_processes(format))
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('views.export_job_status', job_id=job_id),
+        'download_url': url_for('views.export_job_download', job_id=job_id)
+    }), 202
+
+@views.route('/export-jobs/<string:job_id>', methods=['GET'])
+@user_with_all_params()
+@login_required
+def export_job_status(job_id):
+    from .plans.export_jobs import get_job
+    job = get_job(job_id)
+    if not job or job['user_id'] != current_user.id:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return jsonify(job)
+
+@views.route('/export-jobs/<string:job_id>/download', methods=['GET'])
+@user_with_all_params()
+@login_required
+def export_job_download(job_id):
+    from .plans.export_jobs import get_job, archive_path
+    job = get_job(job_id)
+    if not job or job['user_id'] != current_user.id or job['status'] != 'finished':
+        abort(404)
+    return send_file(archive_path(current_app, job_id), as_attachment=True,
+                     download_name=f"plans_{job['format']}.zip", mimetype="application/zip")
 
 @views.route('/create-plan', methods=['GET', 'POST'])
 @user_with_all_params()
@@ -492,18 +501,16 @@ def create_plan():
         )
         
         db.session.add(new_plan)
+        db.session.flush()
+        try:
+            # сбой пересчета счетчиков статусов не должен мешать созданию плана
+            with db.session.begin_nested():
+                refresh_plan_rollups(new_plan, sums=False)
+        except SQLAlchemyError as e:
+            current_app.logger.error(f"Rollup refresh failed for new plan {new_plan.id}: {str(e)}")
         db.session.commit()
 
-        existing_indicators = db.session.query(IndicatorUsage.id_indicator)\
-            .filter(IndicatorUsage.id_plan == new_plan.id)\
-            .subquery()
-        
-        mandatory_indicators = Indicator.query\
-            .filter(Indicator.IsMandatory == True)\
-            .filter(~Indicator.id.in_(existing_indicators))\
-            .all()
-        
-        for indicator in mandatory_indicators:
+        for indicator in get_reference().mandatory_indicators:
             indicator_usage = IndicatorUsage(
                 id_indicator=indicator.id,
                 id_plan=new_plan.id,
@@ -514,6 +521,7 @@ def create_plan():
             db.session.add(indicator_usage)
         
         db.session.commit()
+        invalidate_status_counts(current_user.id)
         flash('Новый план создан', 'success')
         return redirect(url_for('views.plans'))
 
@@ -527,12 +535,9 @@ def create_plan():
 @owner_only
 @login_required
 def edit_plan(id):
-    current_plan = Plan.query.filter_by(
-        id=id,
-        user_id=current_user.id
-    ).first()
+    current_plan = g.current_plan
     
-    if not current_plan:
+    if not is_plan_owner():
         flash('План не найден или у вас нет прав для его редактирования', 'error')
         return redirect(url_for('views.plans'))
     
@@ -553,32 +558,37 @@ def edit_plan(id):
     saving_fuel = to_decimal_3(request.form.get('saving_fuel'))
     share_energy = to_decimal_3(request.form.get('share_energy'))
 
+    # при смене года план уходит из сводок прежнего года - группы берутся до изменения
+    old_groups = stored_plan_rollup_groups(id) if str(current_plan.year) != str(year) else []
+
     current_plan.year = year
     current_plan.energy_saving = energy_saving
     current_plan.share_fuel = share_fuel
     current_plan.saving_fuel = saving_fuel
     current_plan.share_energy = share_energy
     
-    current_plan.change_time = current_utc_time()
-    
-    db.session.commit()
+    # изменения плана и отметка времени сохраняются одним коммитом в update_ChangeTimePlan
     flash('Изменения приняты', 'success')
-    update_ChangeTimePlan(current_plan.id)
-    return redirect(url_for('views.plan_review', id=current_plan.id))  
+    update_ChangeTimePlan(id, old_groups)
+    return redirect(url_for('views.plan_review', id=id))  
     
 @views.route('/delete-plan/<int:id>', methods=['POST'])
 @user_with_all_params()
 @owner_only
 @login_required
 def delete_plan(id):
+    if not is_plan_owner():
+        flash('План не найден или у вас нет прав для его удаления', 'error')
+        return redirect(url_for('views.plans'))
     try:
-        current_plan = Plan.query.filter_by(
-            id=id,
-            user_id=current_user.id
-        ).first()
+        current_plan = g.current_plan
 
+        rollup_groups = plan_rollup_groups(current_plan)
+        was_approved = current_plan.is_approved
         db.session.delete(current_plan)
+        refresh_rollup_groups(rollup_groups, sums=was_approved)
         db.session.commit()
+        invalidate_status_counts(current_user.id)
         
         flash('План успешно удален', 'success')
         
@@ -608,13 +618,17 @@ def check_plan_year():
         
     return jsonify({'exists': existing_plan is not None})
 
-@views.route('/stats', methods=['GET', 'POST'])
+@views.route('/stats', methods=['GET'])
 @user_with_all_params()
 @login_required
 def stats():
-    if request.method == 'POST':
-        pass
+    from .plans.rollups import user_rollup_scope
+    from .plans.stats import stats_years
+    scope = user_rollup_scope(current_user)
+    years = stats_years(*scope) if scope else []
     return render_template('stats.html', 
+                        years=years,
+                        stats_available=scope is not None,
                         hide_header=False,
                         second_header = True,
                         active_tab='stats')
@@ -661,7 +675,7 @@ def plan_directions(id):
         pass
     
     current_plan = g.current_plan
-    directions = Direction.query.all() 
+    directions = get_reference().directions
     
     econ_measures = (
         EconMeasure.query
@@ -717,7 +731,6 @@ def create_econmeasure(id):
     )
     
     db.session.add(new_econmeasure)
-    db.session.commit()    
     flash('Направление добавлено', 'success')
     update_ChangeTimePlan(id)
     return redirect(url_for('views.plan_directions', id=id))
@@ -731,9 +744,8 @@ def delete_econmeasure(id):
     id_plan = econ_measure.id_plan
 
     db.session.delete(econ_measure)
-    db.session.commit()
     
-    other_data_indicatorUpdate(id)
+    other_data_indicatorUpdate(id_plan, {ECON_EXECES})
     update_ChangeTimePlan(id_plan)
 
     flash('Направление успешно удалено', 'success')
@@ -756,57 +768,10 @@ def edit_econmeasure(id):
     id = econmeasure.id_plan
     econmeasure.year_econ = year_econ
     econmeasure.estim_econ = estim_econ
-    db.session.commit()
     update_ChangeTimePlan(id)
     flash('Направление обновлено', 'success')
     return redirect(url_for('views.plan_directions', id=id))
 
-def get_cumulative_econ_metrics(plan_id, is_local): 
-    """ Возвращает нарастающие итоги экономических показателей по кварталам """
-    quarterly_results = (db.session.query(
-            EconExec.ExpectedQuarter,  
-            func.sum(EconExec.EffCurrYear).label('total_eff'), 
-            func.sum(EconExec.VolumeFin).label('total_vol')
-        )
-        .join(EconMeasure) 
-        .join(Plan)
-        .filter(Plan.id == plan_id, EconExec.is_local == is_local)
-        .group_by(EconExec.ExpectedQuarter)
-        .all())
-    
-    cumulative_totals = {
-        'jan_mar': {'eff_curr_year': 0, 'volume_fin': 0},  # Январь-Март
-        'jan_jun': {'eff_curr_year': 0, 'volume_fin': 0},  # Январь-Июнь
-        'jan_sep': {'eff_curr_year': 0, 'volume_fin': 0},  # Январь-Сентябрь
-        'jan_dec': {'eff_curr_year': 0, 'volume_fin': 0}   # Январь-Декабрь
-    }
-    
-
-    quarter_data = {1: {'eff': 0, 'vol': 0}, 2: {'eff': 0, 'vol': 0}, 
-                   3: {'eff': 0, 'vol': 0}, 4: {'eff': 0, 'vol': 0}}
-    
-    for quarter, eff_sum, vol_sum in quarterly_results:
-        if quarter in [1, 2, 3, 4]:
-            quarter_data[quarter]['eff'] = eff_sum or 0
-            quarter_data[quarter]['vol'] = vol_sum or 0
-    
-
-    cumulative_totals['jan_mar']['eff_curr_year'] = quarter_data[1]['eff']
-    cumulative_totals['jan_mar']['volume_fin'] = quarter_data[1]['vol']
-    
-    cumulative_totals['jan_jun']['eff_curr_year'] = quarter_data[1]['eff'] + quarter_data[2]['eff']
-    cumulative_totals['jan_jun']['volume_fin'] = quarter_data[1]['vol'] + quarter_data[2]['vol']
-    
-    cumulative_totals['jan_sep']['eff_curr_year'] = quarter_data[1]['eff'] + quarter_data[2]['eff'] + quarter_data[3]['eff']
-    cumulative_totals['jan_sep']['volume_fin'] = quarter_data[1]['vol'] + quarter_data[2]['vol'] + quarter_data[3]['vol']
-    
-    cumulative_totals['jan_dec']['eff_curr_year'] = (quarter_data[1]['eff'] + quarter_data[2]['eff'] + 
-                                                   quarter_data[3]['eff'] + quarter_data[4]['eff'])
-    cumulative_totals['jan_dec']['volume_fin'] = (quarter_data[1]['vol'] + quarter_data[2]['vol'] + 
-                                                quarter_data[3]['vol'] + quarter_data[4]['vol'])
-    
-    return cumulative_totals
-
 @views.route('/plans/plan-events/<int:id>', methods=['GET', 'POST'])
 @user_with_all_params()
 @login_required
@@ -816,58 +781,10 @@ def plan_events(id):
         pass
     
     current_plan = g.current_plan
-  
-    econ_measures = (
-        EconMeasure.query
-        .filter_by(id_plan=current_plan.id)
-        .join(EconMeasure.direction)
-        .order_by(asc(Direction.code))
-        .all()
-    )
-  
-    econ_exec = (
-        EconExec.query
-        .filter_by(id_plan=current_plan.id)
-        .join(EconMeasure.direction)
-        .order_by(asc(Direction.code))
-        .all()
-    )
-  
-    local_econ_execes = (EconExec.query
-        .join(EconMeasure)
-        .join(Plan)
-        .filter(Plan.id == current_plan.id, EconExec.is_local == True)
-        .options(joinedload(EconExec.econ_measures).joinedload(EconMeasure.plan))
-        .all())
-
-    non_local_econ_execes = (EconExec.query
-        .join(EconMeasure)
-        .join(Plan)
-        .filter(Plan.id == current_plan.id, EconExec.is_local == False)
-        .options(joinedload(EconExec.econ_measures).joinedload(EconMeasure.plan))
-        .all())
-    
-
-    local_totals = get_cumulative_econ_metrics(current_plan.id, True)
-    non_local_totals = get_cumulative_econ_metrics(current_plan.id, False)
-    
-    total_metrics = {
-        'jan_mar_eff': local_totals['jan_mar']['eff_curr_year'] + non_local_totals['jan_mar']['eff_curr_year'],
-        'jan_mar_vol': local_totals['jan_mar']['volume_fin'] + non_local_totals['jan_mar']['volume_fin'],
-        'jan_jun_eff': local_totals['jan_jun']['eff_curr_year'] + non_local_totals['jan_jun']['eff_curr_year'],
-        'jan_jun_vol': local_totals['jan_jun']['volume_fin'] + non_local_totals['jan_jun']['volume_fin'],
-        'jan_sep_eff': local_totals['jan_sep']['eff_curr_year'] + non_local_totals['jan_sep']['eff_curr_year'],
-        'jan_sep_vol': local_totals['jan_sep']['volume_fin'] + non_local_totals['jan_sep']['volume_fin'],
-        'jan_dec_eff': local_totals['jan_dec']['eff_curr_year'] + non_local_totals['jan_dec']['eff_curr_year'],
-        'jan_dec_vol': local_totals['jan_dec']['volume_fin'] + non_local_totals['jan_dec']['volume_fin']
-    }
+    from .plans.plan_events import load_plan_events
 
     return render_template('plan_events.html',  
-                        econ_exec=econ_exec,
-                        econ_measures=econ_measures,
-                        local_econ_execes=local_econ_execes,
-                        non_local_econ_execes=non_local_econ_execes,
-                        total_metrics=total_metrics,
+                        **load_plan_events(current_plan.id),
                         plan=current_plan, 
                         hide_header=False,
                         plan_header=True,
@@ -937,12 +854,65 @@ def create_econexeces(id):
     )
     
     db.session.add(new_econexec)
-    db.session.commit()
-    other_data_indicatorUpdate(id)
+    other_data_indicatorUpdate(id, {ECON_EXECES})
     update_ChangeTimePlan(id)
     flash('Мероприятие добавлено', 'success')
     return redirect(url_for('views.plan_events', id=id))
     
+@views.route('/import-plan/<int:id>', methods=['POST'])
+@user_with_all_params()
+@login_required
+@owner_only
+def import_plan_file_route(id):
+    plan = g.current_plan
+    if plan.is_sent or plan.is_approved:
+        flash('План недоступен для редактирования', 'error')
+        return redirect(url_for('views.plan_events', id=id))
+
+    uploaded_file = request.files.get('file')
+    if not uploaded_file or uploaded_file.filename == '':
+        flash('Файл не выбран', 'error')
+        return redirect(url_for('views.plan_events', id=id))
+
+    try:
+        execs_count, indicators_count = import_plan_file(
+            plan, uploaded_file, replace=request.form.get('replace') == 'on')
+    except PlanImportError as e:
+        db.session.rollback()
+        for message in e.errors[:IMPORT_ERRORS_SHOWN]:
+            flash(message, 'error')
+        if len(e.errors) > IMPORT_ERRORS_SHOWN:
+            flash(f'... и еще ошибок: {len(e.errors) - IMPORT_ERRORS_SHOWN}', 'error')
+        return redirect(url_for('views.plan_events', id=id))
+
+    db.session.commit()
+    update_ChangeTimePlan(id)
+    flash(f'Загружено мероприятий: {execs_count}, показателей: {indicators_count}', 'success')
+    return redirect(url_for('views.plan_events', id=id))
+
+@views.route('/api/plan-batch/<int:id>', methods=['POST'])
+@user_with_all_params()
+@login_required
+@owner_only
+def api_plan_batch(id):
+    plan = g.current_plan
+    if plan.is_sent or plan.is_approved:
+        return jsonify({'error': 'План недоступен для редактирования'}), 409
+
+    data = request.get_json(silent=True) or {}
+    try:
+        created, derived = apply_plan_batch(plan, data.get('operations'))
+    except BatchError as e:
+        db.session.rollback()
+        return jsonify({'error': 'Пакет не применен', 'errors': e.errors}), 400
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'Пакет не применен: изменения противоречат данным плана'}), 409
+
+    db.session.commit()
+    update_ChangeTimePlan(id)
+    return jsonify({'message': 'Изменения сохранены', 'created': created, 'derived': derived})
+
 @views.route('/delete-econexeces/<int:id>', methods=['POST'])
 @user_with_all_params()
 @login_required
@@ -952,9 +922,8 @@ def delete_econexeces(id):
     id_plan = econ_exec.econ_measures.id_plan
 
     db.session.delete(econ_exec)
-    db.session.commit()
 
-    other_data_indicatorUpdate(id_plan)
+    other_data_indicatorUpdate(id_plan, {ECON_EXECES})
     update_ChangeTimePlan(id_plan)
     flash('Мероприятие успешно удалено', 'success')
     return redirect(url_for('views.plan_events', id=id_plan))
@@ -1007,11 +976,10 @@ def edit_econexeces(id):
     current_EconExec.MoneyLoan=MoneyLoan
     current_EconExec.MoneyOther=MoneyOther
 
-    db.session.commit()
     flash('Мероприятие изменено', 'success')
 
     id_plan = current_EconExec.econ_measures.id_plan
-    other_data_indicatorUpdate(id_plan)
+    other_data_indicatorUpdate(id_plan, {ECON_EXECES})
     update_ChangeTimePlan(id_plan)
     return redirect(url_for('views.plan_events', id=id_plan))
 
@@ -1039,20 +1007,17 @@ def plan_indicators(id):
     
     current_plan = g.current_plan
 
-    used_indicator_subquery = (db.session.query(IndicatorUsage.id_indicator)
-                            .filter(IndicatorUsage.id_plan == current_plan.id)
-                            .subquery())
-
-    indicators_non_mandatory = (Indicator.query
-                            .filter_by(IsMandatory=False)
-                            .filter(~Indicator.id.in_(used_indicator_subquery))
-                            .all())
-    
     indicators = (IndicatorUsage.query
                 .join(Indicator, IndicatorUsage.id_indicator == Indicator.id)
                 .filter(IndicatorUsage.id_plan == current_plan.id)
                 .order_by(Indicator.Group.asc(), Indicator.RowN.asc())
                 .all())
+
+    used_indicator_ids = {usage.id_indicator for usage in indicators}
+    indicators_non_mandatory = [
+        indicator for indicator in get_reference().non_mandatory_indicators
+        if indicator.id not in used_indicator_ids
+    ]
     
     return render_template('plan_indicators.html',  
                         plan=current_plan, 
@@ -1096,7 +1061,10 @@ def create_indicator(id):
         flash('Пустой показатель', 'error')
         return redirect(url_for('views.plan_indicators', id=id))
     
-    indicator = Indicator.query.filter_by(id=id_indicator).first()
+    indicator = get_reference().indicator(id_indicator)
+    if indicator is None:
+        flash('Показатель не найден', 'error')
+        return redirect(url_for('views.plan_indicators', id=id))
 
     QYearPrev = to_decimal_3(QYearPrev_ed * indicator.CoeffToTut)
     QYearCurr = to_decimal_3(QYearCurr_ed * indicator.CoeffToTut)
@@ -1111,8 +1079,7 @@ def create_indicator(id):
     )
     
     db.session.add(new_IndicatorUsage)
-    db.session.commit()
-    other_data_indicatorUpdate(id)
+    other_data_indicatorUpdate(id, indicator_sources(indicator))
     update_ChangeTimePlan(id)
     flash('Показатель добавлен', 'success')
     return redirect(url_for('views.plan_indicators', id=id))
@@ -1130,14 +1097,14 @@ def edit_indicator(id):
         return redirect(request.url)
     
     indicator_usage = IndicatorUsage.query.filter_by(id=id).first()
+    indicator = get_reference().indicator(indicator_usage.id_indicator)
 
-    indicator_usage.QYearPrev = to_decimal_3(QYearPrev_ed * indicator_usage.indicator.CoeffToTut)
-    indicator_usage.QYearCurr = to_decimal_3(QYearCurr_ed * indicator_usage.indicator.CoeffToTut)
-    indicator_usage.QYearNext = to_decimal_3(QYearNext_ed * indicator_usage.indicator.CoeffToTut)
-    db.session.commit()
+    indicator_usage.QYearPrev = to_decimal_3(QYearPrev_ed * indicator.CoeffToTut)
+    indicator_usage.QYearCurr = to_decimal_3(QYearCurr_ed * indicator.CoeffToTut)
+    indicator_usage.QYearNext = to_decimal_3(QYearNext_ed * indicator.CoeffToTut)
 
     id = indicator_usage.id_plan
-    other_data_indicatorUpdate(id)
+    other_data_indicatorUpdate(id, indicator_sources(indicator))
     update_ChangeTimePlan(id)
     flash('Обновление данных', 'success')
     return redirect(url_for('views.plan_indicators', id=id))
@@ -1149,16 +1116,21 @@ def delete_indicator(id):
     indicator = IndicatorUsage.query.get_or_404(id)
 
     id_plan = indicator.id_plan
+    sources = indicator_sources(get_reference().indicator(indicator.id_indicator))
 
     db.session.delete(indicator)
-    db.session.commit()
-    other_data_indicatorUpdate(id_plan)
+    other_data_indicatorUpdate(id_plan, sources)
     update_ChangeTimePlan(id_plan)
     flash('Показатель успешно удален', 'success')
     return redirect(url_for('views.plan_indicators', id=id_plan))
 
 
-def update_ChangeTimePlan(id):
+def update_ChangeTimePlan(id, old_groups=()):
+    """
+    Возврат плана в редакцию после изменения. Один коммит для изменения,
+    пересчета показателей и отметки времени - вызывающий код не коммитит до него.
+    old_groups - прежние группы сводок плана, если изменились год или организация.
+    """
     def owner_ticket(plan):
         new_ticket = Ticket(
             note='Внесение изменений.',
@@ -1169,13 +1141,17 @@ def update_ChangeTimePlan(id):
 
         db.session.add(new_ticket)
         plan.afch = False
-        db.session.commit()
         
      
-    plan = Plan.query.filter_by(id=id).first()
+    plan = get_plan(id)
     if not plan:
-        return 
+        db.session.commit()
+        return
     
+    invalidate_status_counts(plan.user_id)
+    was_approved = plan.is_approved
+    status_changed = not plan.is_draft or plan.is_control or plan.is_sent or plan.is_error or was_approved
+
     plan.change_time = current_utc_time()
     plan.is_draft = True   
     plan.is_control = False  
@@ -1183,129 +1159,23 @@ def update_ChangeTimePlan(id):
     plan.is_error = False    
     plan.is_approved = False  
 
+    if status_changed or old_groups:
+        refresh_rollup_groups(list(old_groups) + plan_rollup_groups(plan), sums=was_approved)
+
     if plan.afch == True:
         owner_ticket(plan)
 
     db.session.commit()
 
-def other_data_indicatorUpdate(id):
-    plan = Plan.query.filter_by(id=id).first()
-    if not plan:
-        return
-
-    indicator_usages = IndicatorUsage.query.filter_by(id_plan=plan.id).all()
-
-    def econom_ter():
-        total_eff_curr_year = db.session.query(func.sum(EconExec.EffCurrYear))\
-            .filter(
-                EconExec.id_plan == plan.id,
-                EconExec.EffCurrYear.isnot(None)
-            )\
-            .scalar() or 0
-        
-        indicator_usages = IndicatorUsage.query.filter_by(id_plan=plan.id).all()
-        usage_with_code_9900 = None
-        for usage in indicator_usages:
-            if usage.indicator.code == '9900':
-                usage_with_code_9900 = usage
-                break
-        
-        usage_with_code_9900.QYearNext = to_decimal_3(total_eff_curr_year)
-        db.session.commit()
-
-    def first_title():
-        totals = db.session.query(
-                func.sum(IndicatorUsage.QYearPrev).label('total_prev'),
-                func.sum(IndicatorUsage.QYearCurr).label('total_curr'),
-                func.sum(IndicatorUsage.QYearNext).label('total_next')
-            )\
-            .join(IndicatorUsage.indicator)\
-            .filter(
-                IndicatorUsage.id_plan == plan.id,
-                Indicator.IsMandatory == False
-            )\
-            .first()
-
-        total_prev = totals.total_prev or 0
-        total_curr = totals.total_curr or 0
-        total_next = totals.total_next or 0
-
-        usage_with_code_1000 = None
-        for usage in indicator_usages:
-            if usage.indicator.code == '1000':
-                usage_with_code_1000 = usage
-                break
-        
-        if usage_with_code_1000:
-            usage_with_code_1000.QYearPrev = to_decimal_3(total_prev)
-            usage_with_code_1000.QYearCurr = to_decimal_3(total_curr)
-            usage_with_code_1000.QYearNext = to_decimal_3(total_next)
-            db.session.commit()
-    
-    def four_title():
-        indicators_by_code = {}
-        codes_to_find = ['260', '1000', '1105', '1405', '1104', '1404']
-        
-        for usage in indicator_usages:
-            if usage.indicator.code in codes_to_find:
-                indicators_by_code[usage.indicator.code] = usage
-                if len(indicators_by_code) == len(codes_to_find):
-                    break
-        
-        missing_codes = [code for code in codes_to_find if code not in indicators_by_code]
-        if missing_codes:
-            print(f"Не найдены индикаторы: {missing_codes}")
-            return
-        
-        indicator_260 = indicators_by_code['260']
-        indicator_1000 = indicators_by_code['1000']
-        indicator_1105 = indicators_by_code['1105']
-        indicator_1405 = indicators_by_code['1405']
-        indicator_1104 = indicators_by_code['1104']
-        indicator_1404 = indicators_by_code['1404']
-        
-        def get_value(indicator, field_name):
-            value = getattr(indicator, field_name)
-            return value if value is not None else Decimal('0')
-        
-        def calculate_period(period):
-            base = get_value(indicator_1000, period)
-            diff1 = get_value(indicator_1105, period) - get_value(indicator_1405, period)
-            diff2 = get_value(indicator_1104, period) - get_value(indicator_1404, period)
-            return to_decimal_3(base + (diff1 * Decimal('0.123')) + (diff2 * Decimal('0.143')))
-        
-        indicator_260.QYearPrev = calculate_period('QYearPrev')
-        indicator_260.QYearCurr = calculate_period('QYearCurr')
-        indicator_260.QYearNext = calculate_period('QYearNext')
-        db.session.commit()
-
-    def seven_title():
-        usage_with_code_9999 = None
-        for usage in indicator_usages:
-            if usage.indicator.code == '9999':
-                usage_with_code_9999 = usage
-                break
-
-        usage_with_code_9900 = None
-        for usage in indicator_usages:
-            if usage.indicator.code == '9900':
-                usage_with_code_9900 = usage
-                break
-        
-        usage_with_code_9910 = None
-        for usage in indicator_usages:
-            if usage.indicator.code == '9910':
-                usage_with_code_9910 = usage
-                break
-
-        usage_with_code_9999.QYearNext = usage_with_code_9900.QYearNext + usage_with_code_9910.QYearNext
-
-    first_title()
-    four_title()
-    econom_ter()
-    seven_title()
+def other_data_indicatorUpdate(id, sources=None):
+    """
+    Пересчет расчетных показателей плана, затронутых изменением sources.
+    Коммит - в следующем за ним update_ChangeTimePlan.
+    """
+    recompute_derived_indicators(id, sources, commit=False)
 
 def handle_draft_status(plan):
+    invalidate_status_counts(plan.user_id)
     plan.is_draft = True
     plan.is_control = plan.is_sent = plan.is_error = plan.is_approved = False
     plan.afch = False
@@ -1318,6 +1188,7 @@ def handle_control_status(plan):
     ) # № п/п = 5
     
     if indicator_usage and indicator_usage.QYearNext != 0:
+        invalidate_status_counts(plan.user_id)
         plan.is_control = True
         plan.is_draft = plan.is_sent = plan.is_error = plan.is_approved = False
         plan.afch = False
@@ -1328,6 +1199,7 @@ def handle_control_status(plan):
 def handle_sent_status(plan):
     if plan.audit_time and (current_utc_time() - plan.audit_time) > timedelta(hours=1):
         return {"error": "Нельзя изменить статус: прошло больше допустимого времени"}
+    invalidate_status_counts(plan.user_id)
     plan.sent_time = current_utc_time()
     plan.is_sent = True
     plan.is_draft = plan.is_control = plan.is_error = plan.is_approved = False
@@ -1335,18 +1207,16 @@ def handle_sent_status(plan):
     return "План отправлен."
 
 def handle_error_status(plan):
+    invalidate_status_counts(plan.user_id)
     plan.audit_time = current_utc_time()
     plan.is_error = True
     plan.is_draft = plan.is_control = plan.is_sent = plan.is_approved = False
 
-    notification = Notification(
-        user_id=plan.user_id,
-        message=f"В плане на {plan.year} год нашли ошибки"
-    )
-    db.session.add(notification)
+    notify(plan.user_id, f"В плане на {plan.year} год нашли ошибки")
     return "Статус ошибки установлен."
 
 def handle_approved_status(plan):
+    invalidate_status_counts(plan.user_id)
     plan.audit_time = current_utc_time()
     plan.is_approved = True
     plan.is_draft = plan.is_control = plan.is_sent = plan.is_error = False
@@ -1359,11 +1229,7 @@ def handle_approved_status(plan):
     )
     db.session.add(new_ticket)
 
-    notification = Notification(
-        user_id=plan.user_id,
-        message=f"План на {plan.year} год был утверждён"
-    )
-    db.session.add(notification)
+    notify(plan.user_id, f"План на {plan.year} год был утверждён")
     return "План утверждён"
 
 
@@ -1380,7 +1246,7 @@ status_handlers = {
 @login_required
 @owner_only
 def api_change_plan_status(id):
-    plan = Plan.query.get_or_404(id)
+    plan = g.current_plan
     
     if request.is_json:
         data = request.get_json()
@@ -1421,7 +1287,13 @@ def api_change_plan_status(id):
     
     if status in status_handlers:
         try:
+            was_approved = plan.is_approved
+            previous_status = plan_status(plan)
             result = status_handlers[status](plan)
+            # отклоненный переход и повторная установка того же статуса сводки не меняют;
+            # суммы пересчитываются при входе плана в утвержденные и выходе из них
+            if plan_status(plan) != previous_status:
+                refresh_plan_rollups(plan, sums=was_approved or plan.is_approved)
             db.session.commit()
 
             if isinstance(result, dict) and "error" in result:
@@ -1450,9 +1322,7 @@ def api_change_plan_status(id):
 @login_required
 @owner_only
 def create_ticket(id):
-    plan = Plan.query.filter_by(
-        id=id
-    ).first()
+    plan = g.current_plan
     plan.afch = True
 
     note = request.form.get('note')
@@ -1487,25 +1357,51 @@ def begin_page():
             active_tab = 'begin'
             )
 
+@views.route('/api/rollups/<int:year>', methods=['GET'])
+@user_with_all_params()
+@login_required
+def api_rollups(year):
+    """Сводные показатели утвержденных планов подведомственных организаций"""
+    from .plans.rollups import get_rollup, user_rollup_scope
+    scope = user_rollup_scope(current_user)
+    if scope is None:
+        return jsonify({'error': 'Сводные данные недоступны'}), 403
+    return jsonify(get_rollup(scope[0], scope[1], year))
+
+@views.route('/api/stats/<int:year>', methods=['GET'])
+@user_with_all_params()
+@login_required
+def api_stats(year):
+    """Данные страницы статистики из предрасчитанных сводок"""
+    from .plans.rollups import user_rollup_scope
+    from .plans.stats import get_stats
+    scope = user_rollup_scope(current_user)
+    if scope is None:
+        return jsonify({'error': 'Статистика недоступна'}), 403
+    return jsonify(get_stats(scope[0], scope[1], year))
+
 @views.route('/api/notifications', methods=['GET'])
 @user_with_all_params()
 @login_required
 def api_notifications():
-    notifications = Notification.query.filter_by(user_id=current_user.id).order_by(Notification.created_at.desc()).all()
-    return jsonify([
-        {
-            'id': n.id,
-            'message': n.message,
-            'is_read': n.is_read,
-            'created_at': n.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        }
-        for n in notifications
-    ])
+    since = request.args.get('since', type=int)
+    has_more = False
+    if since is not None:
+        notifications, has_more = notifications_since(current_user.id, since)
+        next_cursor = None
+    else:
+        notifications, next_cursor = notifications_page(current_user.id, request.args.get('cursor'))
+    return jsonify({
+        'items': [serialize_notification(n) for n in notifications],
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+        'unread': unread_count(current_user.id),
+    })
 
 @views.route('/api/notifications/mark-all-read', methods=['POST'])
 @user_with_all_params()
 @login_required
 def mark_all_notifications_read():
-    Notification.query.filter_by(user_id=current_user.id, is_read=False).update({'is_read': True})
+    mark_all_read(current_user.id)
     db.session.commit()
     return jsonify({'message': 'Все уведомления отмечены как прочитанные'})
\ No newline at end of file